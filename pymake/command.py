@@ -11,7 +11,7 @@ except when a submake specifies -j1 when the parent make is building in parallel
 
 import os, subprocess, sys, logging, time, traceback, re
 from optparse import OptionParser
-from . import data, parserdata, process, util
+from . import data, parser, parserdata, process, util, jobhistory, sysload
 from pymake import errors
 
 from pymake import makeyaml
@@ -64,6 +64,32 @@ def parsemakeflags(env):
 
     return opts
 
+def _optionaljobs(args, op):
+    """
+    Give -j and --jobs without a number the number 0, meaning as many jobs as there are
+    usable CPUs. optparse has no options with optional values. -j may also end a group
+    of short options, such as -kj, which the OptionParser `op` would otherwise give the
+    next argument to.
+    """
+    result = []
+    for i, a in enumerate(args):
+        nonumber = i + 1 == len(args) or not args[i + 1].isdigit()
+        if a in ('-j', '--jobs'):
+            if nonumber:
+                a = '-j0'
+        elif a.startswith('-') and not a.startswith('--') and a.endswith('j') and nonumber:
+            # the j is only an option if none of the options before it take a value
+            for j in range(1, len(a)):
+                o = op.get_option('-' + a[j])
+                if o is None:
+                    break
+                if o.takes_value():
+                    if j == len(a) - 1 and o.get_opt_string() == '--jobs':
+                        a += '0'
+                    break
+        result.append(a)
+    return result
+
 def _version(*args):
     print("""pymake: GNU-compatible make program
 Copyright (C) 2009 The Mozilla Foundation <http://www.mozilla.org/>
@@ -155,11 +181,50 @@ class _MakeContext(object):
             self.realtargets = self.targets
             self.tstack = ['<command-line>']
 
+        if self.options.prefetchmtimes:
+            self.makefile.prefetchmtimes(self.realtargets, self.options.prefetchmtimes)
+
+        if self.options.parallelgoals and self.makefile.context.jcount > 1:
+            # build every goal at once; makecb is called when all of them are done
+            self.goalsremaining = len(self.realtargets)
+            self.goalerror = False
+            self.goaldidanything = False
+            for t in self.realtargets:
+                self.context.defer(self.startgoal, t)
+            self.realtargets = []
+            return
+
         self.makefile.gettarget(self.realtargets.pop(0)).make(self.makefile, self.tstack, cb=self.makecb)
 
+    def startgoal(self, t):
+        if self.goalerror and not self.options.keepgoing:
+            self.goalcb(True, False)
+        else:
+            self.makefile.gettarget(t).make(self.makefile, self.tstack, cb=self.goalcb)
+
+    def goalcb(self, error, didanything):
+        assert error in (True, False)
+
+        if error:
+            self.goalerror = True
+        if didanything:
+            self.goaldidanything = True
+
+        self.goalsremaining -= 1
+        if self.goalsremaining == 0:
+            self.makecb(self.goalerror, self.goaldidanything)
+
     def makecb(self, error, didanything):
         assert error in (True, False)
 
+        if error or not len(self.realtargets):
+            if data.jobhistory is not None:
+                data.jobhistory.save()
+
+            counts = process.commandcounts
+            _log.debug("make.py[%i]: commands run directly: %i, as chains: %i, through a shell: %i, native: %i",
+                       self.makelevel, counts['direct'], counts['chain'], counts['shell'], counts['native'])
+
         if error:
             self.context.defer(self.cb, 2)
             return
@@ -202,6 +267,14 @@ def main(args, env, cwd, cb):
                       dest="printversion", default=False)
         op.add_option('-j', '--jobs', type="int",
                       dest="jobcount", default=1)
+        op.add_option('-l', '--load-average', '--max-load', type="float",
+                      dest="maxload", default=None)
+        op.add_option('--adaptive-jobs', action="store_true",
+                      dest="adaptivejobs", default=False)
+        op.add_option('--no-parallel-goals', action="store_false",
+                      dest="parallelgoals", default=True)
+        op.add_option('--jobserver-auth', '--jobserver-fds',
+                      dest="jobserverauth", default=None)
         op.add_option('-w', '--print-directory', action="store_true",
                       dest="printdir")
         op.add_option('--no-print-directory', action="store_false",
@@ -211,6 +284,22 @@ def main(args, env, cwd, cb):
         op.add_option('-n', '--just-print', '--dry-run', '--recon',
                       action="store_true",
                       dest="justprint", default=False)
+        op.add_option('--parse-cache',
+                      dest="parsecache", default=None)
+        op.add_option('--prefetch-includes', type="int",
+                      dest="prefetchjobs", default=0)
+        op.add_option('--deps-db',
+                      dest="depsdb", default=None)
+        op.add_option('--memoize-variables', action="store_true",
+                      dest="memoizevariables", default=False)
+        op.add_option('--trust-stat-cache', action="store_true",
+                      dest="truststatcache", default=False)
+        op.add_option('--prefetch-mtimes', type="int",
+                      dest="prefetchmtimes", default=0)
+        op.add_option('--job-history',
+                      dest="jobhistory", default=None)
+        op.add_option('--shell-pool', action="store_true",
+                      dest="shellpool", default=False)
         op.add_option('-y', '--yaml-out',
                       action="store_true",
                       dest="yamlout", default=False)
@@ -219,8 +308,8 @@ def main(args, env, cwd, cb):
                       default=[],
                       action='append')
 
-        options, arguments1 = op.parse_args(parsemakeflags(env))
-        options, arguments2 = op.parse_args(args, values=options)
+        options, arguments1 = op.parse_args(_optionaljobs(parsemakeflags(env), op))
+        options, arguments2 = op.parse_args(_optionaljobs(args, op), values=options)
 
         op.destroy()
 
@@ -265,9 +354,79 @@ def main(args, env, cwd, cb):
         else:
             workdir = util.normaljoin(cwd, options.directory)
 
+        if options.jobcount == 0:
+            options.jobcount = sysload.usablecpus()
+
+        jobserverauth = process.setjobserver(options.jobserverauth, options.jobcount)
+        if jobserverauth is None and options.jobserverauth is not None:
+            print("make.py[%i]: jobserver unavailable: using -j1. Add '+' to parent make rule." % (makelevel,), file=sys.stderr)
+            options.jobcount = 1
+
         if options.jobcount != 1:
             longflags.append('-j%i' % (options.jobcount,))
 
+        if jobserverauth is not None:
+            longflags.append('--jobserver-auth=%s' % (jobserverauth,))
+
+        if options.maxload is not None or options.adaptivejobs:
+            process.loadthrottle = sysload.LoadThrottle(options.maxload, options.adaptivejobs)
+        else:
+            process.loadthrottle = None
+
+        if options.maxload is not None:
+            longflags.append('-l%g' % (options.maxload,))
+
+        if options.adaptivejobs:
+            longflags.append('--adaptive-jobs')
+
+        if not options.parallelgoals:
+            longflags.append('--no-parallel-goals')
+
+        if options.parsecache is not None:
+            # make the path absolute so that submakes in other directories share the cache
+            parsecachedir = util.normaljoin(workdir, options.parsecache)
+            parser.setparsecache(parsecachedir)
+            longflags.append('--parse-cache=%s' % parsecachedir)
+        else:
+            parser.setparsecache(None)
+
+        if options.depsdb is not None:
+            depsdbpath = util.normaljoin(workdir, options.depsdb)
+            parser.setdepsdb(depsdbpath)
+            longflags.append('--deps-db=%s' % depsdbpath)
+        else:
+            parser.setdepsdb(None)
+
+        parser.setprefetcher(options.prefetchjobs)
+        if options.prefetchjobs:
+            longflags.append('--prefetch-includes=%i' % (options.prefetchjobs,))
+
+        data.memoizevariables = options.memoizevariables
+        if options.memoizevariables:
+            longflags.append('--memoize-variables')
+
+        # a make run in this process by another one can't rely on what that make cached,
+        # since the commands run before it may have changed any file
+        data.statcache.forget()
+        data.statcache.trust = options.truststatcache
+        if options.truststatcache:
+            longflags.append('--trust-stat-cache')
+
+        if options.prefetchmtimes:
+            longflags.append('--prefetch-mtimes=%i' % (options.prefetchmtimes,))
+
+        if options.jobhistory is not None:
+            jobhistorypath = util.normaljoin(workdir, options.jobhistory)
+            if data.jobhistory is None or data.jobhistory.path != jobhistorypath:
+                data.jobhistory = jobhistory.JobHistory(jobhistorypath)
+            longflags.append('--job-history=%s' % jobhistorypath)
+        else:
+            data.jobhistory = None
+
+        process.setshellpool(options.shellpool, options.jobcount)
+        if options.shellpool:
+            longflags.append('--shell-pool')
+
         makeflags = ''.join(shortflags)
         if len(longflags):
             makeflags += ' ' + ' '.join(longflags)
@@ -2,8 +2,9 @@
 A representation of makefile data structures.
 """
 
-import logging, re, os, sys
-from functools import reduce
+import logging, re, os, sys, time
+from functools import reduce, lru_cache
+from concurrent import futures
 from . import parserdata, parser, functions, process, util, implicit
 from . import globrelative
 from pymake import errors
@@ -42,12 +43,91 @@ def mtimeislater(deptime, targettime):
     # int(1000*x) because of http://bugs.python.org/issue10148
     return int(1000 * deptime) > int(1000 * targettime)
 
+_NOTCACHED = object()
+
+class StatCache(object):
+    """
+    The modification times of files, keyed on absolute path, so that each file is only
+    stat()ed once while nothing is being remade. The cache belongs to the process, so it is
+    shared by remakemakefiles, the main build and submakes run in the same process.
+
+    When commands run, they may change any file, so the whole cache is forgotten. With
+    `trust`, only the targets pymake remade are forgotten, and everything else is assumed
+    to stay the same until the end of the run, or until a submake starts in this process.
+    """
+
+    def __init__(self):
+        self._mtimes = {} # path -> st_mtime_ns, or None if it doesn't exist
+        self.trust = False
+        self.hits = 0
+        self.misses = 0
+
+    def getmtime(self, path):
+        mtime_ns = self._mtimes.get(path, _NOTCACHED)
+        if mtime_ns is _NOTCACHED:
+            self.misses += 1
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+            except OSError:
+                mtime_ns = None
+            self._mtimes[path] = mtime_ns
+        else:
+            self.hits += 1
+
+        if mtime_ns is None:
+            return None
+        return mtime_ns / 1e9
+
+    def prefetch(self, paths, jobs):
+        """
+        stat() the files at `paths` which aren't cached yet, in batches on `jobs` threads.
+        stat() releases the GIL, so on slow filesystems this is much quicker than stat()ing
+        them one at a time.
+        """
+        paths = [p for p in set(paths) if p not in self._mtimes]
+        if not len(paths):
+            return
+
+        batches = [paths[i:i + _statbatchsize] for i in range(0, len(paths), _statbatchsize)]
+        with futures.ThreadPoolExecutor(jobs) as executor:
+            for batch, mtimes in zip(batches, executor.map(_statmtimes, batches)):
+                self._mtimes.update(zip(batch, mtimes))
+                self.misses += len(batch)
+
+    def filesmodified(self, path=None):
+        """
+        Called after pymake ran commands, which remade the file at `path` if it is given.
+        """
+        if not self.trust:
+            self._mtimes.clear()
+        elif path is not None:
+            self._mtimes.pop(path, None)
+
+    def forget(self):
+        """
+        Forget every cached mtime, even with `trust`.
+        """
+        self._mtimes.clear()
+
+_statbatchsize = 64
+
+def _statmtimes(paths):
+    mtimes = []
+    for path in paths:
+        try:
+            mtimes.append(os.stat(path).st_mtime_ns)
+        except OSError:
+            mtimes.append(None)
+    return mtimes
+
+statcache = StatCache()
+
+# the jobhistory.JobHistory which times the commands of remade targets, and gives
+# them their priority, or None
+jobhistory = None
+
 def getmtime(path):
-    try:
-        s = os.stat(path)
-        return s.st_mtime
-    except OSError:
-        return None
+    return statcache.getmtime(path)
 
 def stripdotslash(s):
     if s.startswith('./'):
@@ -156,6 +236,12 @@ class StringExpansion(BaseExpansion):
     def rstrip(self):
         self.s = self.s.rstrip()
 
+    def removesuffix(self, suffix):
+        if not self.s.endswith(suffix):
+            return False
+        self.s = self.s[:-len(suffix)]
+        return True
+
     def isempty(self):
         return self.s == ''
 
@@ -206,6 +292,13 @@ class StringExpansion(BaseExpansion):
         return s
 
 
+# Expansions are compiled into Python functions (see Expansion.compile) the second time
+# they are resolved. This can be turned off to compare performance.
+compileexpansions = True
+
+# marks an Expansion which has been resolved once, but not compiled yet
+_RESOLVEDONCE = object()
+
 class Expansion(BaseExpansion, list):
     """A representation of expanded data.
 
@@ -214,13 +307,18 @@ class Expansion(BaseExpansion, list):
     the same context in a make file.
     """
 
-    __slots__ = ('loc',)
+    __slots__ = ('loc', '_compiled')
     simple = False
 
     def __init__(self, loc=None):
         # A list of (element, isfunc) tuples
         # element is either a string or a function
         self.loc = loc
+        self._compiled = None
+
+    def __reduce__(self):
+        # compiled functions can't be pickled
+        return (Expansion, (self.loc,), None, iter(self))
 
     @staticmethod
     def fromstring(s, path):
@@ -236,10 +334,12 @@ class Expansion(BaseExpansion, list):
         if s == '':
             return
 
+        self._compiled = None
         self.append((s, False))
 
     def appendfunc(self, func):
         assert isinstance(func, functions.Function)
+        self._compiled = None
         self.append((func, True))
 
     def concat(self, o):
@@ -247,6 +347,7 @@ class Expansion(BaseExpansion, list):
         if o.simple:
             self.appendstr(o.s)
         else:
+            self._compiled = None
             self.extend(o)
 
     def isempty(self):
@@ -254,6 +355,7 @@ class Expansion(BaseExpansion, list):
 
     def lstrip(self):
         """Strip leading literal whitespace from this expansion."""
+        self._compiled = None
         while True:
             i, isfunc = self[0]
             if isfunc:
@@ -268,6 +370,7 @@ class Expansion(BaseExpansion, list):
 
     def rstrip(self):
         """Strip trailing literal whitespace from this expansion."""
+        self._compiled = None
         while True:
             i, isfunc = self[-1]
             if isfunc:
@@ -280,6 +383,23 @@ class Expansion(BaseExpansion, list):
 
             del self[-1]
 
+    def removesuffix(self, suffix):
+        """Remove a literal `suffix` from the end of this expansion, returning whether it was there."""
+        if not len(self):
+            return False
+
+        i, isfunc = self[-1]
+        if isfunc or not i.endswith(suffix):
+            return False
+
+        self._compiled = None
+        i = i[:-len(suffix)]
+        if i == '':
+            del self[-1]
+        else:
+            self[-1] = i, False
+        return True
+
     def finish(self):
         # Merge any adjacent literal strings:
         strings = []
@@ -305,6 +425,7 @@ class Expansion(BaseExpansion, list):
                 elements.append((s, False))
 
         if len(elements) < len(self):
+            self._compiled = None
             self[:] = elements
 
         return self
@@ -318,10 +439,21 @@ class Expansion(BaseExpansion, list):
                being set, if any. Setting variables must avoid self-referential
                loops.
         """
+        compiled = self._compiled
+        if compiled is not None:
+            if compiled is _RESOLVEDONCE:
+                compiled = self._compiled = self.compile()
+            fd.write(compiled(makefile, variables, setting))
+            return
+
         assert isinstance(makefile, Makefile)
         assert isinstance(variables, Variables)
         assert isinstance(setting, list)
 
+        # compiling only pays off for expansions which are resolved again
+        if compileexpansions:
+            self._compiled = _RESOLVEDONCE
+
         for e, isfunc in self:
             if isfunc:
                 e.resolve(makefile, variables, fd, setting)
@@ -330,10 +462,67 @@ class Expansion(BaseExpansion, list):
                 fd.write(e)
 
     def resolvestr(self, makefile, variables, setting=[]):
+        compiled = self._compiled
+        if compiled is not None and compiled is not _RESOLVEDONCE:
+            return compiled(makefile, variables, setting)
+
         fd = StringIO()
         self.resolve(makefile, variables, fd, setting)
         return fd.getvalue()
 
+    def compile(self):
+        """
+        Compile this expansion into a function(makefile, variables, setting) which returns the
+        same string as resolvestr. Adjacent literal strings are joined, and each function is
+        compiled with Function.compile.
+        """
+        parts = []
+        for e, isfunc in self:
+            if isfunc:
+                parts.append(e.compile())
+            elif len(parts) and isinstance(parts[-1], str_type):
+                parts[-1] += e
+            else:
+                parts.append(e)
+
+        if len(parts) == 0:
+            return _resolveempty
+
+        if len(parts) == 1:
+            p, = parts
+            if not isinstance(p, str_type):
+                return p
+
+            def resolvestatic(makefile, variables, setting):
+                return p
+            return resolvestatic
+
+        if len(parts) == 2:
+            a, b = parts
+            if isinstance(a, str_type):
+                def resolvestrfunc(makefile, variables, setting):
+                    return a + b(makefile, variables, setting)
+                return resolvestrfunc
+
+            if isinstance(b, str_type):
+                def resolvefuncstr(makefile, variables, setting):
+                    return a(makefile, variables, setting) + b
+                return resolvefuncstr
+
+            def resolvefuncfunc(makefile, variables, setting):
+                return a(makefile, variables, setting) + b(makefile, variables, setting)
+            return resolvefuncfunc
+
+        template = [p if isinstance(p, str_type) else None for p in parts]
+        calls = [(i, p) for i, p in enumerate(parts) if not isinstance(p, str_type)]
+
+        def resolveparts(makefile, variables, setting):
+            r = template[:]
+            for i, f in calls:
+                r[i] = f(makefile, variables, setting)
+            return ''.join(r)
+        return resolveparts
+
     def resolvesplit(self, makefile, variables, setting=[]):
         return self.resolvestr(makefile, variables, setting).split()
 
@@ -349,11 +538,13 @@ class Expansion(BaseExpansion, list):
 
     def functions(self, descend=False):
         for e, is_func in self:
-            if is_func:
-                yield e
+            if not is_func:
+                continue
+
+            yield e
 
             if descend:
-                for exp in e.expansions(descend=True):
+                for exp in e.expansions():
                     for f in exp.functions(descend=True):
                         yield f
 
@@ -422,13 +613,63 @@ class Expansion(BaseExpansion, list):
     def __ne__(self, other):
         return not self.__eq__(other)
 
+def _resolveempty(makefile, variables, setting):
+    return ''
+
+# The resolved values of recursively-expanded variables can be remembered between
+# references (see Variables.resolvevariable). Off by default.
+memoizevariables = False
+
+class _VariableReads(object):
+    """
+    The names of the variables read while resolving a variable, and whether anything
+    which can't be memoized was involved.
+    """
+
+    __slots__ = ('names', 'memoizable')
+
+    def __init__(self):
+        self.names = set()
+        self.memoizable = True
+
+# _VariableReads being recorded by Variables.resolvevariable, innermost last
+_recording = []
+
+_MEMOIZABLE = object()
+_NOTMEMOIZABLE = object()
+
+def _ismemoizable(exp):
+    """
+    Whether the result of resolving `exp` only depends on variables: it doesn't run the
+    shell, look at the filesystem, or have side effects.
+    """
+    if exp.is_shell_dependent or exp.is_filesystem_dependent:
+        return False
+
+    for f in exp.functions(descend=True):
+        if isinstance(f, (functions.EvalFunction, functions.InfoFunction,
+                          functions.WarningFunction, functions.ErrorFunction)):
+            return False
+
+    return True
+
+@lru_cache(maxsize=8192)
+def _literalexpansion(name, s):
+    """
+    The expansion of the value `s` of the simply-expanded variable `name`. Automatic
+    variables are set for every rule executed, often to the same values, so these are
+    shared.
+    """
+    return Expansion.fromstring(s, "Expansion of variable '%s'" % (name,))
+
 class Variables(object):
     """
     A mapping from variable names to variables. Variables have flavor, source, and value. The value is an 
-    expansion object.
+    expansion object. Values of simply-expanded variables are StringExpansions made when they are set;
+    values of recursively-expanded variables are parsed the first time they are expanded.
     """
 
-    __slots__ = ('parent', '_map')
+    __slots__ = ('parent', '_map', 'version', '_versions', '_memo')
 
     FLAVOR_RECURSIVE = 0
     FLAVOR_SIMPLE = 1
@@ -445,6 +686,11 @@ class Variables(object):
         self._map = {} # vname -> flavor, source, valuestr, valueexp
         self.parent = parent
 
+        # incremented whenever a variable in this scope is modified
+        self.version = 0
+        self._versions = {} # vname -> version when it was last modified
+        self._memo = {} # vname -> _MEMOIZABLE, _NOTMEMOIZABLE or (value, ((vname, versions), ...))
+
     def readfromenvironment(self, env):
         for k, v in env.items():
             self.set(k, self.FLAVOR_RECURSIVE, self.SOURCE_ENVIRONMENT, v)
@@ -459,11 +705,18 @@ class Variables(object):
         it will be returned as an unexpanded string.
         """
         flavor, source, valuestr, valueexp = self._map.get(name, (None, None, None, None))
+        if _recording:
+            _recording[-1].names.add(name)
+
         if flavor is not None:
-            if expand and flavor != self.FLAVOR_SIMPLE and valueexp is None:
-                d = parser.Data.fromstring(valuestr, parserdata.Location("Expansion of variables '%s'" % (name,), 1, 0))
-                valueexp, t, o = parser.parsemakesyntax(d, 0, (), parser.iterdata)
-                self._map[name] = flavor, source, valuestr, valueexp
+            if expand and flavor != self.FLAVOR_SIMPLE:
+                if valueexp is None:
+                    d = parser.Data.fromstring(valuestr, parserdata.Location("Expansion of variables '%s'" % (name,), 1, 0))
+                    valueexp, t, o = parser.parsemakesyntax(d, 0, (), parser.iterdata)
+                    self._map[name] = flavor, source, valuestr, valueexp
+
+                if _recording and not self._memoizable(name, valueexp):
+                    _recording[-1].memoizable = False
 
             if flavor == self.FLAVOR_APPEND:
                 if self.parent:
@@ -491,30 +744,117 @@ class Variables(object):
             if not expand:
                 return flavor, source, valuestr
 
-            if flavor == self.FLAVOR_RECURSIVE:
-                val = valueexp
-            else:
-                val = Expansion.fromstring(valuestr, "Expansion of variable '%s'" % (name,))
-
-            return flavor, source, val
+            return flavor, source, valueexp
 
         if self.parent is not None:
             return self.parent.get(name, expand)
 
         return (None, None, None)
 
+    def resolvevariable(self, name, makefile, setting):
+        """
+        Resolve a reference to the variable `name`. Returns None if the variable is not set.
+
+        The result for a recursively-expanded variable is remembered in the scope which
+        defines it, along with the versions of the variables read to compute it. It is
+        reused while none of those have been modified, or hidden by a variable in a scope
+        between this one and the defining one.
+        """
+        scope = self
+        while name not in scope._map:
+            scope = scope.parent
+            if scope is None:
+                if _recording:
+                    _recording[-1].names.add(name)
+                return None
+
+        if scope._map[name][0] == self.FLAVOR_RECURSIVE:
+            memo = scope._memo.get(name)
+            if type(memo) is tuple:
+                value, reads = memo
+                if self._canreuse(scope, reads, setting):
+                    if _recording:
+                        names = _recording[-1].names
+                        names.add(name)
+                        names.update([n for n, versions in reads])
+                    return value
+
+        flavor, source, value = self.get(name)
+        if flavor != self.FLAVOR_RECURSIVE or not scope._memoizable(name, value):
+            return value.resolvestr(makefile, self, setting + [name])
+
+        reads = _VariableReads()
+        _recording.append(reads)
+        try:
+            value = value.resolvestr(makefile, self, setting + [name])
+        finally:
+            _recording.pop()
+
+        if _recording:
+            outer = _recording[-1]
+            outer.names.update(reads.names)
+            if not reads.memoizable:
+                outer.memoizable = False
+
+        if reads.memoizable and not self._hides(scope, reads.names):
+            scope._memo[name] = value, tuple([(n, scope._versionsof(n)) for n in reads.names])
+
+        return value
+
+    def _memoizable(self, name, valueexp):
+        memo = self._memo.get(name)
+        if memo is None:
+            memo = _MEMOIZABLE if _ismemoizable(valueexp) else _NOTMEMOIZABLE
+            self._memo[name] = memo
+        return memo is not _NOTMEMOIZABLE
+
+    def _versionsof(self, name):
+        versions = []
+        v = self
+        while v is not None:
+            versions.append(v._versions.get(name))
+            v = v.parent
+        return tuple(versions)
+
+    def _hides(self, scope, names):
+        """
+        Whether any of `names` is defined in a scope between this one and `scope`.
+        """
+        v = self
+        while v is not scope:
+            if not v._map.keys().isdisjoint(names):
+                return True
+            v = v.parent
+        return False
+
+    def _canreuse(self, scope, reads, setting):
+        for n, versions in reads:
+            if n in setting or scope._versionsof(n) != versions:
+                return False
+
+        return self is scope or not self._hides(scope, [n for n, versions in reads])
+
+    def _modified(self, name):
+        self.version += 1
+        self._versions[name] = self.version
+        self._memo.pop(name, None)
+
     def set(self, name, flavor, source, value, force=False):
         assert flavor in (self.FLAVOR_RECURSIVE, self.FLAVOR_SIMPLE)
         assert source in (self.SOURCE_OVERRIDE, self.SOURCE_COMMANDLINE, self.SOURCE_MAKEFILE, self.SOURCE_ENVIRONMENT, self.SOURCE_AUTOMATIC, self.SOURCE_IMPLICIT)
         assert isinstance(value, str_type), "expected str, got %s" % type(value)
 
-        prevflavor, prevsource, prevvalue = self.get(name)
+        prevflavor, prevsource, prevvalue = self.get(name, expand=False)
         if prevsource is not None and source > prevsource and not force:
             # TODO: give a location for this warning
             _log.info("not setting variable '%s', set by higher-priority source to value '%s'" % (name, prevvalue))
             return
 
-        self._map[name] = flavor, source, value, None
+        if flavor == self.FLAVOR_SIMPLE:
+            self._map[name] = flavor, source, value, _literalexpansion(name, value)
+        else:
+            self._map[name] = flavor, source, value, None
+        self._modified(name)
 
     def append(self, name, source, value, variables, makefile):
         assert source in (self.SOURCE_OVERRIDE, self.SOURCE_MAKEFILE, self.SOURCE_AUTOMATIC)
@@ -522,6 +862,7 @@ class Variables(object):
 
         if name not in self._map:
             self._map[name] = self.FLAVOR_APPEND, source, value, None
+            self._modified(name)
             return
 
         prevflavor, prevsource, prevvalue, valueexp = self._map[name]
@@ -533,12 +874,14 @@ class Variables(object):
             d = parser.Data.fromstring(value, parserdata.Location("Expansion of variables '%s'" % (name,), 1, 0))
             valueexp, t, o = parser.parsemakesyntax(d, 0, (), parser.iterdata)
 
-            val = valueexp.resolvestr(makefile, variables, [name])
-            self._map[name] = prevflavor, prevsource, prevvalue + ' ' + val, None
+            newvalue = prevvalue + ' ' + valueexp.resolvestr(makefile, variables, [name])
+            self._map[name] = prevflavor, prevsource, newvalue, _literalexpansion(name, newvalue)
+            self._modified(name)
             return
 
         newvalue = prevvalue + ' ' + value
         self._map[name] = prevflavor, prevsource, newvalue, None
+        self._modified(name)
 
     def merge(self, other):
         assert isinstance(other, Variables)
@@ -798,17 +1141,19 @@ class RemakeTargetParallel(object):
 
 class RemakeRuleContext(object):
     def __init__(self, target, makefile, rule, deps,
-                 targetstack, avoidremakeloop):
+                 targetstack, avoidremakeloop, orderonly=()):
         self.target = target
         self.makefile = makefile
         self.rule = rule
         self.deps = deps
+        # order-only prerequisites are made first, but their mtimes are never compared
+        self.orderonly = [(t, False) for t in orderonly]
         self.targetstack = targetstack
         self.avoidremakeloop = avoidremakeloop
 
         self.running = False
         self.error = False
-        self.depsremaining = len(deps) + 1
+        self.depsremaining = len(deps) + len(self.orderonly) + 1
         self.remake = False
 
     def resolvedeps(self, serial, cb):
@@ -844,7 +1189,7 @@ class RemakeRuleContext(object):
             self.resolvecb(error=self.error, didanything=self.didanything)
 
     def _resolvedepsserial(self):
-        self.resolvelist = list(self.deps)
+        self.resolvelist = self.deps + self.orderonly
         self._depfinishedserial(False, False)
 
     def _startdepparallel(self, d):
@@ -884,21 +1229,44 @@ class RemakeRuleContext(object):
 
         self.didanything = False
 
-        for d in self.deps:
+        for d in self.deps + self.orderonly:
             self.makefile.context.defer(self._startdepparallel, d)
 
     def _commandcb(self, error):
         assert error in (True, False)
 
+        if self.command is not None:
+            self.elapsed += self.command.elapsed
+
         if error:
             self.runcb(error=True)
             return
 
         if len(self.commands):
-            self.commands.pop(0)(self._commandcb)
+            self.command = self.commands.pop(0)
+            self.command(self._commandcb)
         else:
+            if jobhistory is not None and self.command is not None and not self.makefile.justprint:
+                jobhistory.record(self._historykey(self.target.target), self.elapsed)
             self.runcb(error=False)
 
+    def _groupfinished(self, error):
+        self.rule.group.finish(self.makefile, self.target, error)
+        self.groupcb(error=error)
+
+    def _historykey(self, target):
+        return util.normaljoin(self.makefile.workdir, target)
+
+    def _setpriority(self):
+        """
+        Queue the commands ahead of those with less work left behind them: the targets
+        on the stack are waiting for this one.
+        """
+        priority = jobhistory.remaining(self._historykey(self.target.target),
+                                        [self._historykey(t) for t in self.targetstack])
+        for c in self.commands:
+            c.priority = priority
+
     def runcommands(self, indent, cb):
         assert not self.running
         self.running = True
@@ -919,6 +1287,17 @@ class RemakeRuleContext(object):
             cb(error=False)
             return
 
+        group = self.rule.group
+        if group is not None and group.state != MAKESTATE_NONE:
+            _log.info("%sNot remaking %s: the commands of its group at %s made it.", indent, self.target.target, self.rule.loc)
+            self.target.beingremade()
+            self.target.didanything = True
+            if group.state == MAKESTATE_WORKING:
+                group.callbacks.append(cb)
+            else:
+                cb(error=group.error)
+            return
+
         if self.rule.doublecolon:
             if len(self.deps) == 0:
                 if self.avoidremakeloop:
@@ -958,6 +1337,16 @@ class RemakeRuleContext(object):
                 cb(error=True)
                 return
 
+            if group is not None:
+                # the other targets of the group wait for these commands
+                group.state = MAKESTATE_WORKING
+                self.groupcb = cb
+                self.runcb = self._groupfinished
+
+            self.command = None
+            self.elapsed = 0
+            if jobhistory is not None:
+                self._setpriority()
             self._commandcb(False)
         else:
             cb(error=False)
@@ -1030,9 +1419,10 @@ class Target(object):
 
         candidates = [] # list of PatternRuleInstance
 
-        hasmatch = util.any((r.hasspecificmatch(file) for r in makefile.implicitrules))
+        rules = makefile.implicitrulesfor(dir + file)
+        hasmatch = util.any((r.hasspecificmatch(file) for r in rules))
 
-        for r in makefile.implicitrules:
+        for r in rules:
             if r in rulestack:
                 _log.info("%s %s: Avoiding implicit rule recursion", indent, r.loc)
                 continue
@@ -1047,7 +1437,7 @@ class Target(object):
 
         for r in candidates:
             depfailed = None
-            for p in r.prerequisites:
+            for p in r.prerequisites + r.orderonly:
                 t = makefile.gettarget(p)
                 t.resolvevpath(makefile)
                 if not t.explicit and t.mtime is None:
@@ -1069,13 +1459,23 @@ class Target(object):
 
         for r in newcandidates:
             newrulestack = rulestack + [r.prule]
+            rulestackkey = tuple([id(rule) for rule in newrulestack])
 
             depfailed = None
-            for p in r.prerequisites:
+            for p in r.prerequisites + r.orderonly:
+                if (p, rulestackkey) in makefile.failedchains:
+                    depfailed = p
+                    break
+
                 t = makefile.gettarget(p)
+                recursionerrors = makefile.recursionerrors
                 try:
                     t.resolvedeps(makefile, targetstack, newrulestack, True)
                 except errors.ResolutionError:
+                    # Unless the failure came from a recursive dependency, it doesn't depend
+                    # on targetstack, and sibling targets would fail the same way.
+                    if makefile.recursionerrors == recursionerrors:
+                        makefile.failedchains.add((p, rulestackkey))
                     depfailed = p
                     break
 
@@ -1112,6 +1512,7 @@ class Target(object):
         assert makefile.parsingfinished
 
         if self.target in targetstack:
+            makefile.recursionerrors += 1
             raise errors.ResolutionError("Recursive dependency: %s -> %s" % (
                     " -> ".join(targetstack), self.target))
 
@@ -1147,7 +1548,7 @@ class Target(object):
         if recursive:
             for r in self.rules:
                 newrulestack = rulestack + [r]
-                for d in r.prerequisites:
+                for d in r.prerequisites + r.orderonly:
                     dt = makefile.gettarget(d)
                     if dt.explicit:
                         continue
@@ -1194,12 +1595,12 @@ class Target(object):
                     self.mtime = None
                     return
 
-        search = [self.target]
-        if not os.path.isabs(self.target):
-            search += [util.normaljoin(dir, self.target).replace('\\', '/')
-                       for dir in makefile.getvpath(self.target)]
+        targetandtime = self.searchinlocs(makefile, [self.target])
+        if targetandtime is None and not os.path.isabs(self.target):
+            vpathtarget = makefile.findinvpath(self.target)
+            if vpathtarget is not None:
+                targetandtime = self.searchinlocs(makefile, [vpathtarget])
 
-        targetandtime = self.searchinlocs(makefile, search)
         if targetandtime is not None:
             (self.vpathtarget, self.mtime) = targetandtime
             return
@@ -1229,15 +1630,25 @@ class Target(object):
         self.vpathtarget = self.target
         self.wasremade = True
 
+    def refreshmtime(self, makefile):
+        """
+        Resolve the mtime again after we were remade.
+        """
+        statcache.filesmodified(util.normaljoin(makefile.workdir, self.target).replace('\\', '/'))
+        targetandtime = self.searchinlocs(makefile, [self.target])
+        if targetandtime is not None:
+            (_, self.mtime) = targetandtime
+        else:
+            self.mtime = None
+
+        # a missing prerequisite may exist now
+        makefile.failedchains.clear()
+        globrelative.dircache.invalidate()
+
     def notifydone(self, makefile):
         assert self._state == MAKESTATE_WORKING, "State was %s" % self._state
-        # If we were remade then resolve mtime again
         if self.wasremade:
-            targetandtime = self.searchinlocs(makefile, [self.target])
-            if targetandtime is not None:
-                (_, self.mtime) = targetandtime
-            else:
-                self.mtime = None
+            self.refreshmtime(makefile)
 
         self._state = MAKESTATE_FINISHED
         for cb in self._callbacks:
@@ -1299,13 +1710,18 @@ class Target(object):
             return
 
         if self.isdoublecolon():
-            rulelist = [RemakeRuleContext(self, makefile, r, [(makefile.gettarget(p), False) for p in r.prerequisites], targetstack, avoidremakeloop) for r in self.rules]
+            rulelist = [RemakeRuleContext(self, makefile, r, [(makefile.gettarget(p), False) for p in r.prerequisites], targetstack, avoidremakeloop,
+                                          getorderonly(makefile, r.prerequisites, r.orderonly)) for r in self.rules]
         else:
             alldeps = []
+            prereqs = []
+            orderonly = []
 
             commandrule = None
             for r in self.rules:
                 rdeps = [(makefile.gettarget(p), r.weakdeps) for p in r.prerequisites]
+                prereqs.extend(r.prerequisites)
+                orderonly.extend(r.orderonly)
                 if len(r.commands):
                     assert commandrule is None
                     commandrule = r
@@ -1315,7 +1731,8 @@ class Target(object):
                 else:
                     alldeps.extend(rdeps)
 
-            rulelist = [RemakeRuleContext(self, makefile, commandrule, alldeps, targetstack, avoidremakeloop)]
+            rulelist = [RemakeRuleContext(self, makefile, commandrule, alldeps, targetstack, avoidremakeloop,
+                                          getorderonly(makefile, prereqs, orderonly))]
 
         targetstack = targetstack + [self.target]
 
@@ -1324,6 +1741,12 @@ class Target(object):
         else:
             RemakeTargetParallel(self, makefile, indent, rulelist)
 
+def getorderonly(makefile, prerequisites, orderonly):
+    """
+    Get the targets of the order-only prerequisites which aren't also normal prerequisites.
+    """
+    return [makefile.gettarget(p) for p in withoutdups(orderonly) if p not in prerequisites]
+
 def dirpart(p):
     d, s, f = util.strrpartition(p, '/')
     if d == '':
@@ -1340,7 +1763,7 @@ def setautomatic(v, name, plist):
     v.set(name + 'D', Variables.FLAVOR_SIMPLE, Variables.SOURCE_AUTOMATIC, ' '.join((dirpart(p) for p in plist)))
     v.set(name + 'F', Variables.FLAVOR_SIMPLE, Variables.SOURCE_AUTOMATIC, ' '.join((filepart(p) for p in plist)))
 
-def setautomaticvariables(v, makefile, target, prerequisites):
+def setautomaticvariables(v, makefile, target, prerequisites, orderonly=()):
     prtargets = [makefile.gettarget(p) for p in prerequisites]
     prall = [pt.vpathtarget for pt in prtargets]
     proutofdate = [pt.vpathtarget for pt in withoutdups(prtargets)
@@ -1353,6 +1776,8 @@ def setautomaticvariables(v, makefile, target, prerequisites):
     setautomatic(v, '?', proutofdate)
     setautomatic(v, '^', list(withoutdups(prall)))
     setautomatic(v, '+', prall)
+    setautomatic(v, '|', [makefile.gettarget(p).vpathtarget for p in withoutdups(orderonly)
+                          if p not in prerequisites])
 
 def splitcommand(command):
     """
@@ -1390,6 +1815,16 @@ def findmodifiers(command):
     modset = set(command[:-len(realcommand)])
     return realcommand, '@' in modset, '+' in modset, '-' in modset, '%' in modset
 
+def _runsmake(c, makefile, variables):
+    """
+    Whether the command expansion `c` references $(MAKE), which makes its lines recursive
+    commands, like those starting with +.
+    """
+    for f in c.variable_references(descend=True):
+        if f.vname.is_static_string and f.vname.resolvestr(makefile, variables) == 'MAKE':
+            return True
+    return False
+
 class _CommandWrapper(object):
     def __init__(self, cline, ignoreErrors, loc, context, **kwargs):
         self.ignoreErrors = ignoreErrors
@@ -1397,8 +1832,21 @@ class _CommandWrapper(object):
         self.cline = cline
         self.kwargs = kwargs
         self.context = context
+        self.priority = 0
+        self.elapsed = 0
 
     def _cb(self, res):
+        # commands run by the context are timed from when they start; other commands
+        # (submakes run in this process) from when they were called
+        if self.job is not None:
+            self.elapsed = self.job.elapsed
+        else:
+            self.elapsed = time.time() - self.called
+
+        # the command may have changed any file
+        statcache.filesmodified()
+        globrelative.dircache.invalidate()
+
         if res != 0 and not self.ignoreErrors:
             print("%s: command '%s' failed, return code %i" % (self.loc, self.cline, res))
             self.usercb(error=True)
@@ -1407,7 +1855,10 @@ class _CommandWrapper(object):
 
     def __call__(self, cb):
         self.usercb = cb
-        process.call(self.cline, loc=self.loc, cb=self._cb, context=self.context, **self.kwargs)
+        self.job = None
+        self.called = time.time()
+        self.job = process.call(self.cline, loc=self.loc, cb=self._cb, context=self.context,
+                                priority=self.priority, **self.kwargs)
 
 class _NativeWrapper(_CommandWrapper):
     def __init__(self, cline, ignoreErrors, loc, context,
@@ -1431,51 +1882,102 @@ class _NativeWrapper(_CommandWrapper):
         method = parts[1]
         cline_list = parts[2:]
         self.usercb = cb
-        process.call_native(module, method, cline_list,
-                            loc=self.loc, cb=self._cb, context=self.context,
-                            pycommandpath=self.pycommandpath, **self.kwargs)
+        self.job = None
+        self.called = time.time()
+        self.job = process.call_native(module, method, cline_list,
+                                       loc=self.loc, cb=self._cb, context=self.context,
+                                       pycommandpath=self.pycommandpath, priority=self.priority,
+                                       **self.kwargs)
+
+def _makecommand(makefile, v, env, loc, cline, isHidden, ignoreErrors, isNative, isRecursive=False):
+    if (isHidden or makefile.silent) and not makefile.justprint:
+        echo = None
+    else:
+        echo = "%s$ %s" % (loc, cline)
+    if not isNative:
+        return _CommandWrapper(cline, ignoreErrors=ignoreErrors, env=env, cwd=makefile.workdir, loc=loc, context=makefile.context,
+                               echo=echo, justprint=makefile.justprint, yamlout=makefile.yamlout, yamlin=makefile.yamlin,
+                               recursive=isRecursive)
+
+    f, s, e = v.get("PYCOMMANDPATH", True)
+    if e:
+        e = e.resolvestr(makefile, v, ["PYCOMMANDPATH"])
+    return _NativeWrapper(cline, ignoreErrors=ignoreErrors,
+                          env=env, cwd=makefile.workdir,
+                          loc=loc, context=makefile.context,
+                          echo=echo, justprint=makefile.justprint,
+                          pycommandpath=e, yamlout=makefile.yamlout, yamlin=makefile.yamlin)
+
+def _getoneshellcommands(makefile, v, env, clines):
+    """
+    With .ONESHELL, the lines of a recipe are run by a single shell. As in GNU make with
+    a POSIX shell, the modifiers of the first line apply to the whole recipe, and those of
+    the other lines are removed. A native command can't be part of a shell script, so it
+    runs on its own, between the scripts of the lines before and after it.
+    """
+    isHidden = ignoreErrors = False
+    scriptloc = None
+    script = []
+    scriptRecursive = False
+    for i, (loc, cline, runsmake) in enumerate(clines):
+        cline, hidden, isRecursive, ignore, isNative = findmodifiers(cline)
+        if i == 0:
+            isHidden, ignoreErrors = hidden, ignore
+
+        if isNative:
+            if len(script):
+                yield _makecommand(makefile, v, env, scriptloc, '\n'.join(script), isHidden, ignoreErrors, False,
+                                   scriptRecursive)
+                script = []
+                scriptRecursive = False
+            yield _makecommand(makefile, v, env, loc, cline, isHidden, ignoreErrors, True)
+        else:
+            if not len(script):
+                scriptloc = loc
+            script.append(cline)
+            scriptRecursive = scriptRecursive or isRecursive or runsmake
+
+    if len(script):
+        yield _makecommand(makefile, v, env, scriptloc, '\n'.join(script), isHidden, ignoreErrors, False,
+                           scriptRecursive)
 
-def getcommandsforrule(rule, target, makefile, prerequisites, stem):
+def getcommandsforrule(rule, target, makefile, prerequisites, stem, orderonly=()):
     v = Variables(parent=target.variables)
-    setautomaticvariables(v, makefile, target, prerequisites)
+    setautomaticvariables(v, makefile, target, prerequisites, orderonly)
     if stem is not None:
         setautomatic(v, '*', [stem])
 
     env = makefile.getsubenvironment(v)
 
+    if makefile.oneshell:
+        clines = [(c.loc, cline, _runsmake(c, makefile, v)) for c in rule.commands for cline in splitcommand(c.resolvestr(makefile, v))]
+        for command in _getoneshellcommands(makefile, v, env, clines):
+            yield command
+        return
+
     for c in rule.commands:
         cstring = c.resolvestr(makefile, v)
+        runsmake = _runsmake(c, makefile, v)
         for cline in splitcommand(cstring):
             cline, isHidden, isRecursive, ignoreErrors, isNative = findmodifiers(cline)
-            if (isHidden or makefile.silent) and not makefile.justprint:
-                echo = None
-            else:
-                echo = "%s$ %s" % (c.loc, cline)
-            if not isNative:
-                yield _CommandWrapper(cline, ignoreErrors=ignoreErrors, env=env, cwd=makefile.workdir, loc=c.loc, context=makefile.context,
-                                      echo=echo, justprint=makefile.justprint, yamlout=makefile.yamlout, yamlin=makefile.yamlin)
-            else:
-                f, s, e = v.get("PYCOMMANDPATH", True)
-                if e:
-                    e = e.resolvestr(makefile, v, ["PYCOMMANDPATH"])
-                yield _NativeWrapper(cline, ignoreErrors=ignoreErrors,
-                                     env=env, cwd=makefile.workdir,
-                                     loc=c.loc, context=makefile.context,
-                                     echo=echo, justprint=makefile.justprint,
-                                     pycommandpath=e, yamlout=makefile.yamlout, yamlin=makefile.yamlin)
+            yield _makecommand(makefile, v, env, c.loc, cline, isHidden, ignoreErrors, isNative,
+                               isRecursive or runsmake)
 
 class Rule(object):
     """
     A rule contains a list of prerequisites and a list of commands. It may also
     contain rule-specific variables. This rule may be associated with multiple targets.
+    The targets of a grouped rule share the RuleGroup `group`.
     """
 
-    def __init__(self, prereqs, doublecolon, loc, weakdeps):
+    def __init__(self, prereqs, doublecolon, loc, weakdeps, orderonly=(), group=None):
         self.prerequisites = prereqs
+        self.orderonly = list(orderonly)
         self.doublecolon = doublecolon
         self.commands = []
         self.loc = loc
         self.weakdeps = weakdeps
+        self.group = group
 
     def addcommand(self, c):
         assert isinstance(c, (Expansion, StringExpansion))
@@ -1488,6 +1990,8 @@ class Rule(object):
         # https://www.gnu.org/software/make/manual/make.html#Multiple-Targets.
         prereqs = []
         prereqs.extend(self.prerequisites)
+        orderonly = []
+        orderonly.extend(self.orderonly)
 
         if not self.doublecolon:
             for rule in target.rules:
@@ -1495,10 +1999,47 @@ class Rule(object):
                 # we don't need to add it again.
                 if rule != self:
                     prereqs.extend(rule.prerequisites)
+                    orderonly.extend(rule.orderonly)
 
-        return getcommandsforrule(self, target, makefile, prereqs, stem=None)
+        return getcommandsforrule(self, target, makefile, prereqs, stem=None, orderonly=orderonly)
         # TODO: $* in non-pattern rules?
 
+class RuleGroup(object):
+    """
+    The targets of a grouped rule (`a b &: c`). Its commands make every target in the
+    group, so they are run at most once: the targets made after the first take the result
+    of that run.
+    """
+
+    def __init__(self, targets):
+        self.targets = targets
+        self.state = MAKESTATE_NONE
+        self.error = False
+        self.callbacks = []
+
+    def finish(self, makefile, target, error):
+        """
+        The commands which made `target` for the group have finished.
+        """
+        assert self.state == MAKESTATE_WORKING
+        self.state = MAKESTATE_FINISHED
+        self.error = error
+
+        for t in self.targets:
+            if t == target.target:
+                continue
+            member = makefile.gettarget(t)
+            if member._state == MAKESTATE_FINISHED:
+                # found up to date before the commands ran
+                member.beingremade()
+                member.refreshmtime(makefile)
+            else:
+                statcache.filesmodified(util.normaljoin(makefile.workdir, t).replace('\\', '/'))
+
+        for cb in self.callbacks:
+            makefile.context.defer(cb, error=error)
+        del self.callbacks
+
 class PatternRuleInstance(object):
     weakdeps = False
 
@@ -1513,14 +2054,17 @@ class PatternRuleInstance(object):
         self.stem = stem
         self.prule = prule
         self.prerequisites = prule.prerequisitesforstem(dir, stem)
+        self.orderonly = prule.orderonlyforstem(dir, stem)
         self.doublecolon = prule.doublecolon
         self.loc = prule.loc
         self.ismatchany = ismatchany
         self.commands = prule.commands
+        self.group = prule.group
 
     def getcommands(self, target, makefile):
         assert isinstance(target, Target)
-        return getcommandsforrule(self, target, makefile, self.prerequisites, stem=self.dir + self.stem)
+        return getcommandsforrule(self, target, makefile, self.prerequisites, stem=self.dir + self.stem,
+                                  orderonly=self.orderonly)
 
     def __str__(self):
         return "Pattern rule at %s with stem '%s', matchany: %s doublecolon: %s" % (self.loc,
@@ -1531,15 +2075,17 @@ class PatternRuleInstance(object):
 class PatternRule(object):
     """
     An implicit rule or static pattern rule containing target patterns, prerequisite patterns,
-    and a list of commands.
+    and a list of commands. A grouped static pattern rule has a RuleGroup `group`.
     """
 
-    def __init__(self, targetpatterns, prerequisites, doublecolon, loc):
+    def __init__(self, targetpatterns, prerequisites, doublecolon, loc, orderonly=(), group=None):
         self.targetpatterns = targetpatterns
         self.prerequisites = prerequisites
+        self.orderonly = list(orderonly)
         self.doublecolon = doublecolon
         self.loc = loc
         self.commands = []
+        self.group = group
 
     def addcommand(self, c):
         assert isinstance(c, (Expansion, StringExpansion))
@@ -1580,6 +2126,48 @@ class PatternRule(object):
     def prerequisitesforstem(self, dir, stem):
         return [p.resolve(dir, stem) for p in self.prerequisites]
 
+    def orderonlyforstem(self, dir, stem):
+        return [p.resolve(dir, stem) for p in self.orderonly]
+
+class PatternRuleIndex(object):
+    """
+    An index of the target patterns of a list of pattern rules, to find the rules which might
+    match a file name without matching every pattern against it. Patterns are bucketed on
+    their literal text after the '%'; match-anything rules are kept on a separate list.
+    """
+
+    def __init__(self, rules):
+        self.rules = rules
+        self._bysuffix = {} # suffix -> [rule number, ...]
+        self._matchany = []
+
+        for i, r in enumerate(rules):
+            for p in r.targetpatterns:
+                if p.ismatchany():
+                    if not len(self._matchany) or self._matchany[-1] != i:
+                        self._matchany.append(i)
+                else:
+                    self._bysuffix.setdefault(p.data[-1], []).append(i)
+
+        self._suffixlengths = sorted(set((len(suffix) for suffix in self._bysuffix)))
+
+    def candidates(self, word):
+        """
+        Return the rules, in definition order, which have a target pattern that may match
+        `word` or any trailing part of it.
+        """
+        found = set(self._matchany)
+        wlen = len(word)
+        for l in self._suffixlengths:
+            if l > wlen:
+                break
+
+            rules = self._bysuffix.get(word[wlen - l:])
+            if rules is not None:
+                found.update(rules)
+
+        return [self.rules[i] for i in sorted(found)]
+
 class _RemakeContext(object):
     def __init__(self, makefile, cb):
         self.makefile = makefile
@@ -1643,8 +2231,14 @@ class Makefile(object):
         self.justprint = justprint
         self.yamlout = yamlout
         self.yamlin = yamlin
+        self.oneshell = False
         self._patternvariables = [] # of (pattern, variables)
         self.implicitrules = []
+        self._implicitruleindex = None
+
+        # (prerequisite, ids of the rule stack) which implicit rule chaining failed to resolve
+        self.failedchains = set()
+        self.recursionerrors = 0
         self.parsingfinished = False
 
         self._patternvpaths = [] # of (pattern, [dir, ...])
@@ -1699,7 +2293,7 @@ class Makefile(object):
         if there isn't already a default target.
         """
         flavor, source, value = self.variables.get('.DEFAULT_GOAL')
-        if self.defaulttarget is None and t != '.PHONY' and value is None:
+        if self.defaulttarget is None and t not in ('.PHONY', '.ONESHELL') and value is None:
             self.defaulttarget = t
             self.variables.set('.DEFAULT_GOAL', Variables.FLAVOR_SIMPLE,
                                Variables.SOURCE_AUTOMATIC, t)
@@ -1742,6 +2336,16 @@ class Makefile(object):
     def appendimplicitrule(self, rule):
         assert isinstance(rule, PatternRule)
         self.implicitrules.append(rule)
+        self._implicitruleindex = None
+
+    def implicitrulesfor(self, target):
+        """
+        Return the implicit rules which might have a target pattern matching `target` or its
+        file name part, in definition order.
+        """
+        if self._implicitruleindex is None:
+            self._implicitruleindex = PatternRuleIndex(self.implicitrules)
+        return self._implicitruleindex.candidates(target)
 
     def finishparsing(self):
         """
@@ -1752,6 +2356,9 @@ class Makefile(object):
         """
         self.parsingfinished = True
 
+        # every dependency file has been read by now
+        parser.savedepsdb()
+
         flavor, source, value = self.variables.get('GPATH')
         if value is not None and value.resolvestr(self, self.variables, ['GPATH']).strip() != '':
             raise errors.DataError('GPATH was set: pymake does not support GPATH semantics')
@@ -1769,13 +2376,15 @@ class Makefile(object):
         for t in targets:
             t.explicit = True
             for r in t.rules:
-                for p in r.prerequisites:
+                for p in r.prerequisites + r.orderonly:
                     self.gettarget(p).explicit = True
 
         np = self.gettarget('.NOTPARALLEL')
         if len(np.rules):
             self.context = process.getcontext(1)
 
+        self.oneshell = len(self.gettarget('.ONESHELL').rules) > 0
+
         flavor, source, value = self.variables.get('.DEFAULT_GOAL')
         if value is not None:
             self.defaulttarget = value.resolvestr(self, self.variables, ['.DEFAULT_GOAL']).strip()
@@ -1798,9 +2407,12 @@ class Makefile(object):
                     stmts = parser.parsedepfile(fspath)
                 else:
                     stmts = parser.parsefile(fspath)
+                    parser.prefetchincludes(stmts, self)
                 self.variables.append('MAKEFILE_LIST', Variables.SOURCE_AUTOMATIC, path, None, self)
                 stmts.execute(self, weak=weak)
                 self.gettarget(path).explicit = True
+            elif weak:
+                parser.forgetdepfile(fspath)
 
 
     def includeyaml(self, path, required=True, weak=False, loc=None):
@@ -1856,6 +2468,63 @@ class Makefile(object):
 
         return withoutdups(vp)
 
+    def prefetchmtimes(self, goals, jobs):
+        """
+        Before making `goals`, stat() every file they depend on through explicit rules, on
+        `jobs` threads, so that resolving them finds the mtimes in the stat cache. Without
+        statcache.trust, the cache is forgotten as soon as a command runs.
+        """
+        if not statcache.trust:
+            _log.info("Prefetched mtimes are only kept until a command runs; see --trust-stat-cache")
+
+        phony = set()
+        for r in self.gettarget('.PHONY').rules:
+            phony.update(r.prerequisites)
+
+        paths = []
+        seen = set()
+        stack = list(goals)
+        while len(stack):
+            name = stack.pop()
+            if name in seen:
+                continue
+            seen.add(name)
+
+            if name not in phony:
+                paths.append(util.normaljoin(self.workdir, name).replace('\\', '/'))
+
+            t = self._targets.get(name)
+            if t is not None:
+                for r in t.rules:
+                    stack.extend(r.prerequisites)
+                    stack.extend(r.orderonly)
+
+        _log.info("Prefetching the mtimes of %i files", len(paths))
+        statcache.prefetch(paths, jobs)
+
+    def findinvpath(self, target):
+        """
+        Return the first path to `target` through the vpath directories which exists, or None.
+        Directories are looked up in the listings kept by globrelative.dircache, instead of
+        stat()ing the target in each of them. Once commands have run, the listings are
+        stale, and the target is stat()ed in the directories rather than listing them all
+        again after every command.
+        """
+        leaf = os.path.basename(target)
+        special = leaf in ('', '.', '..')
+        leaf = os.path.normcase(leaf)
+        for vpdir in self.getvpath(target):
+            path = util.normaljoin(vpdir, target).replace('\\', '/')
+            fspath = util.normaljoin(self.workdir, path)
+            fsdir = os.path.dirname(fspath)
+            if special or not globrelative.dircache.isfresh(fsdir):
+                if getmtime(fspath) is not None:
+                    return path
+            elif leaf in globrelative.dircache.names(fsdir):
+                return path
+
+        return None
+
     def remakemakefiles(self, cb):
         mlist = []
         for f, required in self.included:
@@ -0,0 +1,215 @@
+"""
+A consolidated database of dependency files, in the spirit of ninja's .ninja_deps.
+
+Compilers write one small .d file per object, and a build including thousands of them
+spends most of a no-op run opening and reading them. The database keeps the dependency
+lines of every .d file it has seen in a single file, which is loaded with one mmap. A
+record is only used while the size and modification time of its .d file still match;
+otherwise the .d file is read again and the database is rewritten.
+
+Makes sharing the database, such as recursive makes, each write it when they are done.
+The records they read are merged into the database as it is on disk at that time, under
+a lock, so none of them are lost. Records are only checked against the filesystem when
+they are looked up, so a save doesn't stat every .d file in the database; records for .d
+files which a make found missing are dropped.
+
+File layout (little-endian):
+
+  header: 8 byte magic, uint32 version, uint32 record count
+  record: int64 mtime_ns, int64 size, uint32 path length, uint32 body length,
+          path (utf-8), body (utf-8, the joined dependency lines separated by newlines)
+"""
+
+import os, mmap, struct, tempfile, logging
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+_log = logging.getLogger('pymake.depsdb')
+
+MAGIC = b'pymkdeps'
+VERSION = 1
+
+_header = struct.Struct('<8sII')
+_record = struct.Struct('<qqII')
+
+def _encode(s):
+    return s.encode('utf-8', 'surrogateescape')
+
+def _decode(b):
+    return b.decode('utf-8', 'surrogateescape')
+
+def _read(path):
+    """
+    Map the database at `path`, and return the map and an index of its records, keyed on
+    the path of the .d file: (mtime_ns, size, body offset, body length). The map is
+    None if the database doesn't exist or can't be used.
+    """
+    try:
+        with open(path, 'rb') as fd:
+            if os.fstat(fd.fileno()).st_size < _header.size:
+                return None, {}
+            m = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+    except OSError as e:
+        _log.debug("Not using dependency database '%s': %s", path, e)
+        return None, {}
+
+    try:
+        magic, version, count = _header.unpack_from(m, 0)
+        if magic != MAGIC or version != VERSION:
+            _log.debug("Dependency database '%s' has an unknown format", path)
+            return None, {}
+
+        index = {}
+        offset = _header.size
+        for i in range(0, count):
+            mtime_ns, size, pathlen, bodylen = _record.unpack_from(m, offset)
+            offset += _record.size
+            dpath = _decode(m[offset:offset + pathlen])
+            offset += pathlen
+            if offset + bodylen > len(m):
+                raise struct.error("record extends past the end of the file")
+            index[dpath] = (mtime_ns, size, offset, bodylen)
+            offset += bodylen
+    except struct.error as e:
+        _log.debug("Dependency database '%s' is corrupt: %s", path, e)
+        return None, {}
+
+    return m, index
+
+class _Lock(object):
+    """
+    An exclusive lock on the file `path`, where fcntl is available.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._fd is not None:
+            os.close(self._fd) # releases the lock
+            self._fd = None
+
+class DepsDB(object):
+    """
+    The dependency database stored at `path`. Records are keyed on the real path of
+    the .d file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._map = None
+        self._index = None # .d path -> (mtime_ns, size, body offset, body length)
+        self._new = {} # .d path -> (mtime_ns, size, body) read from .d files this time
+        self._gone = set() # .d paths with a record whose file was found missing
+
+        self.hits = 0
+        self.misses = 0
+
+    def _load(self):
+        self._map, self._index = _read(self.path)
+
+    def getlines(self, depfile, readfunc):
+        """
+        Get the dependency lines of the .d file at real path `depfile`, using readfunc(depfile)
+        to read them when the database doesn't have an up-to-date record.
+        """
+        if self._index is None:
+            self._load()
+
+        st = os.stat(depfile)
+
+        new = self._new.get(depfile)
+        if new is not None and new[:2] == (st.st_mtime_ns, st.st_size):
+            self.hits += 1
+            return new[2].split('\n') if new[2] else []
+
+        record = self._index.get(depfile)
+        if record is not None and record[:2] == (st.st_mtime_ns, st.st_size):
+            self.hits += 1
+            mtime_ns, size, offset, length = record
+            body = _decode(self._map[offset:offset + length])
+            return body.split('\n') if body else []
+
+        self.misses += 1
+        lines = readfunc(depfile)
+        self._new[depfile] = (st.st_mtime_ns, st.st_size, '\n'.join(lines))
+        self._gone.discard(depfile)
+        return lines
+
+    def forget(self, depfile):
+        """
+        Drop the record of the .d file at real path `depfile`, which doesn't exist, on the
+        next save.
+        """
+        if self._index is None:
+            self._load()
+
+        self._new.pop(depfile, None)
+        if depfile in self._index:
+            self._gone.add(depfile)
+
+    def save(self):
+        """
+        Merge the .d files read and dropped since the last save into the database, if there
+        are any. The new file is renamed into place, so concurrent readers always see a complete
+        database.
+        """
+        if not self._new and not self._gone:
+            return
+
+        try:
+            with _Lock(self.path + '.lock'):
+                self._write()
+        except OSError as e:
+            _log.warning("Couldn't write dependency database '%s': %s", self.path, e)
+            return
+
+        # what is on disk is now the up-to-date contents of the database
+        self._map = None
+        self._index = None
+        self._new = {}
+        self._gone = set()
+
+    def _write(self):
+        m, index = _read(self.path)
+
+        records = []
+        for path, (mtime_ns, size, offset, length) in index.items():
+            if path in self._new or path in self._gone:
+                continue
+            records.append((path, mtime_ns, size, m[offset:offset + length]))
+        for path, (mtime_ns, size, body) in self._new.items():
+            records.append((path, mtime_ns, size, _encode(body)))
+
+        if m is not None:
+            m.close()
+
+        directory = os.path.dirname(self.path) or '.'
+        fd, tmppath = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix='.depsdb')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(_header.pack(MAGIC, VERSION, len(records)))
+                for path, mtime_ns, size, body in records:
+                    path = _encode(path)
+                    f.write(_record.pack(mtime_ns, size, len(path), len(body)))
+                    f.write(path)
+                    f.write(body)
+            os.replace(tmppath, self.path)
+        except OSError:
+            try:
+                os.unlink(tmppath)
+            except OSError:
+                pass
+            raise
+
+        _log.debug("Wrote %i records to dependency database '%s'", len(records), self.path)
@@ -5,7 +5,8 @@ Makefile functions.
 
 from . import parser, util
 import subprocess, os, logging, sys
-from .globrelative import glob
+from io import StringIO
+from .globrelative import glob, dircache
 from pymake import errors
 
 log = logging.getLogger('pymake.data')
@@ -60,6 +61,20 @@ class Function(object):
         assert isinstance(arg, (data.Expansion, data.StringExpansion))
         self._arguments.append(arg)
 
+    def compile(self):
+        """
+        Return a function(makefile, variables, setting) which returns the value of this
+        function call as a string. This is used by data.Expansion.compile; functions on
+        hot paths override it with a specialized version.
+        """
+        resolve = self.resolve
+
+        def resolvefunction(makefile, variables, setting):
+            fd = StringIO()
+            resolve(makefile, variables, fd, setting)
+            return fd.getvalue()
+        return resolvefunction
+
     def to_source(self):
         """Convert the function back to make file "source" code."""
         if not hasattr(self, 'name'):
@@ -178,6 +193,15 @@ class VariableRef(Function):
         if vname in setting:
             raise errors.DataError("Setting variable '%s' recursively references itself." % (vname,), self.loc)
 
+        if data.memoizevariables:
+            value = variables.resolvevariable(vname, makefile, setting)
+            if value is None:
+                log.debug("%s: variable '%s' was not set" % (self.loc, vname))
+                return
+
+            fd.write(value)
+            return
+
         flavor, source, value = variables.get(vname)
         if value is None:
             log.debug("%s: variable '%s' was not set" % (self.loc, vname))
@@ -185,6 +209,37 @@ class VariableRef(Function):
 
         value.resolve(makefile, variables, fd, setting + [vname])
 
+    def compile(self):
+        vname = self.vname
+        if not isinstance(vname, data.StringExpansion):
+            return Function.compile(self)
+
+        loc = self.loc
+
+        def resolvevariable(makefile, variables, setting):
+            name = vname.s
+            if name in setting:
+                raise errors.DataError("Setting variable '%s' recursively references itself." % (name,), loc)
+
+            if data.memoizevariables:
+                value = variables.resolvevariable(name, makefile, setting)
+                if value is None:
+                    log.debug("%s: variable '%s' was not set", loc, name)
+                    return ''
+                return value
+
+            flavor, source, value = variables.get(name)
+            if value is None:
+                log.debug("%s: variable '%s' was not set", loc, name)
+                return ''
+
+            # simply-expanded values are already resolved
+            if value.simple:
+                return value.s
+
+            return value.resolvestr(makefile, variables, setting + [name])
+        return resolvevariable
+
     def to_source(self):
         if isinstance(self.vname, data.StringExpansion):
             if self.vname.s in self.AUTOMATIC_VARIABLES:
@@ -206,6 +261,95 @@ class VariableRef(Function):
 
         return self.vname == other.vname
 
+class _PatSubster(object):
+    """
+    Substitutes patterns in a list of words, like data.Pattern.subst, remembering the
+    patterns it parsed last time.
+    """
+
+    __slots__ = ('pattern', 'replacement', 'p', 'r')
+
+    def __init__(self):
+        self.pattern = None
+        self.replacement = None
+
+    def __call__(self, pattern, replacement, words):
+        if pattern != self.pattern:
+            self.p = data.Pattern(pattern)
+            self.pattern = pattern
+        if replacement != self.replacement:
+            self.r = data.Pattern(replacement)
+            self.replacement = replacement
+
+        p = self.p
+        if not p.ispattern():
+            # if we're not a pattern, the replacement is not parsed as a pattern either
+            match, = p.data
+            return ' '.join([replacement if w == match else w for w in words])
+
+        prefix, suffix = p.data
+        lp = len(prefix)
+        ls = len(suffix)
+        minlen = lp + ls
+
+        r = self.r
+        if r.ispattern():
+            rprefix, rsuffix = r.data
+        else:
+            rprefix, rsuffix = None, r.data[0]
+
+        if rprefix is None:
+            return ' '.join([rsuffix if len(w) >= minlen and w.startswith(prefix) and w.endswith(suffix) else w
+                             for w in words])
+
+        return ' '.join([rprefix + w[lp:len(w) - ls] + rsuffix
+                         if len(w) >= minlen and w.startswith(prefix) and w.endswith(suffix) else w
+                         for w in words])
+
+class _WordMatcher(object):
+    """
+    Returns a function telling whether a word matches any of the patterns in a string, like
+    data.Pattern.match, remembering the patterns it parsed last time.
+    """
+
+    __slots__ = ('patterns', 'match')
+
+    def __init__(self):
+        self.patterns = None
+
+    def __call__(self, patterns):
+        if patterns == self.patterns:
+            return self.match
+
+        exact = set()
+        affixes = []
+        for p in patterns.split():
+            p = data.Pattern(p)
+            if p.ispattern():
+                prefix, suffix = p.data
+                affixes.append((prefix, suffix, len(prefix) + len(suffix)))
+            else:
+                exact.add(p.data[0])
+
+        if not len(affixes):
+            match = exact.__contains__
+        elif len(affixes) == 1 and not len(exact):
+            (prefix, suffix, minlen), = affixes
+            def match(w):
+                return len(w) >= minlen and w.startswith(prefix) and w.endswith(suffix)
+        else:
+            def match(w):
+                if w in exact:
+                    return True
+                for prefix, suffix, minlen in affixes:
+                    if len(w) >= minlen and w.startswith(prefix) and w.endswith(suffix):
+                        return True
+                return False
+
+        self.patterns = patterns
+        self.match = match
+        return match
+
 class SubstitutionRef(Function):
     """$(VARNAME:.c=.o) and $(VARNAME:%.c=%.o)"""
 
@@ -228,8 +372,18 @@ class SubstitutionRef(Function):
         substfrom = self.substfrom.resolvestr(makefile, variables, setting)
         substto = self.substto.resolvestr(makefile, variables, setting)
 
-        flavor, source, value = variables.get(vname)
-        if value is None:
+        if data.memoizevariables:
+            words = variables.resolvevariable(vname, makefile, setting)
+            if words is not None:
+                words = words.split()
+        else:
+            flavor, source, value = variables.get(vname)
+            if value is not None:
+                words = value.resolvesplit(makefile, variables, setting + [vname])
+            else:
+                words = None
+
+        if words is None:
             log.debug("%s: variable '%s' was not set" % (self.loc, vname))
             return
 
@@ -239,7 +393,37 @@ class SubstitutionRef(Function):
             substto = '%' + substto
 
         fd.write(' '.join([f.subst(substto, word, False)
-                           for word in value.resolvesplit(makefile, variables, setting + [vname])]))
+                           for word in words]))
+
+    def compile(self):
+        vname, substfrom, substto, loc = self.vname, self.substfrom, self.substto, self.loc
+        patsubst = _PatSubster()
+
+        def resolvesubstitution(makefile, variables, setting):
+            name = vname.resolvestr(makefile, variables, setting)
+            if name in setting:
+                raise errors.DataError("Setting variable '%s' recursively references itself." % (name,), loc)
+
+            f = substfrom.resolvestr(makefile, variables, setting)
+            t = substto.resolvestr(makefile, variables, setting)
+
+            if data.memoizevariables:
+                value = variables.resolvevariable(name, makefile, setting)
+            else:
+                flavor, source, value = variables.get(name)
+                if value is not None:
+                    value = value.resolvestr(makefile, variables, setting + [name])
+
+            if value is None:
+                log.debug("%s: variable '%s' was not set", loc, name)
+                return ''
+
+            if not data.Pattern(f).ispattern():
+                f = '%' + f
+                t = '%' + t
+
+            return patsubst(f, t, value.split())
+        return resolvesubstitution
 
     def to_source(self):
         return '$(%s:%s=%s)' % (
@@ -290,6 +474,16 @@ class PatSubstFunction(Function):
         fd.write(' '.join([p.subst(r, word, False)
                            for word in self._arguments[2].resolvesplit(makefile, variables, setting)]))
 
+    def compile(self):
+        pattern, replacement, text = self._arguments
+        patsubst = _PatSubster()
+
+        def resolvepatsubst(makefile, variables, setting):
+            return patsubst(pattern.resolvestr(makefile, variables, setting),
+                            replacement.resolvestr(makefile, variables, setting),
+                            text.resolvesplit(makefile, variables, setting))
+        return resolvepatsubst
+
 class StripFunction(Function):
     name = 'strip'
     minargs = 1
@@ -328,6 +522,15 @@ class FilterFunction(Function):
         fd.write(' '.join([w for w in self._arguments[1].resolvesplit(makefile, variables, setting)
                            if util.any((p.match(w) for p in plist))]))
 
+    def compile(self):
+        patterns, text = self._arguments
+        matcher = _WordMatcher()
+
+        def resolvefilter(makefile, variables, setting):
+            match = matcher(patterns.resolvestr(makefile, variables, setting))
+            return ' '.join([w for w in text.resolvesplit(makefile, variables, setting) if match(w)])
+        return resolvefilter
+
 class FilteroutFunction(Function):
     name = 'filter-out'
     minargs = 2
@@ -517,6 +720,28 @@ class AddPrefixFunction(Function):
 
         fd.write(' '.join([prefix + w for w in self._arguments[1].resolvesplit(makefile, variables, setting)]))
 
+    def compile(self):
+        prefix, text = self._arguments
+
+        if text.is_static_string:
+            words = text.resolvesplit(None, None)
+            if prefix.is_static_string:
+                value = ' '.join([prefix.resolvestr(None, None) + w for w in words])
+
+                def resolvestaticaddprefix(makefile, variables, setting):
+                    return value
+                return resolvestaticaddprefix
+
+            def resolveaddprefixwords(makefile, variables, setting):
+                p = prefix.resolvestr(makefile, variables, setting)
+                return ' '.join([p + w for w in words])
+            return resolveaddprefixwords
+
+        def resolveaddprefix(makefile, variables, setting):
+            p = prefix.resolvestr(makefile, variables, setting)
+            return ' '.join([p + w for w in text.resolvesplit(makefile, variables, setting)])
+        return resolveaddprefix
+
 class JoinFunction(Function):
     name = 'join'
     minargs = 2
@@ -793,6 +1018,10 @@ class ShellFunction(Function):
             os.environ['PATH'] = oldpath
 
         stdout, stderr = p.communicate()
+        # the command may have created files
+        dircache.invalidate()
+        data.statcache.filesmodified()
+
         stdout = stdout.replace(b'\r\n', b'\n')
         if stdout.endswith(b'\n'):
             stdout = stdout[:-1]
@@ -11,6 +11,72 @@ from . import util
 
 _globcheck = re.compile('[\[*?]')
 
+class DirCache(object):
+    """
+    The names in directories which have been globbed, read with one os.scandir each.
+    Listings are kept until invalidate() is called, which pymake does whenever it may
+    have created files: after each command and after running $(shell). The directories
+    whose listings were thrown away are remembered as stale, so that lookups of single
+    files (see isfresh) don't list them again after every command.
+    """
+
+    def __init__(self):
+        self._listings = {} # directory -> [name, ...]
+        self._namesets = {} # directory -> set of normcased names
+        self._stale = set() # directories which were listed before the last invalidate()
+        self.hits = 0
+        self.misses = 0
+
+    def listdir(self, dir):
+        """
+        Return the names of the entries in `dir` which exist: links are only included
+        when their targets exist. '.' and '..' are not included.
+        """
+        names = self._listings.get(dir)
+        if names is not None:
+            self.hits += 1
+            return names
+
+        self.misses += 1
+        names = []
+        with os.scandir(dir) as it:
+            for e in it:
+                if e.is_symlink() and not os.path.exists(e.path):
+                    continue
+                names.append(e.name)
+
+        self._listings[dir] = names
+        return names
+
+    def names(self, dir):
+        """
+        Return the set of os.path.normcase()d names listed by listdir(dir), which is empty
+        if `dir` can't be listed.
+        """
+        names = self._namesets.get(dir)
+        if names is None:
+            try:
+                listing = self.listdir(dir)
+            except OSError:
+                listing = []
+            names = set([os.path.normcase(name) for name in listing])
+            self._namesets[dir] = names
+        return names
+
+    def isfresh(self, dir):
+        """
+        Whether `dir` has a listing, or has never been listed. Otherwise, finding out
+        whether a single file exists is quicker with a stat() than by listing `dir` again.
+        """
+        return dir in self._listings or dir not in self._stale
+
+    def invalidate(self):
+        self._stale.update(self._listings)
+        self._listings.clear()
+        self._namesets.clear()
+
+dircache = DirCache()
+
 def hasglob(p):
     return _globcheck.search(p) is not None
 
@@ -54,15 +120,13 @@ def globpattern(dir, pattern):
             return [pattern]
         return []
 
-    leaves = os.listdir(dir) + ['.', '..']
-
     # "hidden" filenames are a bit special
-    if not pattern.startswith('.'):
-        leaves = [leaf for leaf in leaves
+    if pattern.startswith('.'):
+        leaves = dircache.listdir(dir) + ['.', '..']
+    else:
+        leaves = [leaf for leaf in dircache.listdir(dir)
                   if not leaf.startswith('.')]
 
     leaves = fnmatch.filter(leaves, pattern)
-    leaves = [l for l in leaves if os.path.exists(util.normaljoin(dir, l))]
-
     leaves.sort()
     return leaves
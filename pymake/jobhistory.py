@@ -0,0 +1,111 @@
+"""
+A record of how long the commands of each target took to run, used to schedule the
+longest chains of work first.
+
+When a target's commands finish, the time they spent running (not waiting for a job
+slot) is stored under the absolute path of the target. The next time the target is
+remade, its commands are queued with the estimated length of the work which remains
+once they start: their own duration plus the durations of the targets which are waiting
+for them. With more ready jobs than slots, the context starts the one with the
+longest remaining work first, so that long links at the end of a chain don't start late.
+
+The file is JSON. Each run merges what it measured into the file as it is on disk,
+so parallel submakes sharing a history file keep each other's records.
+"""
+
+import os, json, tempfile, logging
+
+_log = logging.getLogger('pymake.jobhistory')
+
+VERSION = 1
+
+# how much a new measurement counts against the recorded duration
+_weight = 0.5
+
+class JobHistory(object):
+    """
+    The durations recorded in the history file at `path`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._durations = None
+        self._new = {} # target path -> duration measured this time
+
+    def _read(self):
+        try:
+            with open(self.path) as fd:
+                d = json.load(fd)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            _log.debug("Ignoring unreadable job history '%s': %s", self.path, e)
+            return {}
+
+        if not isinstance(d, dict) or d.get('version') != VERSION or not isinstance(d.get('durations'), dict):
+            _log.debug("Job history '%s' has an unknown format", self.path)
+            return {}
+
+        return d['durations']
+
+    def duration(self, target):
+        """
+        Return the recorded duration in seconds of the commands for `target`, or 0 if
+        it has never been remade.
+        """
+        if self._durations is None:
+            self._durations = self._read()
+
+        d = self._new.get(target)
+        if d is None:
+            d = self._durations.get(target, 0)
+        return d
+
+    def remaining(self, target, waiting):
+        """
+        Estimate the time left until the targets in `waiting`, which can only be remade
+        after `target`, are finished, starting from when the commands for `target` start.
+        """
+        return self.duration(target) + sum(self.duration(t) for t in waiting)
+
+    def record(self, target, seconds):
+        """
+        Record that the commands for `target` took `seconds` to run.
+        """
+        old = self.duration(target)
+        if old:
+            seconds = old + (seconds - old) * _weight
+        self._new[target] = seconds
+
+    def save(self):
+        """
+        Merge the durations measured since the last save into the history file.
+        Failures are logged and otherwise ignored: the history is only a scheduling hint.
+        """
+        if not self._new:
+            return
+
+        durations = self._read()
+        durations.update(self._new)
+
+        directory = os.path.dirname(self.path) or '.'
+        try:
+            fd, tmppath = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix='.jobhistory')
+        except OSError as e:
+            _log.warning("Couldn't write job history '%s': %s", self.path, e)
+            return
+
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'version': VERSION, 'durations': durations}, f, indent=0, sort_keys=True)
+            os.replace(tmppath, self.path)
+        except OSError as e:
+            _log.warning("Couldn't write job history '%s': %s", self.path, e)
+            try:
+                os.unlink(tmppath)
+            except OSError:
+                pass
+            return
+
+        self._durations = durations
+        self._new = {}
@@ -0,0 +1,169 @@
+"""
+The GNU make jobserver protocol, which lets recursive makes share one limit on the
+number of jobs running at once.
+
+The top-level make creates a pipe holding one token (a byte) for each job it may run
+beyond the first, and tells the makes below it about the pipe in MAKEFLAGS, as
+--jobserver-auth=R,W (the file descriptors of the two ends). Newer GNU makes may pass
+--jobserver-auth=fifo:PATH instead, and older ones --jobserver-fds=R,W. Every make may
+always run one job; it reads a token from the pipe before starting each job beyond
+that, and writes the token back when the job finishes.
+
+Reading from the pipe blocks, so a thread waits for tokens when the event loop wants
+one, and tells the event loop when it got one.
+"""
+
+import os, select, threading, logging
+
+_log = logging.getLogger('pymake.jobserver')
+
+class JobServer(object):
+    """
+    The tokens of a jobserver, read from `rfd` and written back to `wfd`. `ontoken` is
+    called from another thread when a token which was asked for has arrived.
+    """
+
+    def __init__(self, auth, rfd, wfd, ontoken):
+        self.auth = auth
+        self.rfd = rfd
+        self.wfd = wfd
+        self.ontoken = ontoken
+
+        self.held = [] # tokens taken for running jobs
+
+        self._lock = threading.Condition()
+        self._available = [] # tokens read from the pipe but not taken yet
+        self._wanted = False
+        self._closed = False
+        self._thread = None
+
+    @property
+    def fds(self):
+        """
+        The file descriptors which commands need to inherit to take part.
+        """
+        return (self.rfd, self.wfd)
+
+    def acquire(self, running):
+        """
+        Return True if a job may start while `running` other jobs of this process are
+        running, taking a token for it if necessary. Otherwise start waiting for a token
+        and return False; `ontoken` is called when it arrives.
+        """
+        if running < len(self.held) + 1:
+            return True
+
+        with self._lock:
+            if len(self._available):
+                self.held.append(self._available.pop())
+                return True
+
+            if not self._closed:
+                self._wanted = True
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._readtokens)
+                    self._thread.daemon = True
+                    self._thread.start()
+                self._lock.notify()
+
+        return False
+
+    def release(self, running, waiting):
+        """
+        Write back the tokens which aren't needed now that `running` jobs of this process
+        are running and `waiting` jobs are ready to start.
+        """
+        tokens = []
+        while len(self.held) > max(running - 1, 0):
+            tokens.append(self.held.pop())
+
+        if not waiting:
+            with self._lock:
+                tokens.extend(self._available)
+                del self._available[:]
+                self._wanted = False
+
+        if len(tokens):
+            self._write(b''.join(tokens))
+
+    def _write(self, tokens):
+        try:
+            os.write(self.wfd, tokens)
+        except OSError as e:
+            _log.warning("Couldn't return %i jobserver tokens: %s", len(tokens), e)
+
+    def _readtokens(self):
+        while True:
+            with self._lock:
+                while not self._wanted:
+                    self._lock.wait()
+
+            try:
+                token = os.read(self.rfd, 1)
+            except BlockingIOError:
+                # GNU make may have made the pipe non-blocking: wait until it's readable
+                select.select([self.rfd], [], [])
+                continue
+            except InterruptedError:
+                continue
+            except OSError as e:
+                _log.warning("Couldn't read from the jobserver: %s", e)
+                token = b''
+
+            with self._lock:
+                if not len(token):
+                    # every writer is gone: only the implicit job slot is left
+                    self._closed = True
+                    self._wanted = False
+                    return
+
+                self._available.append(token)
+                self._wanted = False
+
+            self.ontoken()
+
+    def close(self):
+        """
+        Give back every token this process has taken.
+        """
+        with self._lock:
+            tokens = self.held + self._available
+            self.held = []
+            self._available = []
+            self._wanted = False
+
+        if len(tokens):
+            self._write(b''.join(tokens))
+
+def create(jcount, ontoken):
+    """
+    Create the jobserver of a top-level make running up to `jcount` jobs at once.
+    """
+    rfd, wfd = os.pipe()
+    os.set_inheritable(rfd, True)
+    os.set_inheritable(wfd, True)
+    os.write(wfd, b'+' * (jcount - 1))
+    return JobServer('%i,%i' % (rfd, wfd), rfd, wfd, ontoken)
+
+def connect(auth, ontoken):
+    """
+    Connect to the jobserver of a parent make, given the value of --jobserver-auth.
+    Return None if it can't be used, typically because the parent make didn't pass the
+    file descriptors on to this command.
+    """
+    try:
+        if auth.startswith('fifo:'):
+            rfd = wfd = os.open(auth[5:], os.O_RDWR)
+            os.set_inheritable(rfd, True)
+        else:
+            r, w = auth.split(',')
+            rfd, wfd = int(r), int(w)
+            if rfd < 0 or wfd < 0:
+                return None
+            os.fstat(rfd)
+            os.fstat(wfd)
+    except (OSError, ValueError) as e:
+        _log.debug("Jobserver '%s' is unavailable: %s", auth, e)
+        return None
+
+    return JobServer(auth, rfd, wfd, ontoken)
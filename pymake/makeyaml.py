@@ -37,15 +37,22 @@ def parsefile(yaml_file, makefile):
             if 'prereqs' not in v:
                 v['prereqs'] = []
 
+            prereqs = ' '.join(v['prereqs'])
+            if 'orderonly' in v:
+                prereqs += ' | ' + ' '.join(v['orderonly'])
+
             if v['doublecolon']:
                 dc = ' :: '
             else:
                 dc = ' : '
 
+            if v.get('grouped'):
+                dc = ' &' + dc.lstrip()
+
             if 'targetpatterns' in v:
-                vars.append("{} {} {}: {}".format(' '.join(v['targets']), dc, ' '.join(v['targetpatterns']), ' '.join(v['prereqs'])))
+                vars.append("{} {} {}: {}".format(' '.join(v['targets']), dc, ' '.join(v['targetpatterns']), prereqs))
             else:
-                vars.append("{} {} {}".format(' '.join(v['targets']), dc, ' '.join(v['prereqs'])))
+                vars.append("{} {} {}".format(' '.join(v['targets']), dc, prereqs))
 
             for c in v['commands']:
                 vars.append('\t{}'.format(c))
@@ -79,7 +86,9 @@ def output(makefile):
 
             if thisrule.commands == []:
                 if k in ruleempty.keys():
-                    ruleempty[k]['prereqs'].extend(thisrule.prerequisites)
+                    ruleempty[k].setdefault('prereqs', []).extend(thisrule.prerequisites)
+                    if thisrule.orderonly != []:
+                        ruleempty[k].setdefault('orderonly', []).extend(thisrule.orderonly)
                     continue
 
             for ra, rr in ruleaddr.items():
@@ -96,6 +105,12 @@ def output(makefile):
             if thisrule.prerequisites != []:
                 rule['prereqs'] =  thisrule.prerequisites
 
+            if thisrule.orderonly != []:
+                rule['orderonly'] = thisrule.orderonly
+
+            if thisrule.group is not None:
+                rule['grouped'] = True
+
             if hasattr(thisrule, 'targetpatterns'):
                 rule['targetpatterns'] = []
                 for t in thisrule.targetpatterns:
@@ -0,0 +1,164 @@
+"""
+A persistent on-disk cache of parsed makefiles.
+
+Every makefile gets one entry file in the cache directory holding a pickled
+parserdata.StatementList. The entry also records the real path, size,
+modification time and a hash of the contents of the makefile it was parsed
+from; it is only used while all of them still match.
+
+Entries are written to a temporary file and atomically renamed into place, so
+parallel submakes sharing a cache directory never see partially written data.
+The total size of the directory is bounded: when it grows too large, the least
+recently used entries (by file modification time, which is refreshed on every
+hit) are removed.
+"""
+
+import os, sys, time, pickle, hashlib, tempfile, logging
+
+_log = logging.getLogger('pymake.parsecache')
+
+# Bump this when the layout of the parserdata/data/functions classes changes,
+# so that entries pickled by an older pymake are ignored.
+CACHE_VERSION = 4
+
+DEFAULT_MAXBYTES = 64 * 1024 * 1024
+
+_entrysuffix = '.pickle'
+_tmpprefix = '.tmp-'
+# temporary files older than this (in seconds) were left behind by a crashed writer
+_staletmpage = 3600
+
+def contenthash(s):
+    """
+    Hash the text of a makefile.
+    """
+    return hashlib.sha1(s.encode('utf-8', 'surrogateescape')).hexdigest()
+
+class ParseCache(object):
+    """
+    A directory of cached parse results, keyed on the real path of the makefile.
+    """
+
+    def __init__(self, directory, maxbytes=DEFAULT_MAXBYTES):
+        self.directory = directory
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+
+    def _entrypath(self, realpath):
+        name = hashlib.sha1(realpath.encode('utf-8', 'surrogateescape')).hexdigest()
+        return os.path.join(self.directory, name + _entrysuffix)
+
+    @staticmethod
+    def _key(realpath, st, digest):
+        return (CACHE_VERSION, sys.version_info[:2], realpath, st.st_size, st.st_mtime_ns, digest)
+
+    def load(self, realpath, st, digest):
+        """
+        Return the cached StatementList for the makefile at `realpath`, or None if there
+        is no entry or the entry is out of date.
+
+        @param st the os.stat_result of the makefile
+        @param digest the contenthash() of the makefile text
+        """
+        entrypath = self._entrypath(realpath)
+        try:
+            with open(entrypath, 'rb') as fd:
+                key, stmts = pickle.load(fd)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception as e:
+            # A corrupt or incompatible entry is just a miss; it will be overwritten.
+            _log.debug("Ignoring unreadable parse cache entry '%s' for '%s': %s", entrypath, realpath, e)
+            self.misses += 1
+            return None
+
+        if key != self._key(realpath, st, digest):
+            _log.debug("Parse cache entry for '%s' is out of date", realpath)
+            self.misses += 1
+            return None
+
+        try:
+            # mark the entry as recently used
+            os.utime(entrypath)
+        except OSError:
+            pass
+
+        self.hits += 1
+        return stmts
+
+    def store(self, realpath, st, digest, stmts):
+        """
+        Store a StatementList for the makefile at `realpath`. Failures are logged and
+        otherwise ignored: the cache is only an optimization.
+        """
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmppath = tempfile.mkstemp(dir=self.directory, prefix=_tmpprefix, suffix=_entrysuffix)
+        except OSError as e:
+            _log.debug("Couldn't create parse cache entry for '%s': %s", realpath, e)
+            return
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((self._key(realpath, st, digest), stmts), f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmppath, self._entrypath(realpath))
+        except Exception as e:
+            _log.debug("Couldn't write parse cache entry for '%s': %s", realpath, e)
+            try:
+                os.unlink(tmppath)
+            except OSError:
+                pass
+            return
+
+        self.evict()
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache is no larger than maxbytes.
+        Other processes may be evicting at the same time, so entries disappearing
+        underneath us are expected.
+        """
+        entries = []
+        total = 0
+        now = time.time()
+        try:
+            it = os.scandir(self.directory)
+        except OSError:
+            return
+
+        with it:
+            for e in it:
+                try:
+                    st = e.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+
+                if e.name.startswith(_tmpprefix):
+                    if now - st.st_mtime > _staletmpage:
+                        self._remove(e.path)
+                    continue
+
+                if not e.name.endswith(_entrysuffix):
+                    continue
+
+                total += st.st_size
+                entries.append((st.st_mtime, st.st_size, e.path))
+
+        if total <= self.maxbytes:
+            return
+
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.maxbytes:
+                break
+            self._remove(path)
+            total -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
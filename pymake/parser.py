@@ -31,10 +31,15 @@ yield 4-tuples (flatstr, token, tokenoffset, afteroffset)
 flatstr is data, guaranteed to have no tokens (may be '')
 token, tokenoffset, afteroffset *may be None*. That means there is more text
 coming.
+
+parsemakesyntax has two interchangeable engines, selected with setscanner() or the
+PYMAKE_SCANNER environment variable: 'regex' drives the iterators above with the
+_alltokens regular expression, 'singlepass' recognizes the same tokens by hand while
+walking the data once, without the iterators.
 """
 
 import logging, re, os, sys
-from . import data, functions, util, parserdata
+from . import data, functions, util, parserdata, parsecache, prefetch, depsdb
 from pymake import errors
 
 _log = logging.getLogger('pymake.parser')
@@ -344,11 +349,72 @@ _directivesre = re.compile(r'(%s)(?:$|\s+)' % '|'.join(_directivestokenlist))
 
 _varsettokens = (':=', '+=', '?=', '=')
 
+# persistent cache of parse results shared between make invocations, see setparsecache
+_diskcache = None
+
+def setparsecache(directory, maxbytes=parsecache.DEFAULT_MAXBYTES):
+    """
+    Keep parse results in an on-disk cache in `directory`, so that they can be reused by
+    later (or concurrent) make invocations. Pass None to disable the cache.
+    """
+    global _diskcache
+
+    if directory is None:
+        _diskcache = None
+    else:
+        _diskcache = parsecache.ParseCache(directory, maxbytes)
+
+# parses included makefiles ahead of time, see setprefetcher
+_prefetcher = None
+
+def setprefetcher(jobs):
+    """
+    Parse the makefiles which are about to be included ahead of time, in `jobs` worker
+    processes. Pass 0 to disable prefetching.
+    """
+    global _prefetcher
+
+    if _prefetcher is not None and _prefetcher.jobs == jobs:
+        return
+
+    if _prefetcher is not None:
+        _prefetcher.close()
+
+    if not jobs:
+        _prefetcher = None
+    else:
+        _prefetcher = prefetch.IncludePrefetcher(jobs)
+
+def prefetchincludes(stmts, makefile):
+    """
+    Called before `stmts` is executed in `makefile`, to start parsing the files it includes.
+    """
+    if _prefetcher is not None:
+        _prefetcher.scan(stmts, makefile)
+
 def _parsefile(pathname):
-    fd = open(pathname, "rU")
-    stmts = parsestring(fd.read(), pathname)
-    stmts.mtime = os.fstat(fd.fileno()).st_mtime
-    fd.close()
+    if _prefetcher is not None:
+        stmts = _prefetcher.take(pathname)
+        if stmts is not None:
+            _log.debug("Using prefetched parse of makefile '%s'", pathname)
+            return stmts
+
+    with open(pathname) as fd:
+        s = fd.read()
+        st = os.fstat(fd.fileno())
+
+    if _diskcache is None:
+        stmts = parsestring(s, pathname)
+    else:
+        digest = parsecache.contenthash(s)
+        stmts = _diskcache.load(pathname, st, digest)
+        if stmts is None:
+            stmts = parsestring(s, pathname)
+            _diskcache.store(pathname, st, digest, stmts)
+        else:
+            _log.debug("Using cached parse of makefile '%s'", pathname)
+
+    stmts.mtime = st.st_mtime
     return stmts
 
 def _checktime(path, stmts):
@@ -361,6 +427,13 @@ def _checktime(path, stmts):
 
 _parsecache = util.MostUsedCache(50, _parsefile, _checktime)
 
+def iscached(pathname):
+    """
+    Whether a parse of the file at real path `pathname` is held in memory.
+    """
+    item = _parsecache.d.get(pathname)
+    return item is not None and item.o is not None
+
 def parsefile(pathname):
     """
     Parse a filename into a parserdata.StatementList. A cache is used to avoid re-parsing
@@ -375,26 +448,62 @@ _depfilesplitter = re.compile(r':(?![\\/])')
 # simple variable references
 _vars = re.compile('\$\((\w+)\)')
 
+def _joindeplines(lines):
+    """
+    Join continued lines of a dependency file, skipping empty ones.
+    """
+    current_line = []
+    for line in lines:
+        line = line.rstrip()
+        if line.endswith("\\"):
+            current_line.append(line.rstrip("\\"))
+            continue
+        if not len(line):
+            continue
+        current_line.append(line)
+        yield ''.join(current_line)
+        current_line = []
+    if current_line:
+        yield ''.join(current_line)
+
+def _readdepfile(pathname):
+    with open(pathname) as fd:
+        return list(_joindeplines(fd))
+
+# database of dependency files consulted by parsedepfile, see setdepsdb
+_depsdb = None
+
+def setdepsdb(path):
+    """
+    Keep the contents of dependency files in the database at `path` and read them from
+    there while they are unchanged. Pass None to read dependency files directly.
+    """
+    global _depsdb
+
+    if path is None:
+        _depsdb = None
+    elif _depsdb is None or _depsdb.path != path:
+        _depsdb = depsdb.DepsDB(path)
+
+def savedepsdb():
+    """
+    Write out the dependency database, if dependency files were read since it was loaded.
+    """
+    if _depsdb is not None:
+        _depsdb.save()
+
+def forgetdepfile(pathname):
+    """
+    Drop the dependency file at `pathname`, which doesn't exist, from the dependency database.
+    """
+    if _depsdb is not None:
+        _depsdb.forget(os.path.realpath(pathname))
+
 def parsedepfile(pathname):
     """
     Parse a filename listing only depencencies into a parserdata.StatementList.
     Simple variable references are allowed in such files.
     """
-    def continuation_iter(lines):
-        current_line = []
-        for line in lines:
-            line = line.rstrip()
-            if line.endswith("\\"):
-                current_line.append(line.rstrip("\\"))
-                continue
-            if not len(line):
-                continue
-            current_line.append(line)
-            yield ''.join(current_line)
-            current_line = []
-        if current_line:
-            yield ''.join(current_line)
-
     def get_expansion(s):
         if '$' in s:
             expansion = data.Expansion()
@@ -413,8 +522,13 @@ def parsedepfile(pathname):
         return data.StringExpansion(s, None)
 
     pathname = os.path.realpath(pathname)
+    if _depsdb is None:
+        lines = _readdepfile(pathname)
+    else:
+        lines = _depsdb.getlines(pathname, _readdepfile)
+
     stmts = parserdata.StatementList()
-    for line in continuation_iter(open(pathname).readlines()):
+    for line in lines:
         target, deps = _depfilesplitter.split(line, 1)
         stmts.append(parserdata.Rule(get_expansion(target),
                                      get_expansion(deps), False))
@@ -590,12 +704,23 @@ def parsestring(s, filename):
             # any of the rules may have order-only prerequisites
             # delimited by |, and a command delimited by ;
             targets = e
+            targetsoffset = offset
 
             e, token, offset = parsemakesyntax(d, offset,
                                                _varsettokens + (':', '|', ';'),
                                                itermakefilechars)
+
+            # the targets of a grouped rule (a b &: c) are all made by one run of its commands
+            if token in _varsettokens:
+                if targets.removesuffix('&'):
+                    raise errors.SyntaxError("Target-specific variables can't be set for grouped targets (&:)",
+                                             d.getloc(targetsoffset))
+                grouped = False
+            else:
+                grouped = targets.removesuffix('&')
+
             if token in (None, ';'):
-                condstack[-1].append(parserdata.Rule(targets, e, doublecolon))
+                condstack[-1].append(parserdata.Rule(targets, e, doublecolon, grouped=grouped))
                 currule = True
 
                 if token == ';':
@@ -610,16 +735,26 @@ def parsestring(s, filename):
                 value = flattenmakesyntax(d, offset).lstrip()
                 condstack[-1].append(parserdata.SetVariable(e, value=value, valueloc=d.getloc(offset), token=token, targetexp=targets))
             elif token == '|':
-                raise errors.SyntaxError('order-only prerequisites not implemented', d.getloc(offset))
+                orderonly, token, offset = parsemakesyntax(d, offset, (';',), itermakefilechars)
+                condstack[-1].append(parserdata.Rule(targets, e, doublecolon, orderonly, grouped))
+                currule = True
+
+                if token == ';':
+                    offset = d.skipwhitespace(offset)
+                    e, t, offset = parsemakesyntax(d, offset, (), itercommandchars)
+                    condstack[-1].append(parserdata.Command(e))
             else:
                 assert token == ':'
                 # static pattern rule
 
                 pattern = e
 
-                deps, token, offset = parsemakesyntax(d, offset, (';',), itermakefilechars)
+                deps, token, offset = parsemakesyntax(d, offset, ('|', ';'), itermakefilechars)
+                orderonly = None
+                if token == '|':
+                    orderonly, token, offset = parsemakesyntax(d, offset, (';',), itermakefilechars)
 
-                condstack[-1].append(parserdata.StaticPatternRule(targets, pattern, deps, doublecolon))
+                condstack[-1].append(parserdata.StaticPatternRule(targets, pattern, deps, doublecolon, orderonly, grouped))
                 currule = True
 
                 if token == ';':
@@ -675,6 +810,132 @@ def parsemakesyntax(d, offset, stopon, iterfunc):
  
     @return a tuple (expansion, token, offset). If all the data is consumed,
     token and offset will be None
+
+    The work is done by the scanning engine selected with setscanner().
+    """
+
+    return _scanner(d, offset, stopon, iterfunc)
+
+def _parsetoken(d, stacktop, token, tokenoffset):
+    """
+    Advance the parsemakesyntax state machine over a token which is significant in the
+    current parse state.
+
+    @return the new top of the parse stack, or None if `token` is one of the tokens
+    toplevel parsing should stop on.
+    """
+
+    parsestate = stacktop.parsestate
+
+    if token[0] == '$':
+        loc = d.getloc(tokenoffset)
+        c = token[1]
+        if c == '$':
+            assert len(token) == 2
+            stacktop.expansion.appendstr('$')
+        elif c in ('(', '{'):
+            closebrace = _matchingbrace[c]
+
+            if len(token) > 2:
+                fname = token[2:].rstrip()
+                fn = functions.functionmap[fname](loc)
+                e = data.Expansion()
+                if len(fn) + 1 == fn.maxargs:
+                    tokenlist = (c, closebrace, '$')
+                else:
+                    tokenlist = (',', c, closebrace, '$')
+
+                stacktop = ParseStackFrame(_PARSESTATE_FUNCTION, stacktop,
+                                           e, tokenlist, function=fn,
+                                           openbrace=c, closebrace=closebrace)
+            else:
+                e = data.Expansion()
+                tokenlist = (':', c, closebrace, '$')
+                stacktop = ParseStackFrame(_PARSESTATE_VARNAME, stacktop,
+                                           e, tokenlist,
+                                           openbrace=c, closebrace=closebrace, loc=loc)
+        else:
+            assert len(token) == 2
+            e = data.Expansion.fromstring(c, loc)
+            stacktop.expansion.appendfunc(functions.VariableRef(loc, e))
+    elif token in ('(', '{'):
+        assert token == stacktop.openbrace
+
+        stacktop.expansion.appendstr(token)
+        stacktop = ParseStackFrame(_PARSESTATE_PARENMATCH, stacktop,
+                                   stacktop.expansion,
+                                   (token, stacktop.closebrace, '$'),
+                                   openbrace=token, closebrace=stacktop.closebrace, loc=d.getloc(tokenoffset))
+    elif parsestate == _PARSESTATE_PARENMATCH:
+        assert token == stacktop.closebrace
+        stacktop.expansion.appendstr(token)
+        stacktop = stacktop.parent
+    elif parsestate == _PARSESTATE_TOPLEVEL:
+        assert stacktop.parent is None
+        return None
+    elif parsestate == _PARSESTATE_FUNCTION:
+        if token == ',':
+            stacktop.function.append(stacktop.expansion.finish())
+
+            stacktop.expansion = data.Expansion()
+            if len(stacktop.function) + 1 == stacktop.function.maxargs:
+                tokenlist = (stacktop.openbrace, stacktop.closebrace, '$')
+                stacktop.tokenlist = tokenlist
+        elif token in (')', '}'):
+            fn = stacktop.function
+            fn.append(stacktop.expansion.finish())
+            fn.setup()
+            
+            stacktop = stacktop.parent
+            stacktop.expansion.appendfunc(fn)
+        else:
+            assert False, "Not reached, _PARSESTATE_FUNCTION"
+    elif parsestate == _PARSESTATE_VARNAME:
+        if token == ':':
+            stacktop.varname = stacktop.expansion
+            stacktop.parsestate = _PARSESTATE_SUBSTFROM
+            stacktop.expansion = data.Expansion()
+            stacktop.tokenlist = ('=', stacktop.openbrace, stacktop.closebrace, '$')
+        elif token in (')', '}'):
+            fn = functions.VariableRef(stacktop.loc, stacktop.expansion.finish())
+            stacktop = stacktop.parent
+            stacktop.expansion.appendfunc(fn)
+        else:
+            assert False, "Not reached, _PARSESTATE_VARNAME"
+    elif parsestate == _PARSESTATE_SUBSTFROM:
+        if token == '=':
+            stacktop.substfrom = stacktop.expansion
+            stacktop.parsestate = _PARSESTATE_SUBSTTO
+            stacktop.expansion = data.Expansion()
+            stacktop.tokenlist = (stacktop.openbrace, stacktop.closebrace, '$')
+        elif token in (')', '}'):
+            # A substitution of the form $(VARNAME:.ee) is probably a mistake, but make
+            # parses it. Issue a warning. Combine the varname and substfrom expansions to
+            # make the compatible varname. See tests/var-substitutions.mk SIMPLE3SUBSTNAME
+            _log.warning("%s: Variable reference looks like substitution without =", stacktop.loc)
+            stacktop.varname.appendstr(':')
+            stacktop.varname.concat(stacktop.expansion)
+            fn = functions.VariableRef(stacktop.loc, stacktop.varname.finish())
+            stacktop = stacktop.parent
+            stacktop.expansion.appendfunc(fn)
+        else:
+            assert False, "Not reached, _PARSESTATE_SUBSTFROM"
+    elif parsestate == _PARSESTATE_SUBSTTO:
+        assert token in  (')','}'), "Not reached, _PARSESTATE_SUBSTTO"
+
+        fn = functions.SubstitutionRef(stacktop.loc, stacktop.varname.finish(),
+                                       stacktop.substfrom.finish(), stacktop.expansion.finish())
+        stacktop = stacktop.parent
+        stacktop.expansion.appendfunc(fn)
+    else:
+        assert False, "Unexpected parse state %s" % stacktop.parsestate
+
+    return stacktop
+
+def _regexmakesyntax(d, offset, stopon, iterfunc):
+    """
+    The original scanning engine: tokens are found with _alltokens and fed through
+    the iterdata/itermakefilechars/itercommandchars generators.
     """
 
     assert callable(iterfunc)
@@ -689,122 +950,25 @@ def parsemakesyntax(d, offset, stopon, iterfunc):
     while True: # this is not a for loop because `di` changes during the function
         assert stacktop is not None
         try:
-            s, token, tokenoffset, offset = next(di)
+            s, token, tokenoffset, afteroffset = next(di)
         except StopIteration:
             break
 
         stacktop.expansion.appendstr(s)
         if token is None:
+            offset = d.lend if afteroffset is None else afteroffset
             continue
 
-        parsestate = stacktop.parsestate
+        offset = afteroffset
 
-        if token[0] == '$':
-            if tokenoffset + 1 == d.lend:
-                # an unterminated $ expands to nothing
-                break
+        if token[0] == '$' and tokenoffset + 1 == d.lend:
+            # an unterminated $ expands to nothing
+            break
 
-            loc = d.getloc(tokenoffset)
-            c = token[1]
-            if c == '$':
-                assert len(token) == 2
-                stacktop.expansion.appendstr('$')
-            elif c in ('(', '{'):
-                closebrace = _matchingbrace[c]
-
-                if len(token) > 2:
-                    fname = token[2:].rstrip()
-                    fn = functions.functionmap[fname](loc)
-                    e = data.Expansion()
-                    if len(fn) + 1 == fn.maxargs:
-                        tokenlist = (c, closebrace, '$')
-                    else:
-                        tokenlist = (',', c, closebrace, '$')
-
-                    stacktop = ParseStackFrame(_PARSESTATE_FUNCTION, stacktop,
-                                               e, tokenlist, function=fn,
-                                               openbrace=c, closebrace=closebrace)
-                else:
-                    e = data.Expansion()
-                    tokenlist = (':', c, closebrace, '$')
-                    stacktop = ParseStackFrame(_PARSESTATE_VARNAME, stacktop,
-                                               e, tokenlist,
-                                               openbrace=c, closebrace=closebrace, loc=loc)
-            else:
-                assert len(token) == 2
-                e = data.Expansion.fromstring(c, loc)
-                stacktop.expansion.appendfunc(functions.VariableRef(loc, e))
-        elif token in ('(', '{'):
-            assert token == stacktop.openbrace
-
-            stacktop.expansion.appendstr(token)
-            stacktop = ParseStackFrame(_PARSESTATE_PARENMATCH, stacktop,
-                                       stacktop.expansion,
-                                       (token, stacktop.closebrace, '$'),
-                                       openbrace=token, closebrace=stacktop.closebrace, loc=d.getloc(tokenoffset))
-        elif parsestate == _PARSESTATE_PARENMATCH:
-            assert token == stacktop.closebrace
-            stacktop.expansion.appendstr(token)
-            stacktop = stacktop.parent
-        elif parsestate == _PARSESTATE_TOPLEVEL:
-            assert stacktop.parent is None
+        newtop = _parsetoken(d, stacktop, token, tokenoffset)
+        if newtop is None:
             return stacktop.expansion.finish(), token, offset
-        elif parsestate == _PARSESTATE_FUNCTION:
-            if token == ',':
-                stacktop.function.append(stacktop.expansion.finish())
-
-                stacktop.expansion = data.Expansion()
-                if len(stacktop.function) + 1 == stacktop.function.maxargs:
-                    tokenlist = (stacktop.openbrace, stacktop.closebrace, '$')
-                    stacktop.tokenlist = tokenlist
-            elif token in (')', '}'):
-                fn = stacktop.function
-                fn.append(stacktop.expansion.finish())
-                fn.setup()
-                
-                stacktop = stacktop.parent
-                stacktop.expansion.appendfunc(fn)
-            else:
-                assert False, "Not reached, _PARSESTATE_FUNCTION"
-        elif parsestate == _PARSESTATE_VARNAME:
-            if token == ':':
-                stacktop.varname = stacktop.expansion
-                stacktop.parsestate = _PARSESTATE_SUBSTFROM
-                stacktop.expansion = data.Expansion()
-                stacktop.tokenlist = ('=', stacktop.openbrace, stacktop.closebrace, '$')
-            elif token in (')', '}'):
-                fn = functions.VariableRef(stacktop.loc, stacktop.expansion.finish())
-                stacktop = stacktop.parent
-                stacktop.expansion.appendfunc(fn)
-            else:
-                assert False, "Not reached, _PARSESTATE_VARNAME"
-        elif parsestate == _PARSESTATE_SUBSTFROM:
-            if token == '=':
-                stacktop.substfrom = stacktop.expansion
-                stacktop.parsestate = _PARSESTATE_SUBSTTO
-                stacktop.expansion = data.Expansion()
-                stacktop.tokenlist = (stacktop.openbrace, stacktop.closebrace, '$')
-            elif token in (')', '}'):
-                # A substitution of the form $(VARNAME:.ee) is probably a mistake, but make
-                # parses it. Issue a warning. Combine the varname and substfrom expansions to
-                # make the compatible varname. See tests/var-substitutions.mk SIMPLE3SUBSTNAME
-                _log.warning("%s: Variable reference looks like substitution without =", stacktop.loc)
-                stacktop.varname.appendstr(':')
-                stacktop.varname.concat(stacktop.expansion)
-                fn = functions.VariableRef(stacktop.loc, stacktop.varname.finish())
-                stacktop = stacktop.parent
-                stacktop.expansion.appendfunc(fn)
-            else:
-                assert False, "Not reached, _PARSESTATE_SUBSTFROM"
-        elif parsestate == _PARSESTATE_SUBSTTO:
-            assert token in  (')','}'), "Not reached, _PARSESTATE_SUBSTTO"
-
-            fn = functions.SubstitutionRef(stacktop.loc, stacktop.varname.finish(),
-                                           stacktop.substfrom.finish(), stacktop.expansion.finish())
-            stacktop = stacktop.parent
-            stacktop.expansion.appendfunc(fn)
-        else:
-            assert False, "Unexpected parse state %s" % stacktop.parsestate
+        stacktop = newtop
 
         if stacktop.parent is not None and iterfunc == itercommandchars:
             di = itermakefilechars(d, offset, stacktop.tokenlist, tokeniterator,
@@ -818,3 +982,159 @@ def parsemakesyntax(d, offset, stopon, iterfunc):
     assert stacktop.parsestate == _PARSESTATE_TOPLEVEL
 
     return stacktop.expansion.finish(), None, None
+
+# The single-pass scanner jumps between characters which can begin a token in _alltokens,
+# and works out the token (if any) by hand.
+_scanstart = re.compile(r'''[\\#:+?$=(){};,|'"]''')
+_scanfuncname = re.compile(r'(\S+)\s+')
+
+# how text between significant tokens is treated
+_SCAN_DATA = 0              # iterdata: literally
+_SCAN_MAKEFILE = 1          # itermakefilechars: condense continuations, stop at comments
+_SCAN_MAKEFILE_FUNCTION = 2 # itermakefilechars(ignorecomments=True), inside functions in commands
+_SCAN_COMMAND = 3           # itercommandchars: strip the tab after escaped newlines
+
+_scanmodes = {
+    iterdata: _SCAN_DATA,
+    itermakefilechars: _SCAN_MAKEFILE,
+    itercommandchars: _SCAN_COMMAND,
+    }
+
+def _scantext(mode, s):
+    if mode == _SCAN_COMMAND:
+        return s.replace('\n\t', '\n')
+    if mode != _SCAN_DATA and '\\\n' in s:
+        return _makecontinuations.sub(_replacemakecontinuations, s)
+    return s
+
+def _scanmakesyntax(d, offset, stopon, iterfunc):
+    """
+    A single-pass scanning engine. Tokens are recognized by hand as the data is walked
+    once, and text and tokens are fed straight into the parse state machine. It produces
+    the same results as _regexmakesyntax.
+    """
+
+    mode = _scanmodes[iterfunc]
+
+    stacktop = ParseStackFrame(_PARSESTATE_TOPLEVEL, None, data.Expansion(loc=d.getloc(d.lstart)),
+                               tokenlist=stopon + ('$',),
+                               openbrace=None, closebrace=None)
+
+    s = d.s
+    end = d.lend
+    search = _scanstart.search
+    textmode = mode
+
+    # text between textstart and the current token hasn't been appended yet. Tokens which are
+    # not significant in the current parse state are left in the text.
+    textstart = offset
+    pos = offset
+    while True:
+        m = search(s, pos, end)
+        if m is None:
+            stacktop.expansion.appendstr(_scantext(textmode, s[textstart:end]))
+            offset = end
+            break
+
+        tokenoffset = m.start(0)
+        c = s[tokenoffset]
+        tokenend = tokenoffset + 1
+        nextc = s[tokenend] if tokenend < end else ''
+
+        if c == '\\':
+            # backslashes are only a token when they escape a hash mark
+            while nextc == '\\':
+                tokenend += 1
+                nextc = s[tokenend] if tokenend < end else ''
+            if nextc != '#':
+                pos = tokenend
+                continue
+            tokenend += 1
+        elif c == ':':
+            if nextc in ('=', ':'):
+                tokenend += 1
+            elif nextc in ('\\', '/'):
+                # Windows path detection
+                pos = tokenend
+                continue
+        elif c in '+?':
+            if nextc != '=':
+                pos = tokenend
+                continue
+            tokenend += 1
+        elif c == '$':
+            if nextc == '':
+                # an unterminated $ expands to nothing
+                stacktop.expansion.appendstr(_scantext(textmode, s[textstart:tokenoffset]))
+                offset = end
+                break
+            if nextc == '\n':
+                pos = tokenend
+                continue
+            tokenend += 1
+            if nextc in '({':
+                fm = _scanfuncname.match(s, tokenend, end)
+                if fm is not None and fm.group(1) in functions.functionmap:
+                    tokenend = fm.end(0)
+
+        token = s[tokenoffset:tokenend]
+
+        if token[-1] == '#' and textmode == _SCAN_MAKEFILE:
+            # this includes $#, which itermakefilechars also treats as an escaped hash mark
+            stacktop.expansion.appendstr(_scantext(textmode, s[textstart:tokenoffset]))
+            l = tokenend - tokenoffset
+            # multiple backslashes before a hash are unescaped, halving their total number
+            if l % 2:
+                # found a comment
+                stacktop.expansion.appendstr(token[:(l - 1) // 2])
+                offset = end
+                break
+
+            stacktop.expansion.appendstr(token[-l // 2:])
+            textstart = pos = offset = tokenend
+        elif c == '$' or token in stacktop.tokenlist:
+            stacktop.expansion.appendstr(_scantext(textmode, s[textstart:tokenoffset]))
+            offset = tokenend
+
+            newtop = _parsetoken(d, stacktop, token, tokenoffset)
+            if newtop is None:
+                return stacktop.expansion.finish(), token, offset
+            stacktop = newtop
+
+            if mode == _SCAN_COMMAND and stacktop.parent is not None:
+                textmode = _SCAN_MAKEFILE_FUNCTION
+            else:
+                textmode = mode
+            textstart = pos = tokenend
+        else:
+            pos = tokenend
+
+    if stacktop.parent is not None:
+        raise errors.SyntaxError("Unterminated function call", d.getloc(offset))
+
+    assert stacktop.parsestate == _PARSESTATE_TOPLEVEL
+
+    return stacktop.expansion.finish(), None, None
+
+_scanners = {
+    'regex': _regexmakesyntax,
+    'singlepass': _scanmakesyntax,
+    }
+
+def setscanner(name):
+    """
+    Select the engine used by parsemakesyntax: 'regex' (the default) or 'singlepass'.
+    The initial choice can be made with the PYMAKE_SCANNER environment variable.
+    """
+    global _scanner
+
+    if name not in _scanners:
+        raise errors.DataError("Unknown scanner '%s', expected one of: %s" % (name, ', '.join(sorted(_scanners))))
+
+    _scanner = _scanners[name]
+
+_envscanner = os.environ.get('PYMAKE_SCANNER', 'regex')
+if _envscanner not in _scanners:
+    _log.warning("Unknown scanner '%s' in PYMAKE_SCANNER, using 'regex'", _envscanner)
+    _envscanner = 'regex'
+setscanner(_envscanner)
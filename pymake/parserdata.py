@@ -131,6 +131,21 @@ class Statement(object):
     def __ne__(self, other):
         return self.__eq__(other)
 
+def _resolveorderonly(exp, makefile):
+    if exp is None:
+        return []
+    return list(data.stripdotslashes(exp.resolvesplit(makefile, makefile.variables)))
+
+def _checkungrouped(targets, targetexp):
+    """
+    A rule is grouped by a literal &: in the makefile. Refuse targets which only end with
+    & once they are expanded, such as $(TARGETS): with TARGETS = a b &, rather than
+    silently making the rule an ungrouped one.
+    """
+    if len(targets) and targets[-1].endswith('&'):
+        raise errors.DataError("Grouped targets must be marked with a literal '&:', not come from a variable",
+                               targetexp.loc)
+
 class DummyRule(object):
     __slots__ = ()
 
@@ -152,16 +167,26 @@ class Rule(Statement):
     this is a doublecolon rule. Doublecolon rules are rules that are always
     executed, if they are evaluated. Normally, rules are only executed if their
     target is out of date.
+
+    `orderonlyexp` holds the order-only prerequisites listed after a `|`, or is None.
+    They are made before the target, but don't make it out of date.
+
+    `grouped` says whether the targets were separated from the prerequisites by `&:`.
+    The commands of a grouped rule make all of its targets at once, so they run once
+    for the whole group.
     """
-    __slots__ = ('targetexp', 'depexp', 'doublecolon')
+    __slots__ = ('targetexp', 'depexp', 'doublecolon', 'orderonlyexp', 'grouped')
 
-    def __init__(self, targetexp, depexp, doublecolon):
+    def __init__(self, targetexp, depexp, doublecolon, orderonlyexp=None, grouped=False):
         assert isinstance(targetexp, (data.Expansion, data.StringExpansion))
         assert isinstance(depexp, (data.Expansion, data.StringExpansion))
+        assert orderonlyexp is None or isinstance(orderonlyexp, (data.Expansion, data.StringExpansion))
 
         self.targetexp = targetexp
         self.depexp = depexp
         self.doublecolon = doublecolon
+        self.orderonlyexp = orderonlyexp
+        self.grouped = grouped
 
     def execute(self, makefile, context):
         if context.weak:
@@ -180,7 +205,8 @@ class Rule(Statement):
         if not deps:
             return
         targets = data.stripdotslashes(self.targetexp.resolvesplit(makefile, makefile.variables))
-        rule = data.Rule(list(data.stripdotslashes(deps)), self.doublecolon, loc=self.targetexp.loc, weakdeps=True)
+        rule = data.Rule(list(data.stripdotslashes(deps)), self.doublecolon, loc=self.targetexp.loc, weakdeps=True,
+                         orderonly=_resolveorderonly(self.orderonlyexp, makefile))
         for target in targets:
             makefile.gettarget(target).addrule(rule)
             makefile.foundtarget(target)
@@ -189,7 +215,9 @@ class Rule(Statement):
     def _execute(self, makefile, context):
         assert not context.weak
 
-        atargets = data.stripdotslashes(self.targetexp.resolvesplit(makefile, makefile.variables))
+        atargets = list(data.stripdotslashes(self.targetexp.resolvesplit(makefile, makefile.variables)))
+        if not self.grouped:
+            _checkungrouped(atargets, self.targetexp)
         targets = [data.Pattern(p) for p in _expandwildcards(makefile, atargets)]
 
         if not len(targets):
@@ -202,12 +230,18 @@ class Rule(Statement):
         ispattern, = ispatterns
 
         deps = list(_expandwildcards(makefile, data.stripdotslashes(self.depexp.resolvesplit(makefile, makefile.variables))))
+        orderonly = list(_expandwildcards(makefile, _resolveorderonly(self.orderonlyexp, makefile)))
         if ispattern:
             prerequisites = [data.Pattern(d) for d in deps]
-            rule = data.PatternRule(targets, prerequisites, self.doublecolon, loc=self.targetexp.loc)
+            rule = data.PatternRule(targets, prerequisites, self.doublecolon, loc=self.targetexp.loc,
+                                    orderonly=[data.Pattern(d) for d in orderonly])
             makefile.appendimplicitrule(rule)
         else:
-            rule = data.Rule(deps, self.doublecolon, loc=self.targetexp.loc, weakdeps=False)
+            group = None
+            if self.grouped:
+                group = data.RuleGroup([t.gettarget() for t in targets])
+            rule = data.Rule(deps, self.doublecolon, loc=self.targetexp.loc, weakdeps=False, orderonly=orderonly,
+                             group=group)
             for t in targets:
                 makefile.gettarget(t.gettarget()).addrule(rule)
 
@@ -216,7 +250,11 @@ class Rule(Statement):
         context.currule = rule
 
     def dump(self, fd, indent):
-        print("%sRule %s: %s" % (indent, self.targetexp, self.depexp), file=fd)
+        sep = self.grouped and '&:' or ':'
+        if self.orderonlyexp is None:
+            print("%sRule %s%s %s" % (indent, self.targetexp, sep, self.depexp), file=fd)
+        else:
+            print("%sRule %s%s %s | %s" % (indent, self.targetexp, sep, self.depexp, self.orderonlyexp), file=fd)
 
     def to_source(self):
         sep = ':'
@@ -224,10 +262,16 @@ class Rule(Statement):
         if self.doublecolon:
             sep = '::'
 
+        if self.grouped:
+            sep = '&' + sep
+
         deps = self.depexp.to_source()
         if len(deps) > 0 and not deps[0].isspace():
             sep += ' '
 
+        if self.orderonlyexp is not None:
+            deps += '|' + self.orderonlyexp.to_source()
+
         return '\n%s%s%s' % (
             self.targetexp.to_source(escape_variables=True),
             sep,
@@ -239,7 +283,9 @@ class Rule(Statement):
 
         return self.targetexp == other.targetexp \
                 and self.depexp == other.depexp \
-                and self.doublecolon == other.doublecolon
+                and self.doublecolon == other.doublecolon \
+                and self.orderonlyexp == other.orderonlyexp \
+                and self.grouped == other.grouped
 
 class StaticPatternRule(Statement):
     """
@@ -251,23 +297,29 @@ class StaticPatternRule(Statement):
     They are like `Rule` instances except an added property, `patternexp` is
     present. It contains the Expansion which represents the rule pattern.
     """
-    __slots__ = ('targetexp', 'patternexp', 'depexp', 'doublecolon')
+    __slots__ = ('targetexp', 'patternexp', 'depexp', 'doublecolon', 'orderonlyexp', 'grouped')
 
-    def __init__(self, targetexp, patternexp, depexp, doublecolon):
+    def __init__(self, targetexp, patternexp, depexp, doublecolon, orderonlyexp=None, grouped=False):
         assert isinstance(targetexp, (data.Expansion, data.StringExpansion))
         assert isinstance(patternexp, (data.Expansion, data.StringExpansion))
         assert isinstance(depexp, (data.Expansion, data.StringExpansion))
+        assert orderonlyexp is None or isinstance(orderonlyexp, (data.Expansion, data.StringExpansion))
 
         self.targetexp = targetexp
         self.patternexp = patternexp
         self.depexp = depexp
         self.doublecolon = doublecolon
+        self.orderonlyexp = orderonlyexp
+        self.grouped = grouped
 
     def execute(self, makefile, context):
         if context.weak:
             raise errors.DataError("Static pattern rules not allowed in includedeps", self.targetexp.loc)
 
-        targets = list(_expandwildcards(makefile, data.stripdotslashes(self.targetexp.resolvesplit(makefile, makefile.variables))))
+        atargets = list(data.stripdotslashes(self.targetexp.resolvesplit(makefile, makefile.variables)))
+        if not self.grouped:
+            _checkungrouped(atargets, self.targetexp)
+        targets = list(_expandwildcards(makefile, atargets))
 
         if not len(targets):
             context.currule = DummyRule()
@@ -279,8 +331,13 @@ class StaticPatternRule(Statement):
         pattern = data.Pattern(patterns[0])
 
         deps = [data.Pattern(p) for p in _expandwildcards(makefile, data.stripdotslashes(self.depexp.resolvesplit(makefile, makefile.variables)))]
+        orderonly = [data.Pattern(p) for p in _expandwildcards(makefile, _resolveorderonly(self.orderonlyexp, makefile))]
 
-        rule = data.PatternRule([pattern], deps, self.doublecolon, loc=self.targetexp.loc)
+        group = None
+        if self.grouped:
+            group = data.RuleGroup(targets)
+        rule = data.PatternRule([pattern], deps, self.doublecolon, loc=self.targetexp.loc, orderonly=orderonly,
+                                group=group)
 
         for t in targets:
             if data.Pattern(t).ispattern():
@@ -294,7 +351,11 @@ class StaticPatternRule(Statement):
         context.currule = rule
 
     def dump(self, fd, indent):
-        print("%sStaticPatternRule %s: %s: %s" % (indent, self.targetexp, self.patternexp, self.depexp), file=fd)
+        sep = self.grouped and '&:' or ':'
+        if self.orderonlyexp is None:
+            print("%sStaticPatternRule %s%s %s: %s" % (indent, self.targetexp, sep, self.patternexp, self.depexp), file=fd)
+        else:
+            print("%sStaticPatternRule %s%s %s: %s | %s" % (indent, self.targetexp, sep, self.patternexp, self.depexp, self.orderonlyexp), file=fd)
 
     def to_source(self):
         sep = ':'
@@ -302,8 +363,13 @@ class StaticPatternRule(Statement):
         if self.doublecolon:
             sep = '::'
 
+        if self.grouped:
+            sep = '&' + sep
+
         pattern = self.patternexp.to_source()
         deps = self.depexp.to_source()
+        if self.orderonlyexp is not None:
+            deps += '|' + self.orderonlyexp.to_source()
 
         if len(pattern) > 0 and pattern[0] not in (' ', '\t'):
             sep += ' '
@@ -321,7 +387,9 @@ class StaticPatternRule(Statement):
         return self.targetexp == other.targetexp \
                 and self.patternexp == other.patternexp \
                 and self.depexp == other.depexp \
-                and self.doublecolon == other.doublecolon
+                and self.doublecolon == other.doublecolon \
+                and self.orderonlyexp == other.orderonlyexp \
+                and self.grouped == other.grouped
 
 class Command(Statement):
     """
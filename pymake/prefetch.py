@@ -0,0 +1,194 @@
+"""
+Speculative parsing of included makefiles.
+
+Parsing a makefile doesn't depend on any variable state, only executing it does. Before a
+StatementList is executed, IncludePrefetcher looks for the `include` directives in it whose
+file names are static, or can be worked out from variables which are already known, and
+starts parsing those files in a pool of worker processes. When execution reaches the
+directive, parser.parsefile takes the finished StatementList instead of parsing the file
+itself.
+
+Guesses are allowed to be wrong: results are looked up by the real path of the file that
+is actually included, and are thrown away if the file changed after it was parsed.
+"""
+
+import os, re, logging, atexit
+from concurrent import futures
+from . import data, parser, parserdata, functions, util
+
+_log = logging.getLogger('pymake.prefetch')
+
+_globcheck = re.compile(r'[\[*?]')
+
+# a variable whose value can't be predicted
+_UNKNOWN = object()
+
+# how deeply recursively-expanded variables are followed when guessing a value
+_maxdepth = 8
+
+class IncludePrefetcher(object):
+    """
+    Parses included makefiles ahead of time in `jobs` worker processes.
+    """
+
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self._executor = None
+        self._pending = {} # realpath -> Future
+
+        self.hits = 0
+        self.submitted = 0
+
+    def scan(self, stmts, makefile):
+        """
+        Start parsing the files included by `stmts`, which is about to be executed in
+        `makefile`.
+        """
+        for path in _guessincludes(stmts, makefile, {}):
+            if _globcheck.search(path):
+                continue
+
+            fspath = os.path.realpath(util.normaljoin(makefile.workdir, path))
+            if fspath in self._pending or parser.iscached(fspath) or not os.path.isfile(fspath):
+                continue
+
+            if self._executor is None:
+                self._executor = futures.ProcessPoolExecutor(self.jobs)
+                atexit.register(self.close)
+
+            _log.debug("Prefetching included makefile '%s'", fspath)
+            self._pending[fspath] = self._executor.submit(parser._parsefile, fspath)
+            self.submitted += 1
+
+    def close(self):
+        """
+        Throw away the prefetches which were never used and stop the worker processes.
+        """
+        for f in self._pending.values():
+            f.cancel()
+        self._pending.clear()
+
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def take(self, pathname):
+        """
+        Return the prefetched StatementList for the file at real path `pathname`, or None
+        if the file wasn't prefetched (or should be parsed again).
+        """
+        f = self._pending.pop(pathname, None)
+        if f is None or f.cancel():
+            # it's quicker to parse the file now than wait for the queue
+            return None
+
+        try:
+            stmts = f.result()
+        except Exception as e:
+            # parse it again in this process, to report the error properly
+            _log.debug("Prefetching '%s' failed: %s", pathname, e)
+            return None
+
+        if os.path.getmtime(pathname) != stmts.mtime:
+            _log.debug("Not using prefetched '%s': mtimes differ", pathname)
+            return None
+
+        self.hits += 1
+        return stmts
+
+def _guessincludes(stmts, makefile, assigned):
+    """
+    Yield the file names which the include directives in `stmts` will probably
+    include, following the variable assignments they come after. `assigned` maps
+    variable names to the values given to them earlier on.
+    """
+    for s in stmts:
+        if isinstance(s, parserdata.Include):
+            if s.weak:
+                continue
+
+            value = _guessvalue(s.exp, makefile, assigned, 0)
+            if value is not None:
+                for path in value.split():
+                    yield path
+
+        elif isinstance(s, parserdata.SetVariable):
+            if s.targetexp is not None or not s.vnameexp.is_static_string:
+                continue
+
+            name = s.vnameexp.resolvestr(makefile, makefile.variables).strip()
+            flavor, source, value = makefile.variables.get(name, expand=False)
+            if source is not None and source < s.source:
+                # the assignment won't override it
+                continue
+
+            if s.token == '?=':
+                if source is not None or name in assigned:
+                    continue
+                assigned[name] = (data.Variables.FLAVOR_RECURSIVE, s.value)
+            elif s.token == '=':
+                assigned[name] = (data.Variables.FLAVOR_RECURSIVE, s.value)
+            elif s.token == ':=':
+                value = _guessvalue(_parsevalue(s.value), makefile, assigned, 0)
+                assigned[name] = _UNKNOWN if value is None else (data.Variables.FLAVOR_SIMPLE, value)
+            else:
+                assigned[name] = _UNKNOWN
+
+        elif isinstance(s, parserdata.ConditionBlock):
+            # Either branch may be taken. Look for includes in all of them, and forget the
+            # variables any of them assign afterwards.
+            for c, block in s:
+                blockassigned = dict(assigned)
+                for path in _guessincludes(block, makefile, blockassigned):
+                    yield path
+
+                for name, value in blockassigned.items():
+                    if assigned.get(name) is not value:
+                        assigned[name] = _UNKNOWN
+
+def _parsevalue(value):
+    d = parser.Data.fromstring(value, parserdata.Location('<prefetch>', 1, 0))
+    e, t, o = parser.parsemakesyntax(d, 0, (), parser.iterdata)
+    return e
+
+def _guessvalue(exp, makefile, assigned, depth):
+    """
+    Resolve `exp` if it only consists of text and references to variables with known
+    values. Other functions may have side effects, so return None for those.
+    """
+    if exp.is_static_string:
+        return exp.resolvestr(makefile, makefile.variables)
+
+    if depth > _maxdepth:
+        return None
+
+    parts = []
+    for e, isfunc in exp:
+        if not isfunc:
+            parts.append(e)
+            continue
+
+        if type(e) is not functions.VariableRef or not e.vname.is_static_string:
+            return None
+
+        name = e.vname.resolvestr(makefile, makefile.variables)
+        if name in assigned:
+            v = assigned[name]
+            if v is _UNKNOWN:
+                return None
+            flavor, value = v
+        else:
+            flavor, source, value = makefile.variables.get(name, expand=False)
+            if flavor is None:
+                continue
+            if flavor == data.Variables.FLAVOR_APPEND:
+                return None
+
+        if flavor == data.Variables.FLAVOR_RECURSIVE and '$' in value:
+            value = _guessvalue(_parsevalue(value), makefile, assigned, depth + 1)
+            if value is None:
+                return None
+
+        parts.append(value)
+
+    return ''.join(parts)
@@ -5,13 +5,13 @@ parsing command lines into argv and making sure that no shell magic is being use
 
 
 #TODO: ship pyprocessing?
-import multiprocessing
-import subprocess, shlex, re, logging, sys, traceback, os, imp, glob
+import multiprocessing, threading
+import subprocess, shlex, re, logging, sys, traceback, os, imp, glob, time, heapq, atexit, shutil
 import site
-from collections import deque
+from collections import deque, OrderedDict, Counter
 # XXXkhuey Work around http://bugs.python.org/issue1731717
 subprocess._cleanup = lambda: None
-from . import command, util
+from . import command, util, jobserver as _jobserver, shellpool as _shellpool
 from pymake import errors
 if sys.platform=='win32':
     from . import win32process
@@ -65,6 +65,7 @@ class ClineSplitter(list):
         self.arg = None
         self.cline = cline
         self.glob = False
+        self.globbed = False # whether any argument was globbed
         self._parse_unquoted()
 
     def _push(self, str):
@@ -83,6 +84,7 @@ class ClineSplitter(list):
         if self.arg is None:
             return
         if self.glob:
+            self.globbed = True
             if os.path.isabs(self.arg):
                 path = self.arg
             else:
@@ -194,6 +196,9 @@ def clinetoargv(cline, cwd):
     @returns argv, badchar
     """
     str = _escapednewlines.sub('', cline)
+    if '\n' in str:
+        # several commands, as in a .ONESHELL script
+        return None, '\\n'
     try:
         args = ClineSplitter(str, cwd)
     except MetaCharacterException as e:
@@ -215,67 +220,341 @@ shellwords = (':', '.', 'break', 'cd', 'continue', 'exec', 'exit', 'export',
               'printf', 'read', 'shopt', 'source', 'type', 'typeset',
               'ulimit', 'unalias', 'set', 'find')
 
+# reservedwords are the words which start shell compound commands. A command starting
+# with one is shell syntax, not a program to run.
+reservedwords = ('if', 'then', 'else', 'elif', 'fi', 'for', 'while', 'until', 'do', 'done',
+                 'case', 'esac', 'select', 'function', 'time', 'in', '{', '}', '[[', ']]', '!')
+
+def _chaintokens(s):
+    """
+    Split a command line into words (kept as they are written, quotes included),
+    operators and redirections, or return None if it uses shell syntax which chains
+    don't support.
+    """
+    tokens = []
+    word = []
+    i = 0
+    n = len(s)
+    while i < n:
+        c = s[i]
+        if c == '\\':
+            word.append(s[i:i + 2])
+            i += 2
+            continue
+
+        if c == "'":
+            end = s.find("'", i + 1)
+            if end == -1:
+                return None
+            word.append(s[i:end + 1])
+            i = end + 1
+            continue
+
+        if c == '"':
+            end = i + 1
+            while end < n and s[end] != '"':
+                if s[end] == '\\':
+                    end += 1
+                end += 1
+            if end >= n:
+                return None
+            word.append(s[i:end + 1])
+            i = end + 1
+            continue
+
+        if c == '#' and not len(word):
+            # a comment
+            break
+
+        if c in ' \t&|;<>':
+            # a file descriptor number directly before a redirection is part of it;
+            # only stdin, stdout and stderr are redirected without a shell
+            fd = None
+            if c in '<>' and ''.join(word).isdigit():
+                fd = int(''.join(word))
+                if fd > 2:
+                    return None
+                word = []
+
+            if len(word):
+                tokens.append(('word', ''.join(word)))
+                word = []
+
+            if c in ' \t':
+                i += 1
+            elif c in '<>':
+                for op in ('>>', '>&', '>', '<'):
+                    if s.startswith(op, i):
+                        break
+                i += len(op)
+                if i < n and s[i] in '<>&|':
+                    # here-documents, >|, <>, <& and the like
+                    return None
+                if fd is None:
+                    fd = 0 if op == '<' else 1
+                tokens.append(('redirect', fd, op))
+            elif s.startswith('&&', i) or s.startswith('||', i):
+                tokens.append(('op', s[i:i + 2]))
+                i += 2
+            elif c == '&':
+                # a command in the background
+                return None
+            else:
+                tokens.append(('op', c))
+                i += 1
+            continue
+
+        if c == '\n':
+            return None
+
+        word.append(c)
+        i += 1
+
+    if len(word):
+        tokens.append(('word', ''.join(word)))
+    return tokens
+
+def clinetochain(cline, cwd):
+    """
+    If this command line is a chain of simple commands which can be run without a
+    shell, return it as a list of (operator, pipeline), where the operator is None,
+    '&&', '||' or ';', and a pipeline is a list of one or two (argv, redirections).
+    Redirections are (fd, operator, target) with the operator '<', '>', '>>' or '>&'.
+    Otherwise return None.
+
+    Chains don't support anything else a shell does, and every command in them has
+    to be one which is run without a shell on its own.
+    """
+    if sys.platform == 'win32':
+        return None
+
+    tokens = _chaintokens(_escapednewlines.sub('', cline))
+    if tokens is None:
+        return None
+
+    chain = []
+    pipeline = []
+    words = []
+    redirections = []
+    operator = None
+    redirect = None
+    for t in tokens + [('op', None)]:
+        if redirect is not None:
+            if t[0] != 'word':
+                return None
+            fd, op = redirect
+            redirect = None
+            if op == '>&':
+                if t[1] not in ('1', '2'):
+                    return None
+                redirections.append((fd, op, int(t[1])))
+                continue
+            if re.search(r'[*?\[]', t[1]):
+                return None
+            target, badchar = clinetoargv(t[1], cwd)
+            if target is None or len(target) != 1:
+                return None
+            redirections.append((fd, op, target[0]))
+            continue
+
+        if t[0] == 'word':
+            words.append(t[1])
+            continue
+
+        if t[0] == 'redirect':
+            redirect = t[1:]
+            continue
+
+        if t[1] is None and not len(words) and not len(pipeline) and operator == ';':
+            # a command line ending with ;
+            break
+
+        if not len(words):
+            return None
+        argv, badchar = clinetoargv(' '.join(words), cwd)
+        if not argv or argv[0] in shellwords or argv[0] in reservedwords:
+            return None
+        pipeline.append((argv, redirections))
+        words = []
+        redirections = []
+
+        if t[1] == '|':
+            if len(pipeline) == 2:
+                return None
+            continue
+
+        chain.append((operator, pipeline))
+        pipeline = []
+        operator = t[1]
+
+    return chain
+
 def prepare_command(cline, cwd, loc):
     """
     Returns a list of command and arguments for the given command line string.
     If the command needs to be run through a shell for some reason, the
     returned list contains the shell invocation.
     """
+    executable, argv, shellreason, chain = _preparecommand(cline, cwd)
+    if shellreason is not None:
+        _log.debug("%s: using shell: %s: '%s'", loc, shellreason, cline)
+    return executable, argv
+
+_shellcompat = None
+
+def _checkmsyscompat():
+    """
+    util.checkmsyscompat(), which only depends on the environment of this process, so
+    it is only called once.
+    """
+    global _shellcompat
 
-    #TODO: call this once up-front somewhere and save the result?
-    shell, msys = util.checkmsyscompat()
+    if _shellcompat is None:
+        _shellcompat = util.checkmsyscompat()
+    return _shellcompat
+
+class CommandCache(object):
+    """
+    The results of _preparecommand for the `capacity` most recently used command lines,
+    keyed on (cline, cwd). The same command lines are run for many targets, which only
+    differ in the automatic variables they don't use. Command lines with an argument
+    which was globbed depend on the files on disk, so they aren't kept.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._prepared = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        prepared = self._prepared.get(key)
+        if prepared is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._prepared.move_to_end(key)
+        return prepared
+
+    def put(self, key, prepared):
+        self._prepared[key] = prepared
+        if len(self._prepared) > self.capacity:
+            self._prepared.popitem(last=False)
+
+    def clear(self):
+        self._prepared.clear()
+
+commandcache = CommandCache(4096)
+
+# how many recipe commands were run without a shell ('direct'), as a chain of commands
+# without a shell ('chain'), through a shell ('shell'), and as native Python commands
+# ('native')
+commandcounts = Counter()
+
+def _preparecommand(cline, cwd):
+    """
+    Like prepare_command, and also return why the command is run through a shell, or
+    None, and the command line as returned by clinetochain if it needs a shell.
+    """
+    key = (cline, cwd)
+    prepared = commandcache.get(key)
+    if prepared is not None:
+        return prepared
+
+    shell, msys = _checkmsyscompat()
 
     shellreason = None
     executable = None
+    chain = None
+    cacheable = True
     if msys and cline.startswith('/'):
         shellreason = "command starts with /"
     else:
         argv, badchar = clinetoargv(cline, cwd)
         if argv is None:
             shellreason = "command contains shell-special character '%s'" % (badchar,)
-        elif len(argv) and argv[0] in shellwords:
-            shellreason = "command starts with shell primitive '%s'" % (argv[0],)
-        elif argv and (os.sep in argv[0] or os.altsep and os.altsep in argv[0]):
-            executable = util.normaljoin(cwd, argv[0])
-            # Avoid "%1 is not a valid Win32 application" errors, assuming
-            # that if the executable path is to be resolved with PATH, it will
-            # be a Win32 executable.
-            if sys.platform == 'win32' and os.path.isfile(executable) and open(executable, 'rb').read(2) == "#!":
-                shellreason = "command executable starts with a hashbang"
+        else:
+            cacheable = not argv.globbed
+            if len(argv) and argv[0] in shellwords:
+                shellreason = "command starts with shell primitive '%s'" % (argv[0],)
+            elif len(argv) and argv[0] in reservedwords:
+                shellreason = "command starts with shell reserved word '%s'" % (argv[0],)
+            elif argv and (os.sep in argv[0] or os.altsep and os.altsep in argv[0]):
+                executable = util.normaljoin(cwd, argv[0])
+                # Avoid "%1 is not a valid Win32 application" errors, assuming
+                # that if the executable path is to be resolved with PATH, it will
+                # be a Win32 executable.
+                if sys.platform == 'win32':
+                    cacheable = False
+                    if os.path.isfile(executable) and open(executable, 'rb').read(2) == "#!":
+                        shellreason = "command executable starts with a hashbang"
 
     if shellreason is not None:
-        _log.debug("%s: using shell: %s: '%s'", loc, shellreason, cline)
         if msys:
             if len(cline) > 3 and cline[1] == ':' and cline[2] == '/':
                 cline = '/' + cline[0] + cline[2:]
+        else:
+            chain = clinetochain(cline, cwd)
+            if chain is not None and any(words.globbed for operator, pipeline in chain
+                                         for words, redirections in pipeline):
+                cacheable = False
         argv = [shell, "-c", cline]
         executable = None
 
-    return executable, argv
+    prepared = executable, argv, shellreason, chain
+    if cacheable:
+        commandcache.put(key, prepared)
+    return prepared
 
-def call(cline, env, cwd, loc, cb, context, echo, justprint=False, yamlout=False, yamlin=None):
-    executable, argv = prepare_command(cline, cwd, loc)
+def call(cline, env, cwd, loc, cb, context, echo, justprint=False, yamlout=False, yamlin=None, priority=0,
+         recursive=False):
+    """
+    Run the command line `cline`, and return the Job running it, or None if it is run
+    some other way. Only `recursive` commands, those which run a make, take part in the
+    jobserver.
+    """
+    executable, argv, shellreason, chain = _preparecommand(cline, cwd)
 
     if not len(argv):
         cb(res=0)
-        return
+        return None
+
+    if chain is not None:
+        _log.debug("%s: running chain of commands without a shell: '%s'", loc, cline)
+        commandcounts['chain'] += 1
+        return context.callchain(chain, env=env, cwd=cwd, cb=cb, echo=echo, justprint=justprint,
+                                 yamlout=yamlout, yamlin=None, priority=priority, recursive=recursive)
+
+    if shellreason is not None:
+        _log.debug("%s: using shell: %s: '%s'", loc, shellreason, cline)
+        commandcounts['shell'] += 1
+    else:
+        commandcounts['direct'] += 1
+
+    if shellreason is not None and shellpool is not None:
+        return context.callshell(argv[2], env=env, cwd=cwd, cb=cb, echo=echo, justprint=justprint,
+                                 yamlout=yamlout, yamlin=None, priority=priority, recursive=recursive)
 
     if argv[0] == command.makepypath:
         command.main(argv[1:], env, cwd, cb)
-        return
+        return None
 
     if argv[0:2] == [sys.executable.replace('\\', '/'),
                      command.makepypath.replace('\\', '/')]:
         command.main(argv[2:], env, cwd, cb)
-        return
+        return None
 
-    context.call(argv, executable=executable, shell=False, env=env, cwd=cwd, cb=cb,
-                 echo=echo, justprint=justprint, yamlout=yamlout, yamlin=None)
+    return context.call(argv, executable=executable, shell=False, env=env, cwd=cwd, cb=cb,
+                        echo=echo, justprint=justprint, yamlout=yamlout, yamlin=None, priority=priority,
+                        recursive=recursive)
 
 def call_native(module, method, argv, env, cwd, loc, cb, context, echo, justprint=False,
-                pycommandpath=None, yamlout=False, yamlin=None):
-    context.call_native(module, method, argv, env=env, cwd=cwd, cb=cb,
-                        echo=echo, justprint=justprint, pycommandpath=pycommandpath, yamlout=yamlout, yamlin=None)
+                pycommandpath=None, yamlout=False, yamlin=None, priority=0):
+    commandcounts['native'] += 1
+    return context.call_native(module, method, argv, env=env, cwd=cwd, cb=cb,
+                               echo=echo, justprint=justprint, pycommandpath=pycommandpath, yamlout=yamlout, yamlin=None,
+                               priority=priority)
 
 def statustoresult(status):
     """
@@ -289,56 +568,141 @@ def statustoresult(status):
 
 class Job(object):
     """
-    A single job to be executed on the process pool.
+    A single job to be executed by a ParallelContext.
     """
-    done = False # set to true when the job completes
 
     def __init__(self):
         self.exitcode = -127
-
-    def notify(self, condition, result):
-        condition.acquire()
-        self.done = True
-        self.exitcode = result
-        condition.notify()
-        condition.release()
-
-    def get_callback(self, condition):
-        return lambda result: self.notify(condition, result)
+        self.started = None
+        self.elapsed = 0 # seconds between starting and finishing
 
 class PopenJob(Job):
     """
     A job that executes a command using subprocess.Popen.
     """
-    def __init__(self, argv, executable, shell, env, cwd):
+    def __init__(self, argv, executable, shell, env, cwd, recursive=False):
         Job.__init__(self)
         self.argv = argv
         self.executable = executable
         self.shell = shell
         self.env = env
         self.cwd = cwd
-        self.parentpid = os.getpid()
+        self.recursive = recursive
 
-    def run(self):
-        assert os.getpid() != self.parentpid
+    def start(self):
+        """
+        Start the command from this process. Returns the subprocess.Popen, or None if the
+        command couldn't be started.
+        """
         # subprocess.Popen doesn't use the PATH set in the env argument for
         # finding the executable on some platforms (but strangely it does on
-        # others!), so set os.environ['PATH'] explicitly. This is parallel-
-        # safe because pymake uses separate processes for parallelism, and
-        # each process is serial. See http://bugs.python.org/issue8557 for a
-        # general overview of "subprocess PATH semantics and portability".
+        # others!), so set os.environ['PATH'] explicitly. This is safe because
+        # commands are only started from the thread running the event loop.
+        # See http://bugs.python.org/issue8557 for a general overview of
+        # "subprocess PATH semantics and portability".
         oldpath = os.environ['PATH']
         try:
             if self.env is not None and 'PATH' in self.env:
                 os.environ['PATH'] = self.env['PATH']
-            p = subprocess.Popen(self.argv, executable=self.executable, shell=self.shell, env=self.env, cwd=self.cwd)
-            return p.wait()
+            return subprocess.Popen(self.argv, executable=self.executable, shell=self.shell, env=self.env, cwd=self.cwd,
+                                    pass_fds=_jobserverfds(self.recursive))
         except OSError as e:
             print(e, file=sys.stderr)
-            return -127
+            return None
         finally:
             os.environ['PATH'] = oldpath
 
+class ShellJob(Job):
+    """
+    A job that runs a command line in a shell of the shellpool.
+    """
+    def __init__(self, cline, env, cwd, recursive=False):
+        Job.__init__(self)
+        self.cline = cline
+        self.env = env if env is not None else dict(os.environ)
+        self.cwd = cwd
+        self.recursive = recursive
+
+    def run(self):
+        return shellpool.run(self.cline, self.env, self.cwd, _jobserverfds(self.recursive))
+
+class ChainJob(Job):
+    """
+    A job that runs a chain of commands, as returned by clinetochain, without a shell.
+    """
+    def __init__(self, chain, env, cwd, recursive=False):
+        Job.__init__(self)
+        self.chain = chain
+        self.env = env
+        self.cwd = cwd
+        self.recursive = recursive
+
+    def _executable(self, argv):
+        if os.sep in argv[0] or os.altsep and os.altsep in argv[0]:
+            return util.normaljoin(self.cwd, argv[0])
+
+        # commands run on threads, so os.environ['PATH'] can't be set as for PopenJob
+        path = self.env.get('PATH') if self.env is not None else None
+        return shutil.which(argv[0], path=path)
+
+    def _open(self, target, mode):
+        return open(util.normaljoin(self.cwd, target), mode)
+
+    def _runpipeline(self, pipeline):
+        passfds = _jobserverfds(self.recursive)
+        processes = []
+        files = []
+        try:
+            stdin = None
+            for i, (argv, redirections) in enumerate(pipeline):
+                fds = {0: stdin, 1: None, 2: None}
+                if i < len(pipeline) - 1:
+                    stdin, fds[1] = os.pipe()
+                    files.extend((stdin, fds[1]))
+
+                for fd, op, target in redirections:
+                    if op == '>&':
+                        fds[fd] = fds[target] if fds[target] is not None else target
+                    else:
+                        try:
+                            f = self._open(target, {'<': 'rb', '>': 'wb', '>>': 'ab'}[op])
+                        except OSError as e:
+                            print("%s: %s" % (target, e.strerror), file=sys.stderr)
+                            return 1
+                        files.append(f)
+                        fds[fd] = f
+
+                executable = self._executable(argv)
+                if executable is None:
+                    print("%s: command not found" % (argv[0],), file=sys.stderr)
+                    return 127
+
+                try:
+                    processes.append(subprocess.Popen(argv, executable=executable, env=self.env, cwd=self.cwd,
+                                                      stdin=fds[0], stdout=fds[1], stderr=fds[2], pass_fds=passfds))
+                except OSError as e:
+                    print(e, file=sys.stderr)
+                    return 127
+        finally:
+            # the commands have their own copies of the files and pipes
+            for f in files:
+                if isinstance(f, int):
+                    os.close(f)
+                else:
+                    f.close()
+
+            results = [p.wait() for p in processes]
+
+        return results[-1]
+
+    def run(self):
+        result = 0
+        for operator, pipeline in self.chain:
+            if operator == '&&' and result != 0 or operator == '||' and result == 0:
+                continue
+            result = self._runpipeline(pipeline)
+        return result
+
 class PythonJob(Job):
     """
     A job that calls a Python method.
@@ -424,89 +788,180 @@ class ParallelContext(object):
     """
 
     _allcontexts = set()
-    _condition = multiprocessing.Condition()
+
+    # PopenJobs, ShellJobs and ChainJobs finish on waiter threads of their own, and native
+    # jobs on the process pool's result thread. Either appends (context, job) to _completed
+    # and notifies _condition; the event loop hands them to their callbacks.
+    _condition = threading.Condition()
+    _completed = deque()
 
     def __init__(self, jcount):
         self.jcount = jcount
         self.exit = False
 
-        self.processpool = multiprocessing.Pool(processes=jcount)
+        self.processpool = None # created when the first native command runs
         self.pending = deque() # deque of (cb, args, kwargs)
-        self.running = [] # list of (subprocess, cb)
+        self.ready = [] # heap of (-priority, sequence, job, cb, echo, justprint, yamlout, yamlin)
+        self.running = {} # job -> cb
+
+        self._sequence = 0
 
         self._allcontexts.add(self)
 
     def finish(self):
-        assert len(self.pending) == 0 and len(self.running) == 0, "pending: %i running: %i" % (len(self.pending), len(self.running))
-        self.processpool.close()
-        self.processpool.join()
+        assert len(self.pending) == 0 and len(self.ready) == 0 and len(self.running) == 0, "pending: %i ready: %i running: %i" % (len(self.pending), len(self.ready), len(self.running))
+        if self.processpool is not None:
+            self.processpool.close()
+            self.processpool.join()
         self._allcontexts.remove(self)
 
     def run(self):
-        while len(self.pending) and len(self.running) < self.jcount:
-            cb, args, kwargs = self.pending.popleft()
-            cb(*args, **kwargs)
-
+        """
+        Run deferred callbacks, and start the ready jobs with the highest priority, while
+        there are free job slots. Callbacks come first: they may make more jobs ready.
+        """
+        while len(self.running) < self.jcount:
+            if len(self.pending):
+                cb, args, kwargs = self.pending.popleft()
+                cb(*args, **kwargs)
+            elif len(self.ready) and self._maystart():
+                self._docall_generic(*heapq.heappop(self.ready)[2:])
+            else:
+                break
 
     def defer(self, cb, *args, **kwargs):
         assert self.jcount > 1 or not len(self.pending), "Serial execution error defering %r %r %r: currently pending %r" % (cb, args, kwargs, self.pending)
         self.pending.append((cb, args, kwargs))
 
-    def _docall_generic(self, pool, job, cb, echo, justprint, yamlout, yamlin):
+    def _maystart(self):
+        """
+        Return True if the load on the machine and the jobserver allow another job to start.
+        """
+        running = ParallelContext._countrunning()
+        if loadthrottle is not None and not loadthrottle.allows(running, self.jcount):
+            return False
+        return jobserver is None or jobserver.acquire(running)
+
+    @staticmethod
+    def _countrunning():
+        return sum(len(c.running) for c in ParallelContext._allcontexts)
+
+    @staticmethod
+    def _tokenavailable():
+        with ParallelContext._condition:
+            ParallelContext._completed.append((None, None))
+            ParallelContext._condition.notify()
+
+    def _jobfinished(self, job, result):
+        job.exitcode = result
+        job.elapsed = time.time() - job.started
+        with ParallelContext._condition:
+            ParallelContext._completed.append((self, job))
+            ParallelContext._condition.notify()
+
+    def _spawn(self, job):
+        """
+        Start a PopenJob directly, and wait for it on a thread of its own.
+        """
+        sys.stdout.flush()
+        p = job.start()
+        if p is None:
+            self._jobfinished(job, -127)
+            return
+
+        t = threading.Thread(target=lambda: self._jobfinished(job, p.wait()))
+        t.daemon = True
+        t.start()
+
+    def _runthread(self, job):
+        """
+        Run a ShellJob or ChainJob, waiting for it on a thread of its own.
+        """
+        sys.stdout.flush()
+        t = threading.Thread(target=lambda: self._jobfinished(job, job.run()))
+        t.daemon = True
+        t.start()
+
+    def _docall_generic(self, job, cb, echo, justprint, yamlout, yamlin):
         if echo is not None:
             print(echo)
-        processcb = job.get_callback(ParallelContext._condition)
+        self.running[job] = cb
+        job.started = time.time()
         if justprint:
-            processcb(0)
+            self._jobfinished(job, 0)
+        elif isinstance(job, PopenJob):
+            self._spawn(job)
+        elif isinstance(job, (ShellJob, ChainJob)):
+            self._runthread(job)
         else:
-            pool.apply_async(job_runner, args=(job,), callback=processcb)
-        self.running.append((job, cb))
+            # native commands change the process environment and working directory, so they
+            # run in a pool of worker processes
+            if self.processpool is None:
+                self.processpool = _poolcontext().Pool(processes=self.jcount)
+            self.processpool.apply_async(job_runner, args=(job,),
+                                         callback=lambda result: self._jobfinished(job, result))
+
+    def _queue(self, job, cb, echo, justprint, yamlout, yamlin, priority):
+        """
+        Queue `job` to start when a slot is free. Jobs with a higher priority start first,
+        and jobs with the same priority in the order they were queued.
+        """
+        self._sequence += 1
+        heapq.heappush(self.ready, (-priority, self._sequence, job, cb, echo, justprint, yamlout, yamlin))
+        return job
 
-    def call(self, argv, shell, env, cwd, cb, echo, justprint=False, executable=None, yamlout=False, yamlin=None):
+    def call(self, argv, shell, env, cwd, cb, echo, justprint=False, executable=None, yamlout=False, yamlin=None, priority=0,
+             recursive=False):
         """
         Asynchronously call the process
         """
 
-        job = PopenJob(argv, executable=executable, shell=shell, env=env, cwd=cwd)
-        self.defer(self._docall_generic, self.processpool, job, cb, echo, justprint, yamlout, yamlin)
+        job = PopenJob(argv, executable=executable, shell=shell, env=env, cwd=cwd, recursive=recursive)
+        return self._queue(job, cb, echo, justprint, yamlout, yamlin, priority)
+
+    def callchain(self, chain, env, cwd, cb, echo, justprint=False, yamlout=False, yamlin=None, priority=0,
+                  recursive=False):
+        """
+        Asynchronously run the chain of commands
+        """
+
+        job = ChainJob(chain, env=env, cwd=cwd, recursive=recursive)
+        return self._queue(job, cb, echo, justprint, yamlout, yamlin, priority)
+
+    def callshell(self, cline, env, cwd, cb, echo, justprint=False, yamlout=False, yamlin=None, priority=0,
+                  recursive=False):
+        """
+        Asynchronously run the command line in a shell of the shellpool
+        """
+
+        job = ShellJob(cline, env=env, cwd=cwd, recursive=recursive)
+        return self._queue(job, cb, echo, justprint, yamlout, yamlin, priority)
 
     def call_native(self, module, method, argv, env, cwd, cb,
-                    echo, justprint=False, yamlout=False, yamlin=None, pycommandpath=None):
+                    echo, justprint=False, yamlout=False, yamlin=None, pycommandpath=None, priority=0):
         """
         Asynchronously call the native function
         """
 
         job = PythonJob(module, method, argv, env, cwd, pycommandpath)
-        self.defer(self._docall_generic, self.processpool, job, cb, echo, justprint, yamlout, yamlin)
+        return self._queue(job, cb, echo, justprint, yamlout, yamlin, priority)
 
     @staticmethod
-    def _waitany(condition):
-        def _checkdone():
-            jobs = []
-            for c in ParallelContext._allcontexts:
-                for i in range(0, len(c.running)):
-                    if c.running[i][0].done:
-                        jobs.append(c.running[i])
-                for j in jobs:
-                    if j in c.running:
-                        c.running.remove(j)
-            return jobs
-
-        # We must acquire the lock, and then check to see if any jobs have
-        # finished.  If we don't check after acquiring the lock it's possible
-        # that all outstanding jobs will have completed before we wait and we'll
-        # wait for notifications that have already occurred.
-        condition.acquire()
-        jobs = _checkdone()
-
-        if jobs == []:
-            condition.wait()
-            jobs = _checkdone()
-
-        condition.release()
+    def _waitany():
+        """
+        Wait until at least one job has finished, and return the (context, job) of every
+        finished job.
+        """
+        completed = ParallelContext._completed
+        with ParallelContext._condition:
+            while not len(completed):
+                ParallelContext._condition.wait()
+
+            jobs = list(completed)
+            completed.clear()
 
         return jobs
-        
+
     @staticmethod
     def spin():
         """
@@ -518,13 +973,31 @@ class ParallelContext(object):
             for c in clist:
                 c.run()
 
+            if jobserver is not None:
+                jobserver.release(ParallelContext._countrunning(),
+                                  sum(len(c.ready) for c in ParallelContext._allcontexts))
+
             dowait = util.any((len(c.running) for c in ParallelContext._allcontexts))
             if dowait:
-                # Wait on local jobs first for perf
-                for job, cb in ParallelContext._waitany(ParallelContext._condition):
+                for c, job in ParallelContext._waitany():
+                    if job is None:
+                        # a jobserver token arrived
+                        continue
+                    cb = c.running.pop(job)
                     cb(job.exitcode)
             else:
-                assert any(len(c.pending) for c in ParallelContext._allcontexts)
+                assert any(len(c.pending) or len(c.ready) for c in ParallelContext._allcontexts)
+
+def _poolcontext():
+    """
+    The multiprocessing context for the native command pool. By the time the pool is
+    created, this process has waiter and jobserver threads, and forking it could leave a
+    worker with a lock held by one of them, so workers come from a fork server where there
+    is one.
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
 
 def makedeferrable(usercb, **userkwargs):
     def cb(*args, **kwargs):
@@ -536,6 +1009,69 @@ def makedeferrable(usercb, **userkwargs):
 _serialContext = None
 _parallelContext = None
 
+# the jobserver.JobServer shared with the other makes of a recursive build, or None
+jobserver = None
+
+def _jobserverfds(recursive):
+    """
+    The file descriptors a command inherits. As in GNU make, only recursive commands get
+    those of the jobserver, so other commands can't take its tokens.
+    """
+    if recursive and jobserver is not None:
+        return jobserver.fds
+    return ()
+
+# the sysload.LoadThrottle holding back jobs while the machine is busy, or None
+loadthrottle = None
+
+# the shellpool.ShellPool running the commands which need a shell, or None
+shellpool = None
+
+def setshellpool(enabled, jcount):
+    """
+    Run the commands which need a shell in a pool of shells, keeping one for each of
+    `jcount` job slots, or stop doing so if `enabled` is False.
+    """
+    global shellpool
+
+    if not enabled or sys.platform == 'win32' or _checkmsyscompat()[1]:
+        shellpool = None
+        return
+
+    if shellpool is not None:
+        shellpool.size = max(shellpool.size, jcount)
+        return
+
+    shellpool = _shellpool.ShellPool(_checkmsyscompat()[0], jcount)
+    atexit.register(shellpool.close)
+
+def setjobserver(auth, jcount):
+    """
+    Take part in the jobserver of a parent make described by `auth`, the value of
+    --jobserver-auth, or create a jobserver for `jcount` jobs if `auth` is None.
+    Return the value of --jobserver-auth to pass on to submakes, or None if there is
+    no usable jobserver.
+    """
+    global jobserver
+
+    if sys.platform == 'win32':
+        return None
+
+    if jobserver is not None and auth in (None, jobserver.auth):
+        return jobserver.auth
+
+    if auth is None:
+        if jcount == 1:
+            return None
+        jobserver = _jobserver.create(jcount, ParallelContext._tokenavailable)
+    else:
+        jobserver = _jobserver.connect(auth, ParallelContext._tokenavailable)
+        if jobserver is None:
+            return None
+
+    atexit.register(jobserver.close)
+    return jobserver.auth
+
 def getcontext(jcount):
     global _serialContext, _parallelContext
     if jcount == 1:
@@ -0,0 +1,184 @@
+"""
+A pool of long-lived shells running the commands which need a shell, so that each of
+these commands doesn't start a shell of its own.
+
+Each worker is a shell reading its script from a FIFO. A command is sent to it as a
+subshell, which changes to the working directory of the command, sets the variables
+in which the environment of the command differs from the environment the worker
+started with, and evals the command line. The worker then writes the exit status of
+the subshell to a second FIFO. Whatever the command changes in its shell (the
+directory, variables, traps, ...) goes away with the subshell, so the worker is ready
+for the next command. A worker is replaced when the environment of a command can't be
+set from the shell, because a variable to set or unset isn't a shell identifier, and
+when it dies.
+
+Commands have the standard input and output of make, as when they run in a shell of
+their own.
+"""
+
+import os, sys, re, select, shlex, shutil, subprocess, tempfile, threading, logging
+
+_log = logging.getLogger('pymake.shellpool')
+
+_identifier = re.compile(r'[A-Za-z_][A-Za-z0-9_]*$')
+
+# how often, in seconds, a worker running a command is checked for having died
+_pollinterval = 1.0
+
+class ShellWorker(object):
+    """
+    A `shell` started with the environment `env`, which reads commands from and writes
+    their exit status to FIFOs called `name` in `directory`.
+    """
+
+    def __init__(self, shell, env, passfds, directory, name):
+        self.env = dict(env)
+        self.passfds = passfds
+
+        self.paths = commandpath, statuspath = (os.path.join(directory, name + '.commands'),
+                                                os.path.join(directory, name + '.status'))
+        os.mkfifo(commandpath)
+        os.mkfifo(statuspath)
+
+        # both ends are opened for reading and writing, so that neither open waits for
+        # the shell, and neither end sees the other closed while the worker starts
+        self.commandfd = os.open(commandpath, os.O_RDWR)
+        self.statusfd = os.open(statuspath, os.O_RDWR)
+
+        self.process = subprocess.Popen([shell, commandpath], env=self.env, pass_fds=passfds)
+        self._send('exec 8>%s\n' % shlex.quote(statuspath))
+
+    def canrun(self, env, passfds):
+        """
+        Return True if this worker is alive and can run a command with `env`.
+        """
+        if passfds != self.passfds or self.process.poll() is not None:
+            return False
+
+        for k in self.env:
+            if k not in env and not _identifier.match(k):
+                return False
+        for k, v in env.items():
+            if self.env.get(k) != v and not _identifier.match(k):
+                return False
+        return True
+
+    def _send(self, script):
+        data = script.encode(sys.getfilesystemencoding(), 'surrogateescape')
+        while len(data):
+            data = data[os.write(self.commandfd, data):]
+
+    def _readstatus(self):
+        status = b''
+        while not status.endswith(b'\n'):
+            r, w, x = select.select([self.statusfd], [], [], _pollinterval)
+            if not len(r):
+                if self.process.poll() is not None:
+                    return None
+                continue
+            status += os.read(self.statusfd, 64)
+        return int(status)
+
+    def run(self, cline, env, cwd):
+        """
+        Run `cline` in `cwd` with the environment `env`, and return its exit code, or
+        None if the worker died.
+        """
+        script = ['(', 'cd %s || exit 127' % shlex.quote(cwd)]
+
+        unset = [k for k in self.env if k not in env]
+        if len(unset):
+            script.append('unset %s' % ' '.join(unset))
+        for k, v in env.items():
+            if self.env.get(k) != v:
+                script.append('export %s=%s' % (k, shlex.quote(v)))
+
+        script.append('eval %s' % shlex.quote(cline))
+        script.append(') 8>&-')
+        script.append('echo $? >&8\n')
+
+        try:
+            self._send('\n'.join(script))
+        except OSError as e:
+            _log.debug("Couldn't send a command to shell %i: %s", self.process.pid, e)
+            return None
+        return self._readstatus()
+
+    def close(self):
+        # the shell exits at the end of its script
+        os.close(self.commandfd)
+        os.close(self.statusfd)
+        self.process.wait()
+        for path in self.paths:
+            os.unlink(path)
+
+class ShellPool(object):
+    """
+    Workers running `shell`, of which up to `size` are kept waiting for commands.
+    """
+
+    def __init__(self, shell, size):
+        self.shell = shell
+        self.size = size
+
+        self.started = 0 # number of workers started
+        self._idle = []
+        self._lock = threading.Lock()
+        self._directory = None
+
+    def _take(self, env, passfds):
+        with self._lock:
+            for i, worker in enumerate(self._idle):
+                if worker.canrun(env, passfds):
+                    return self._idle.pop(i)
+
+            if self._directory is None:
+                self._directory = tempfile.mkdtemp(prefix='pymake-shells-')
+            self.started += 1
+            name = str(self.started)
+
+        return ShellWorker(self.shell, env, passfds, self._directory, name)
+
+    def _give(self, worker):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(worker)
+                return
+
+        worker.close()
+
+    def run(self, cline, env, cwd, passfds=()):
+        """
+        Run `cline` in a worker, and return its exit code. `passfds` are the file
+        descriptors the command needs to inherit. Called from the thread waiting for the
+        command.
+        """
+        try:
+            worker = self._take(env, passfds)
+        except OSError as e:
+            print("Couldn't start shell '%s': %s" % (self.shell, e), file=sys.stderr)
+            return -127
+
+        result = worker.run(cline, env, cwd)
+        if result is None:
+            print("Shell '%s' running command '%s' died" % (self.shell, cline), file=sys.stderr)
+            worker.close()
+            return -127
+
+        self._give(worker)
+        return result
+
+    def close(self):
+        """
+        Stop every idle worker.
+        """
+        with self._lock:
+            workers = self._idle
+            self._idle = []
+
+        for worker in workers:
+            worker.close()
+
+        if self._directory is not None:
+            shutil.rmtree(self._directory, ignore_errors=True)
+            self._directory = None
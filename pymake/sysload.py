@@ -0,0 +1,160 @@
+"""
+How much of the machine a parallel make can use.
+
+usablecpus() is the number of jobs -j with no number (or -j0) runs: the CPUs this
+process may be scheduled on, further limited by a cgroup CPU quota, which is how
+containers are usually given a share of a larger machine.
+
+A LoadThrottle holds back new jobs while the machine is busy. With a maximum load
+average (-l), no job is started while the load average is at least that high, as in
+GNU make. In adaptive mode the number of jobs is lowered from -j by the load which
+doesn't come from this make's own jobs, and no job is started while processes are
+stalled waiting for memory (the Linux pressure stall information). Either way a job is
+always started when none are running, so the build keeps going.
+"""
+
+import os, math, time, logging
+
+_log = logging.getLogger('pymake.sysload')
+
+_cgroupv2cpu = '/sys/fs/cgroup/cpu.max'
+_cgroupv1quota = '/sys/fs/cgroup/cpu/cpu.cfs_quota_us'
+_cgroupv1period = '/sys/fs/cgroup/cpu/cpu.cfs_period_us'
+_memorypressure = '/proc/pressure/memory'
+
+# the share of the last 10 seconds some processes were stalled on memory, in percent,
+# above which no more jobs are started in adaptive mode
+_maxmemorypressure = 10.0
+
+# how often, in seconds, the load average and memory pressure are read again
+_interval = 1.0
+
+def _readfile(path):
+    try:
+        with open(path) as fd:
+            return fd.read()
+    except (OSError, UnicodeDecodeError):
+        return None
+
+def cgroupcpus():
+    """
+    Return the number of CPUs the cgroup CPU quota of this process amounts to, rounded
+    up, or None if there is no quota.
+    """
+    s = _readfile(_cgroupv2cpu)
+    if s is not None:
+        parts = s.split()
+        if len(parts) != 2 or parts[0] == 'max':
+            return None
+        quota, period = parts
+    else:
+        quota = _readfile(_cgroupv1quota)
+        period = _readfile(_cgroupv1period)
+        if quota is None or period is None:
+            return None
+
+    try:
+        quota, period = int(quota), int(period)
+    except ValueError:
+        return None
+
+    if quota <= 0 or period <= 0:
+        return None
+    return max(1, int(math.ceil(float(quota) / period)))
+
+def usablecpus():
+    """
+    Return the number of CPUs this process can use.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+
+    quota = cgroupcpus()
+    if quota is not None:
+        cpus = min(cpus, quota)
+
+    return cpus
+
+def loadaverage():
+    """
+    Return the one-minute load average, or None if the platform doesn't have one.
+    """
+    try:
+        return os.getloadavg()[0]
+    except (AttributeError, OSError):
+        return None
+
+def memorypressure():
+    """
+    Return the share of the last 10 seconds in which some processes were stalled waiting
+    for memory, in percent, or None if the kernel doesn't report it.
+    """
+    s = _readfile(_memorypressure)
+    if s is None:
+        return None
+
+    for line in s.splitlines():
+        fields = line.split()
+        if len(fields) and fields[0] == 'some':
+            for f in fields[1:]:
+                name, sep, value = f.partition('=')
+                if name == 'avg10':
+                    try:
+                        return float(value)
+                    except ValueError:
+                        return None
+    return None
+
+class LoadThrottle(object):
+    """
+    Decides whether the load on the machine allows another job to start. `maxload` is
+    the -l limit or None; `adaptive` turns on adjusting the number of jobs to the load.
+    """
+
+    def __init__(self, maxload, adaptive):
+        self.maxload = maxload
+        self.adaptive = adaptive
+
+        self._sampled = None
+        self._load = None
+        self._pressure = None
+
+    def _sample(self):
+        now = time.time()
+        if self._sampled is not None and now - self._sampled < _interval:
+            return
+
+        self._sampled = now
+        self._load = loadaverage()
+        if self.adaptive:
+            self._pressure = memorypressure()
+
+    def allows(self, running, jcount):
+        """
+        Return True if a job may start while `running` of this make's jobs are running,
+        with at most `jcount` jobs at once.
+        """
+        if running == 0:
+            return True
+
+        self._sample()
+
+        if self.maxload is not None and self._load is not None and self._load >= self.maxload:
+            _log.debug("Not starting a job: load average %.2f", self._load)
+            return False
+
+        if self.adaptive:
+            if self._pressure is not None and self._pressure >= _maxmemorypressure:
+                _log.debug("Not starting a job: memory pressure %.2f", self._pressure)
+                return False
+
+            if self._load is not None:
+                # this make's own jobs are part of the load
+                others = max(self._load - running, 0.0)
+                if running >= max(jcount - int(others), 1):
+                    _log.debug("Not starting a job: load average %.2f", self._load)
+                    return False
+
+        return True
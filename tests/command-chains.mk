@@ -0,0 +1,36 @@
+# Chains of simple commands joined by &&, || and ;, with redirections and two-stage
+# pipes, are run without a shell, and do what a shell would. Compound commands still go
+# to the shell.
+
+all: chain-and chain-or chain-redirect chain-pipe chain-compound
+	test ! -f chain-wrong
+	@echo TEST-PASS
+
+chain-and:
+	false && touch chain-wrong; true
+	touch chain-and.1 && touch chain-and.2
+	ls chain-and.1 chain-and.2 > $@
+
+chain-or:
+	true || touch chain-wrong
+	false || touch chain-or.1 ; ls chain-or.1 > $@
+	test "`cat $@`" = chain-or.1
+
+chain-redirect: chain-and
+	cat chain-and > chain-redirect.1 2>&1
+	cat chain-and >> chain-redirect.1
+	sort < chain-redirect.1 > $@
+	test "`wc -l < $@`" -eq 4
+	ls chain-missing > chain-redirect.err 2>&1 || true
+	test -s chain-redirect.err
+
+chain-pipe: chain-and
+	ls chain-and.1 chain-and.2 | sort -r > $@
+	test "`head -n 1 $@`" = chain-and.2
+	false | true
+
+chain-compound:
+	if test -f Makefile; then touch chain-wrong; else touch $@.1; fi
+	for i in 2 3; do touch $@.2 $@.3; done
+	! test -f chain-wrong && { touch $@.4; }
+	ls $@.1 $@.2 $@.3 $@.4 > $@
@@ -0,0 +1,18 @@
+#T commandline: ['-j4']
+# The commands of a grouped rule make all of its targets, so they run once even when
+# the targets are made at the same time.
+
+all: grouped-a.out grouped-b.out grouped-x.o grouped-y.o
+	test "`cat grouped-count`" = "run"
+	test "`cat grouped-static-count`" = "run"
+	@echo TEST-PASS
+
+grouped-a.out grouped-b.out &:
+	sleep 1
+	echo run >> grouped-count
+	touch grouped-a.out grouped-b.out
+
+grouped-x.o grouped-y.o &: grouped-%.o:
+	sleep 1
+	echo run >> grouped-static-count
+	touch grouped-x.o grouped-y.o
@@ -0,0 +1,22 @@
+#T yamlskip
+# Both targets try the same failing chain through gen.h before finding
+# the one through %.mid.
+
+$(shell touch a.in b.in a.src b.src)
+
+all: a.out b.out
+	test "$$(cat a.out)" = "a.mid"
+	test "$$(cat b.out)" = "b.mid"
+	@echo TEST-PASS
+
+%.out: %.in gen.h
+	echo $< gen.h > $@
+
+%.h: %.def
+	cp $< $@
+
+%.out: %.mid
+	cat $< > $@
+
+%.mid: %.src
+	echo $@ > $@
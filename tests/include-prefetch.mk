@@ -0,0 +1,19 @@
+#T environment: {'MAKEFLAGS': '--prefetch-includes=2'}
+$(shell echo "INCLUDED1 = yes" > prefetch-1.inc; echo "INCLUDED2 = yes" > prefetch-2.inc)
+$(shell echo "include prefetch-nested.inc" > prefetch-3.inc; echo "NESTED = yes" > prefetch-nested.inc)
+
+INCDIR := .
+PREFIX = prefetch
+
+include $(TESTPATH)/include-file.inc
+include prefetch-1.inc prefetch-2.inc
+
+ifdef INCLUDED
+include $(INCDIR)/$(PREFIX)-3.inc
+endif
+
+all:
+	test "$(INCLUDED)" = "yes"
+	test "$(INCLUDED1)$(INCLUDED2)" = "yesyes"
+	test "$(NESTED)" = "yes"
+	@echo TEST-PASS
@@ -0,0 +1,14 @@
+#T gmake skip
+#T yamlskip
+#T commandline: ['--deps-db=deps.db']
+
+all: file1
+	test -f deps.db
+	@echo TEST-PASS
+
+includedeps $(TESTPATH)/includedeps.deps
+
+file1:
+	touch $@
+
+filemissing:
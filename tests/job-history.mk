@@ -0,0 +1,14 @@
+#T commandline: ['-j2']
+#T environment: {'MAKEFLAGS': '--job-history=job-history.json'}
+# Jobs start in order of the work waiting on them, and still only after their
+# prerequisites.
+
+all: job-history-link
+	@echo TEST-PASS
+
+job-history-link: job-history-1.o job-history-2.o job-history-3.o
+	test -f job-history-1.o -a -f job-history-2.o -a -f job-history-3.o
+	touch $@
+
+job-history-1.o job-history-2.o job-history-3.o:
+	touch $@
@@ -0,0 +1,12 @@
+#T commandline: ['-j2']
+#T yamlskip
+# A parallel make tells recursive makes about its jobserver. Only recursive commands
+# inherit the jobserver's file descriptors.
+
+JOBSERVERFD = `echo "$$MAKEFLAGS" | sed -n 's/.*--jobserver-auth=\([0-9]*\),.*/\1/p'`
+
+all:
+	+@echo "$$MAKEFLAGS" | grep -e '--jobserver-auth='
+	+@fd=$(JOBSERVERFD); test -z "$$fd" || test -e /proc/self/fd/$$fd
+	@fd=$(JOBSERVERFD); test -z "$$fd" || test ! -e /proc/self/fd/$$fd
+	@echo TEST-PASS
@@ -0,0 +1,20 @@
+#T yamlskip
+#T environment: {'MAKEFLAGS': '--memoize-variables'}
+OPT = -O2
+CFLAGS = $(OPT) -I$(dir $@)
+LIST = $(foreach f,a b,$(f).o)
+
+all: sub/one other debug
+	test "$(CFLAGS)" = "-O2 -I./"
+	test "$(LIST)" = "a.o b.o"
+	@echo TEST-PASS
+
+sub/one:
+	test "$(CFLAGS)" = "-O2 -Isub/"
+
+other:
+	test "$(CFLAGS)" = "-O2 -I./"
+
+debug: OPT = -O0
+debug:
+	test "$(CFLAGS)" = "-O0 -I./"
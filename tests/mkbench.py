@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+"""
+Benchmark variable and recipe expansion.
+
+PYTHONPATH=. python tests/mkbench.py [-n iterations] [--no-compile] [--memoize-variables]
+    [makefile expression...]
+
+The makefile is parsed and executed, and then each expression is expanded `iterations`
+times. Without a makefile, a generated one with large recursively-expanded variables is
+used. --no-compile turns off compiling expansions, for comparison, and --memoize-variables
+turns on remembering the values of recursively-expanded variables.
+"""
+
+import sys, os, time, tempfile
+from optparse import OptionParser
+import pymake.data, pymake.parser
+
+_generated = """
+SRCS := $(foreach d,%(dirs)s,$(foreach f,%(files)s,$(d)/$(f).c))
+HEADERS = $(SRCS:.c=.h)
+OBJS = $(patsubst %%.c,%%.o,$(SRCS))
+INCDIRS = %(dirs)s include $(OBJDIR)/include
+INCLUDES = $(addprefix -I,$(INCDIRS))
+DEFINES = $(addprefix -D,%(defines)s)
+WARNINGS = -Wall -Wextra -Wno-unused-parameter
+OPTFLAGS = -O2 -g
+OBJDIR = obj
+CFLAGS = $(OPTFLAGS) $(WARNINGS) $(DEFINES) $(INCLUDES) $(EXTRA_CFLAGS)
+CSRCS = $(filter %%.c,$(SRCS) $(HEADERS))
+COMPILE = $(CC) $(CFLAGS) -c -o $(OBJDIR)/$(notdir $(@)) $(<)
+"""
+
+_expressions = ['$(COMPILE)', '$(CFLAGS)', '$(OBJS)', '$(CSRCS)']
+
+def generate(path):
+    with open(path, 'w') as fd:
+        fd.write(_generated % {
+            'dirs': ' '.join(['dir%i' % i for i in range(0, 20)]),
+            'files': ' '.join(['file%i' % i for i in range(0, 25)]),
+            'defines': ' '.join(['FEATURE_%i=1' % i for i in range(0, 40)]),
+            })
+
+def main(args):
+    op = OptionParser(usage="%prog [options] [makefile expression...]")
+    op.add_option('-n', type='int', dest='iterations', default=1000)
+    op.add_option('--no-compile', action='store_false', dest='compile', default=True)
+    op.add_option('--memoize-variables', action='store_true', dest='memoize', default=False)
+    options, args = op.parse_args(args)
+
+    pymake.data.compileexpansions = options.compile
+    pymake.data.memoizevariables = options.memoize
+
+    if len(args):
+        path = args[0]
+        expressions = args[1:]
+    else:
+        path = os.path.join(tempfile.mkdtemp(), 'bench.mk')
+        generate(path)
+        expressions = _expressions
+
+    makefile = pymake.data.Makefile(workdir=os.path.dirname(os.path.abspath(path)))
+    makefile.include(path)
+    makefile.finishparsing()
+
+    for s in expressions:
+        d = pymake.parser.Data.fromstring(s, '<mkbench>')
+        e, t, o = pymake.parser.parsemakesyntax(d, 0, (), pymake.parser.iterdata)
+
+        start = time.time()
+        for i in range(0, options.iterations):
+            result = e.resolvestr(makefile, makefile.variables)
+        elapsed = time.time() - start
+
+        print("%-20s %8.1f us/expansion (%i characters)" % (s, 1000000 * elapsed / options.iterations, len(result)))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,16 @@
+#T gmake skip
+# Native commands can't be part of a .ONESHELL script: they run between the shell
+# scripts of the lines around them.
+.ONESHELL:
+
+PYCOMMANDPATH = $(TESTPATH)
+
+all:
+	mkdir -p oneshell-native-dir
+	cd oneshell-native-dir
+	touch shell
+	%pycmd writetofile oneshell-native-dir/native native
+	cd oneshell-native-dir
+	test -f shell
+	test "`cat native`" = "native"
+	@echo TEST-PASS
@@ -0,0 +1,17 @@
+# With .ONESHELL the lines of a recipe run in one shell, so a cd carries over to the
+# lines after it. The modifiers of the first line apply to the whole recipe, and those
+# of the other lines are removed.
+.ONESHELL:
+
+all: oneshell-cd oneshell-ignore
+	@echo TEST-PASS
+
+oneshell-cd:
+	@mkdir -p oneshell-dir # TEST-FAIL
+	cd oneshell-dir
+	@touch here
+	test -f ../oneshell-dir/here
+
+oneshell-ignore:
+	-false
+	test -f oneshell-dir/missing
@@ -0,0 +1,20 @@
+#T yamlskip
+# A target isn't remade because an order-only prerequisite is newer than it.
+
+$(shell mkdir -p orderonly-dir; touch -t 200001010000 orderonly-dir/old.o; touch orderonly-dir/new)
+
+all: orderonly-dir/old.o orderonly-dir/made.o
+	@echo TEST-PASS
+
+orderonly-dir/old.o: | orderonly-dir
+	@echo "old.o was remade"; exit 1
+
+orderonly-dir/made.o: | orderonly-dir orderonly-made
+	test -f orderonly-made
+	touch $@
+
+orderonly-made:
+	touch $@
+
+orderonly-dir:
+	mkdir -p $@
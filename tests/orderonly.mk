@@ -0,0 +1,16 @@
+# Order-only prerequisites are made before the target, and are listed in $| but
+# not in $^ or $+.
+
+all: orderonly.out
+	test -f orderonly.out
+	@echo TEST-PASS
+
+orderonly.out: orderonly.in | orderonly-stamp orderonly.in
+	test -f orderonly-stamp
+	test "$^" = "orderonly.in"
+	test "$+" = "orderonly.in"
+	test "$|" = "orderonly-stamp"
+	touch $@
+
+orderonly.in orderonly-stamp:
+	touch $@
@@ -0,0 +1,11 @@
+#T commandline: ['-j2', 'parallel-goals-a', 'parallel-goals-b']
+# Goals given on the command line are built at the same time: the first one can only
+# finish once the second one has run.
+
+parallel-goals-a:
+	for i in 1 2 3 4 5 6 7 8 9 10; do test -f parallel-goals-b.out && break; sleep 1; done
+	test -f parallel-goals-b.out
+	@echo TEST-PASS
+
+parallel-goals-b:
+	touch parallel-goals-b.out
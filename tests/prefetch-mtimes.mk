@@ -0,0 +1,14 @@
+#T environment: {'MAKEFLAGS': '--prefetch-mtimes=4'}
+$(shell touch prefetch-mtimes.in)
+
+all: prefetch-mtimes.out phony
+	test -f prefetch-mtimes.out
+	@echo TEST-PASS
+
+prefetch-mtimes.out: prefetch-mtimes.in
+	touch $@
+
+phony:
+	@true
+
+.PHONY: phony
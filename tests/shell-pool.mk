@@ -0,0 +1,25 @@
+#T gmake skip
+#T yamlskip
+#T commandline: ['--shell-pool', '-j2']
+# Commands which need a shell run in the shells of the pool. Each command starts in the
+# directory of the make, with its own environment, whatever the commands before it did.
+
+export POOLVAR = value
+
+all: shell-pool-a shell-pool-b shell-pool-c
+	test "`cat shell-pool-a`" = "value"
+	test -f shell-pool-b
+	test -f shell-pool-c
+	@echo TEST-PASS
+
+shell-pool-a:
+	mkdir -p shell-pool-dir && cd shell-pool-dir && export POOLVAR=leaked
+	echo "$$POOLVAR" > $@
+
+shell-pool-b: POOLVAR = changed
+shell-pool-b: shell-pool-a
+	cd shell-pool-dir; test "`pwd`" != "$(CURDIR)"
+	test "$$POOLVAR" = changed && touch $@
+
+shell-pool-c:
+	sleep 1; touch $@
@@ -43,10 +43,10 @@ class ParentDict(dict):
 
         return self.parent[k]
 
-def run_test(makefile, make, logfile, options, commandline):
+def run_test(makefile, make, logfile, options, commandline, stderrdir):
     """
     Given a makefile path, test it with a given `make` and return
-    (pass, message).
+    (pass, message). The stderr of each make goes to a file in `stderrdir`.
     """
 
     stdin = sys.stdin
@@ -56,10 +56,10 @@ def run_test(makefile, make, logfile, options, commandline):
 
     for c in commandline:
         if i == 0:
-            stderr = open('{}.stderr'.format(i), 'w')
+            stderr = open(os.path.join(stderrdir, '{}.stderr'.format(i)), 'w')
             process = subprocess.Popen(make + c, stdout=stdout, stderr=stderr, env=options['env'])
         else:
-            stderr = open('{}.stderr'.format(i), 'w')
+            stderr = open(os.path.join(stderrdir, '{}.stderr'.format(i)), 'w')
             process = subprocess.Popen(make + c, stdin=stdin, stdout=stdout, stderr=stderr, env=options['env'])
 
         i += 1
@@ -181,7 +181,8 @@ def test_scenarios(makefile, tmp_path_factory, gmake, pymake):
         gmakepass, gmakemsg = True, ''
     else:
         gmakepass, gmakemsg = run_test(makefile, [gmake],
-                                      makefile + '.gmakelog', gmakeoptions, [gmakeoptions['commandline']])
+                                      makefile + '.gmakelog', gmakeoptions, [gmakeoptions['commandline']],
+                                      str(tmp_path_factory.mktemp("gmake-stderr")))
 
     if gmakeoptions['pass']:
         if not gmakepass:
@@ -197,7 +198,8 @@ def test_scenarios(makefile, tmp_path_factory, gmake, pymake):
         pymakepass, pymakemsg = True, ''
     else:
         pymakepass, pymakemsg = run_test(makefile, pymake,
-                                        makefile + '.pymakelog', pymakeoptions, [pymakeoptions['commandline1'], pymakeoptions['commandline2']])
+                                        makefile + '.pymakelog', pymakeoptions, [pymakeoptions['commandline1'], pymakeoptions['commandline2']],
+                                        str(tmp_path_factory.mktemp("pymake-stderr")))
 
     if pymakeoptions['pass']:
         if not pymakepass:
@@ -1,6 +1,6 @@
-import pymake.data, pymake.functions, pymake.util
+import pymake.data, pymake.errors, pymake.functions, pymake.jobhistory, pymake.jobserver, pymake.parser, pymake.process, pymake.shellpool, pymake.util
 import unittest
-import re
+import os, re, shutil, tempfile, threading
 
 
 def multitest(cls):
@@ -200,5 +200,339 @@ class ExpansionTest(unittest.TestCase):
         self.assertTrue(e.is_filesystem_dependent)
 
 
+class SimpleVariableTest(unittest.TestCase):
+    def test_shared_expansion(self):
+        v = pymake.data.Variables()
+        v.set('A', pymake.data.Variables.FLAVOR_SIMPLE, pymake.data.Variables.SOURCE_AUTOMATIC, 'foo.o')
+        v.set('B', pymake.data.Variables.FLAVOR_SIMPLE, pymake.data.Variables.SOURCE_AUTOMATIC, 'foo.o')
+
+        flavor, source, a = v.get('A')
+        self.assertTrue(isinstance(a, pymake.data.StringExpansion))
+        self.assertEqual(a.s, 'foo.o')
+        self.assertTrue(v.get('A')[2] is a)
+
+        # expansions keep the name of their variable for error messages
+        self.assertEqual(a.loc.path, "Expansion of variable 'A'")
+        self.assertEqual(v.get('B')[2].loc.path, "Expansion of variable 'B'")
+
+        # a variable set to the same value again, as automatic variables are for each
+        # rule, gets the same expansion
+        child = pymake.data.Variables(parent=v)
+        child.set('A', pymake.data.Variables.FLAVOR_SIMPLE, pymake.data.Variables.SOURCE_AUTOMATIC, 'foo.o')
+        self.assertTrue(child.get('A')[2] is a)
+
+        # the value must not be parsed
+        v.set('C', pymake.data.Variables.FLAVOR_SIMPLE, pymake.data.Variables.SOURCE_AUTOMATIC, '$(A)')
+        self.assertEqual(v.get('C')[2].s, '$(A)')
+
+    def test_append(self):
+        m = pymake.data.Makefile()
+        v = m.variables
+        v.set('A', pymake.data.Variables.FLAVOR_SIMPLE, pymake.data.Variables.SOURCE_MAKEFILE, 'a')
+        v.set('B', pymake.data.Variables.FLAVOR_SIMPLE, pymake.data.Variables.SOURCE_MAKEFILE, 'b')
+        v.append('A', pymake.data.Variables.SOURCE_MAKEFILE, '$(B)', v, m)
+        self.assertEqual(v.get('A')[2].s, 'a b')
+        self.assertEqual(v.get('A', expand=False)[2], 'a b')
+
+class PatternRuleIndexTest(unittest.TestCase):
+    def rule(self, *targets):
+        return pymake.data.PatternRule([pymake.data.Pattern(t) for t in targets], [], False, None)
+
+    def test_candidates(self):
+        c = self.rule('%.c')
+        o = self.rule('%.o', 'lib%.a')
+        anything = self.rule('%')
+        prefix = self.rule('gen-%')
+        h = self.rule('src/%.h')
+        exact = self.rule('%.o.d')
+
+        index = pymake.data.PatternRuleIndex([c, o, anything, prefix, h, exact])
+        self.assertEqual(index.candidates('foo.o'), [o, anything, prefix])
+        self.assertEqual(index.candidates('libfoo.a'), [o, anything, prefix])
+        self.assertEqual(index.candidates('dir/foo.o.d'), [anything, prefix, exact])
+        self.assertEqual(index.candidates('x.c'), [c, anything, prefix])
+        self.assertEqual(index.candidates(''), [anything, prefix])
+
+class StatCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'file')
+        self.cache = pymake.data.StatCache()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_cached(self):
+        self.assertEqual(self.cache.getmtime(self.path), None)
+        open(self.path, 'w').close()
+        self.assertEqual(self.cache.getmtime(self.path), None)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+        self.cache.filesmodified()
+        self.assertEqual(self.cache.getmtime(self.path), os.stat(self.path).st_mtime_ns / 1e9)
+
+    def test_trust(self):
+        self.cache.trust = True
+        other = os.path.join(self.dir, 'other')
+        self.assertEqual(self.cache.getmtime(self.path), None)
+        self.assertEqual(self.cache.getmtime(other), None)
+        open(self.path, 'w').close()
+        open(other, 'w').close()
+
+        # only the remade file is forgotten
+        self.cache.filesmodified(self.path)
+        self.assertNotEqual(self.cache.getmtime(self.path), None)
+        self.assertEqual(self.cache.getmtime(other), None)
+
+        self.cache.filesmodified()
+        self.assertEqual(self.cache.getmtime(other), None)
+
+    def test_prefetch(self):
+        open(self.path, 'w').close()
+        other = os.path.join(self.dir, 'other')
+        self.cache.prefetch([self.path, other, self.path], 2)
+        self.assertEqual(self.cache.misses, 2)
+
+        self.assertEqual(self.cache.getmtime(self.path), os.stat(self.path).st_mtime_ns / 1e9)
+        self.assertEqual(self.cache.getmtime(other), None)
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 2))
+
+class JobHistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'history')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_record(self):
+        h = pymake.jobhistory.JobHistory(self.path)
+        self.assertEqual(h.duration('/a'), 0)
+        h.record('/a', 4.0)
+        h.record('/link', 10.0)
+        self.assertEqual(h.remaining('/a', ['/link', '<command-line>']), 14.0)
+        h.save()
+
+        h = pymake.jobhistory.JobHistory(self.path)
+        self.assertEqual(h.duration('/a'), 4.0)
+        h.record('/a', 2.0)
+        self.assertEqual(h.duration('/a'), 3.0)
+
+    def test_merge(self):
+        h1 = pymake.jobhistory.JobHistory(self.path)
+        h2 = pymake.jobhistory.JobHistory(self.path)
+        h1.record('/a', 1.0)
+        h2.record('/b', 2.0)
+        h1.save()
+        h2.save()
+
+        h = pymake.jobhistory.JobHistory(self.path)
+        self.assertEqual((h.duration('/a'), h.duration('/b')), (1.0, 2.0))
+
+    def test_corrupt(self):
+        with open(self.path, 'w') as fd:
+            fd.write('{"durations": ')
+        h = pymake.jobhistory.JobHistory(self.path)
+        self.assertEqual(h.duration('/a'), 0)
+
+class ParallelContextTest(unittest.TestCase):
+    def test_priority(self):
+        context = pymake.process.ParallelContext(4)
+        for name, priority in (('first', 0), ('long', 5), ('second', 0), ('longer', 7)):
+            job = context.call(['true'], shell=False, env=None, cwd=None, cb=None, echo=None,
+                               justprint=True, priority=priority)
+            job.name = name
+        context.run()
+        started = [job.name for job in context.running]
+        self.assertEqual(started, ['longer', 'long', 'first', 'second'])
+
+        for c, job in pymake.process.ParallelContext._waitany():
+            del context.running[job]
+        context.finish()
+
+class CommandChainTest(unittest.TestCase):
+    def test_chains(self):
+        chain = pymake.process.clinetochain
+        self.assertEqual(chain('a && b || c; d', '/'),
+                         [(None, [(['a'], [])]), ('&&', [(['b'], [])]), ('||', [(['c'], [])]), (';', [(['d'], [])])])
+        self.assertEqual(chain("cc -c 'x y.c' >x.o 2>&1 < /dev/null", '/'),
+                         [(None, [(['cc', '-c', 'x y.c'], [(1, '>', 'x.o'), (2, '>&', 1), (0, '<', '/dev/null')])])])
+        self.assertEqual(chain('a "b|c" | sort 2>>err', '/'),
+                         [(None, [(['a', 'b|c'], []), (['sort'], [(2, '>>', 'err')])])])
+
+    def test_shell(self):
+        chain = pymake.process.clinetochain
+        for cline in ('a | b | c', 'a &', 'test -f x && b', 'a $(b) && c', 'x=1 && b',
+                      'a > *.o', 'a 2>&3', 'a <<EOF', 'a && && b', '(a) && b', 'a "b',
+                      'ls 3>/dev/null', 'a 3>&1', 'a 12>x',
+                      'if test -f x; then a; else b; fi', 'for i in a b; do c; done',
+                      'while a; do b; done', 'until a; do b; done', 'case x in a) b;; esac',
+                      '! a && b', '{ a; b; } > x', '[[ a ]] && b', 'time a && b', 'a; function f'):
+            self.assertEqual(chain(cline, '/'), None, cline)
+
+class CommandCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.saved = pymake.process.commandcache
+        self.cache = pymake.process.commandcache = pymake.process.CommandCache(2)
+
+    def tearDown(self):
+        pymake.process.commandcache = self.saved
+        shutil.rmtree(self.dir)
+
+    def test_cached(self):
+        prepared = pymake.process._preparecommand('cc -c a.c', self.dir)
+        self.assertEqual(prepared[1], ['cc', '-c', 'a.c'])
+        self.assertTrue(pymake.process._preparecommand('cc -c a.c', self.dir) is prepared)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+        # the least recently used command line is dropped
+        pymake.process._preparecommand('cc -c b.c', self.dir)
+        pymake.process._preparecommand('cc -c a.c', self.dir)
+        pymake.process._preparecommand('cc -c c.c', self.dir)
+        self.assertEqual(self.cache.misses, 3)
+        pymake.process._preparecommand('cc -c b.c', self.dir)
+        self.assertEqual(self.cache.misses, 4)
+
+    def test_globbed(self):
+        self.assertEqual(pymake.process._preparecommand('ls *.c', self.dir)[1], ['ls', '*.c'])
+        open(os.path.join(self.dir, 'a.c'), 'w').close()
+        self.assertEqual(pymake.process._preparecommand('ls *.c', self.dir)[1], ['ls', 'a.c'])
+        self.assertEqual(self.cache.hits, 0)
+
+class ShellPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.pool = pymake.shellpool.ShellPool('/bin/sh', 1)
+        self.env = {'PATH': os.environ['PATH'], 'VAR': 'value'}
+
+    def tearDown(self):
+        self.pool.close()
+        shutil.rmtree(self.dir)
+
+    def test_reset(self):
+        pool = self.pool
+        self.assertEqual(pool.run('cd /; export VAR=changed; exit 3', self.env, self.dir), 3)
+        self.assertEqual(pool.run('test "`pwd`" = "%s" && test "$VAR" = value' % self.dir, self.env, self.dir), 0)
+        self.assertEqual(pool.run('test "$VAR" = "it\'s"', dict(self.env, VAR="it's"), self.dir), 0)
+        self.assertEqual(pool.run('test -z "$VAR"', {'PATH': os.environ['PATH']}, self.dir), 0)
+        self.assertEqual(pool.run('if then', self.env, self.dir), 2)
+        self.assertEqual(pool.started, 1)
+
+    def test_respawn(self):
+        pool = self.pool
+        self.assertEqual(pool.run('true', self.env, self.dir), 0)
+        # a variable which the shell can't set needs a new worker
+        self.assertEqual(pool.run('true', dict(self.env, **{'A.B': '1'}), self.dir), 0)
+        self.assertEqual(pool.started, 2)
+
+        self.assertEqual(pool.run('kill -9 $$', self.env, self.dir), -127)
+        self.assertEqual(pool.run('true', self.env, self.dir), 0)
+        self.assertEqual(pool.started, 3)
+
+class JobServerTest(unittest.TestCase):
+    def setUp(self):
+        self.arrived = threading.Event()
+        self.jobserver = pymake.jobserver.create(3, self.arrived.set)
+
+    def tearDown(self):
+        os.close(self.jobserver.rfd)
+        os.close(self.jobserver.wfd)
+
+    def test_tokens(self):
+        js = self.jobserver
+        # the first job doesn't need a token
+        self.assertTrue(js.acquire(0))
+        self.assertFalse(js.acquire(1))
+        self.assertTrue(self.arrived.wait(10))
+        self.assertTrue(js.acquire(1))
+        self.assertEqual(js.held, [b'+'])
+
+        # one token is left in the pipe
+        self.arrived.clear()
+        self.assertFalse(js.acquire(2))
+        self.assertTrue(self.arrived.wait(10))
+        self.assertTrue(js.acquire(2))
+
+        js.release(1, 0)
+        self.assertEqual(js.held, [])
+        self.assertEqual(os.read(js.rfd, 2), b'++')
+
+    def test_connect(self):
+        js = pymake.jobserver.connect(self.jobserver.auth, None)
+        self.assertEqual(js.fds, self.jobserver.fds)
+
+        r, w = os.pipe()
+        os.close(r)
+        os.close(w)
+        self.assertEqual(pymake.jobserver.connect('%i,%i' % (r, w), None), None)
+        self.assertEqual(pymake.jobserver.connect('garbage', None), None)
+
+class VariableMemoizationTest(unittest.TestCase):
+    def setUp(self):
+        pymake.data.memoizevariables = True
+        self.m = pymake.data.Makefile()
+        self.set('OPT', '-O2')
+        self.set('CFLAGS', '$(OPT) $(DEFINES)')
+
+    def tearDown(self):
+        pymake.data.memoizevariables = False
+
+    def set(self, name, value, variables=None):
+        if variables is None:
+            variables = self.m.variables
+        variables.set(name, pymake.data.Variables.FLAVOR_RECURSIVE,
+                      pymake.data.Variables.SOURCE_MAKEFILE, value)
+
+    def resolve(self, s, variables=None):
+        if variables is None:
+            variables = self.m.variables
+        d = pymake.parser.Data.fromstring(s, None)
+        e, t, o = pymake.parser.parsemakesyntax(d, 0, (), pymake.parser.iterdata)
+        return e.resolvestr(self.m, variables)
+
+    def test_memoized(self):
+        self.assertEqual(self.resolve('$(CFLAGS)'), '-O2 ')
+        self.assertTrue(isinstance(self.m.variables._memo['CFLAGS'], tuple))
+        self.assertEqual(self.resolve('$(CFLAGS)'), '-O2 ')
+        self.assertEqual(self.resolve('$(CFLAGS:-%=+%)'), '+O2')
+
+    def test_modified(self):
+        self.assertEqual(self.resolve('$(CFLAGS)'), '-O2 ')
+        self.set('DEFINES', '-DFOO')
+        self.assertEqual(self.resolve('$(CFLAGS)'), '-O2 -DFOO')
+        self.set('OPT', '-O0')
+        self.assertEqual(self.resolve('$(CFLAGS)'), '-O0 -DFOO')
+
+    def test_nested(self):
+        self.set('COMPILE', 'cc $(CFLAGS)')
+        self.assertEqual(self.resolve('$(COMPILE)'), 'cc -O2 ')
+        self.set('OPT', '-O0')
+        self.assertEqual(self.resolve('$(COMPILE)'), 'cc -O0 ')
+
+    def test_hidden(self):
+        self.assertEqual(self.resolve('$(CFLAGS)'), '-O2 ')
+
+        v = pymake.data.Variables(parent=self.m.variables)
+        self.set('OPT', '-O0', v)
+        self.assertEqual(self.resolve('$(CFLAGS)', v), '-O0 ')
+        self.assertEqual(self.resolve('$(foreach OPT,-g,$(CFLAGS))'), '-g ')
+        self.assertEqual(self.resolve('$(CFLAGS)'), '-O2 ')
+
+    def test_not_memoizable(self):
+        self.set('NOW', '$(shell echo $(OPT))')
+        self.set('FLAGS', '$(NOW) -g')
+        self.assertEqual(self.resolve('$(FLAGS)'), '-O2 -g')
+        self.assertFalse(isinstance(self.m.variables._memo.get('FLAGS'), tuple))
+
+        self.set('FILES', '$(wildcard *.nonexistent)')
+        self.assertEqual(self.resolve('$(FILES)'), '')
+        self.assertFalse(isinstance(self.m.variables._memo.get('FILES'), tuple))
+
+    def test_recursive_reference(self):
+        self.set('SELF', '$(OPT) $(SELF)')
+        self.assertRaises(pymake.errors.DataError, self.resolve, '$(SELF)')
+        self.assertRaises(pymake.errors.DataError, self.resolve, '$(SELF)')
+
 if __name__ == '__main__':
     unittest.main()
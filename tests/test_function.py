@@ -2,6 +2,7 @@ import unittest
 
 import pymake.data
 import pymake.functions
+import pymake.parser
 
 class VariableRefTest(unittest.TestCase):
     def test_get_expansions(self):
@@ -50,5 +51,38 @@ class GetExpansionsTest(unittest.TestCase):
 
         self.assertFalse(f.is_filesystem_dependent)
 
+class CompileTest(unittest.TestCase):
+    testdata = (
+        ('$(FOO)', 'a.c b.c'),
+        ('x$(FOO)y', 'xa.c b.cy'),
+        ('$(FOO) $(BAR)', 'a.c b.c %.c'),
+        ('$(FOO:.c=.o)', 'a.o b.o'),
+        ('$(patsubst %.c,%.o,$(FOO) c.h)', 'a.o b.o c.h'),
+        ('$(patsubst %.c,obj,$(FOO))', 'obj obj'),
+        ('$(filter %.c,$(FOO) c.h)', 'a.c b.c'),
+        ('$(filter c.h a.c,$(FOO) c.h)', 'a.c c.h'),
+        ('$(filter a% c.h,$(FOO) c.h)', 'a.c c.h'),
+        ('$(addprefix -I,$(FOO))', '-Ia.c -Ib.c'),
+        ('$(addprefix -D,X Y)', '-DX -DY'),
+        ('$(addprefix $(BAR),x y)', '%.cx %.cy'),
+        ('$(words $(FOO))', '2'),
+    )
+
+    def test_compiled(self):
+        m = pymake.data.Makefile()
+        m.variables.set('FOO', pymake.data.Variables.FLAVOR_RECURSIVE,
+                        pymake.data.Variables.SOURCE_MAKEFILE, 'a.c b.c')
+        m.variables.set('BAR', pymake.data.Variables.FLAVOR_SIMPLE,
+                        pymake.data.Variables.SOURCE_MAKEFILE, '%.c')
+
+        for s, expected in self.testdata:
+            d = pymake.parser.Data.fromstring(s, None)
+            e, t, o = pymake.parser.parsemakesyntax(d, 0, (), pymake.parser.iterdata)
+
+            # the first resolution is interpreted, later ones use the compiled function
+            for i in range(0, 3):
+                self.assertEqual(e.resolvestr(m, m.variables), expected, s)
+            self.assertTrue(callable(e._compiled), s)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,69 @@
+import os, shutil, tempfile
+import unittest
+
+import pymake.globrelative
+
+class DirCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache = pymake.globrelative.DirCache()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def touch(self, name):
+        open(os.path.join(self.dir, name), 'w').close()
+
+    def test_listdir(self):
+        self.touch('a')
+        self.touch('.hidden')
+        os.mkdir(os.path.join(self.dir, 'sub'))
+        os.symlink('missing', os.path.join(self.dir, 'broken'))
+
+        self.assertEqual(sorted(self.cache.listdir(self.dir)), ['.hidden', 'a', 'sub'])
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 1))
+
+        self.touch('b')
+        self.assertEqual(sorted(self.cache.listdir(self.dir)), ['.hidden', 'a', 'sub'])
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+        self.cache.invalidate()
+        self.assertEqual(sorted(self.cache.listdir(self.dir)), ['.hidden', 'a', 'b', 'sub'])
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 2))
+
+    def test_names(self):
+        self.touch('a')
+        self.assertEqual(self.cache.names(self.dir), set(['a']))
+        self.assertEqual(self.cache.names(os.path.join(self.dir, 'missing')), set())
+
+        self.touch('b')
+        self.assertEqual(self.cache.names(self.dir), set(['a']))
+        self.cache.invalidate()
+        self.assertEqual(self.cache.names(self.dir), set(['a', 'b']))
+
+    def test_isfresh(self):
+        self.assertTrue(self.cache.isfresh(self.dir))
+        self.cache.names(self.dir)
+        self.assertTrue(self.cache.isfresh(self.dir))
+
+        # once a listing has been thrown away, files are stat()ed instead of listing again
+        self.cache.invalidate()
+        self.assertFalse(self.cache.isfresh(self.dir))
+        self.cache.listdir(self.dir)
+        self.assertTrue(self.cache.isfresh(self.dir))
+
+    def test_glob(self):
+        self.touch('x.c')
+        self.touch('y.c')
+        self.touch('.z.c')
+        os.mkdir(os.path.join(self.dir, 'sub'))
+        self.touch(os.path.join('sub', 'w.c'))
+
+        self.assertEqual(pymake.globrelative.glob(self.dir, '*.c'), ['x.c', 'y.c'])
+        self.assertEqual(pymake.globrelative.glob(self.dir, '.*.c'), ['.z.c'])
+        self.assertEqual(pymake.globrelative.glob(self.dir, '*/*.c'), ['sub/w.c'])
+        self.assertEqual(pymake.globrelative.glob(self.dir, 'x.c'), ['x.c'])
+        self.assertEqual(pymake.globrelative.glob(self.dir, 'q.c'), [])
+
+if __name__ == '__main__':
+    unittest.main()
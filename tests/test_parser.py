@@ -1,6 +1,8 @@
-import pymake.data, pymake.parser, pymake.parserdata, pymake.functions
+import pymake.data, pymake.parser, pymake.parserdata, pymake.functions, pymake.parsecache, pymake.depsdb, pymake.errors
 import unittest
 import logging
+import os, sys, shutil, tempfile, glob, pickle, subprocess
+from concurrent import futures
 
 
 def multitest(cls):
@@ -239,6 +241,124 @@ class MakeSyntaxTest(TestBase):
 
 multitest(MakeSyntaxTest)
 
+class DepsDBTest(TestBase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.depfile = os.path.join(os.path.realpath(self.tmpdir), 'foo.d')
+        with open(self.depfile, 'w') as fd:
+            fd.write("foo.o: foo.c \\\n  foo.h\n\nfoo.h:\n")
+        pymake.parser.setdepsdb(os.path.join(self.tmpdir, 'deps.db'))
+
+    def tearDown(self):
+        pymake.parser.setdepsdb(None)
+        shutil.rmtree(self.tmpdir)
+
+    def reopen(self):
+        pymake.parser.savedepsdb()
+        pymake.parser.setdepsdb(None)
+        pymake.parser.setdepsdb(os.path.join(self.tmpdir, 'deps.db'))
+        return pymake.parser._depsdb
+
+    def test_reuse(self):
+        stmts = pymake.parser.parsedepfile(self.depfile)
+        self.assertEqual(pymake.parser._depsdb.misses, 1)
+
+        db = self.reopen()
+        cached = pymake.parser.parsedepfile(self.depfile)
+        self.assertEqual((db.hits, db.misses), (1, 0))
+        self.assertEqual(cached.to_source(), stmts.to_source())
+        self.assertEqual(len(cached), 2)
+
+    def test_modified(self):
+        pymake.parser.parsedepfile(self.depfile)
+        db = self.reopen()
+        with open(self.depfile, 'a') as fd:
+            fd.write("bar.o: bar.c\n")
+
+        stmts = pymake.parser.parsedepfile(self.depfile)
+        self.assertEqual((db.hits, db.misses), (0, 1))
+        self.assertEqual(len(stmts), 3)
+
+        db = self.reopen()
+        self.assertEqual(len(pymake.parser.parsedepfile(self.depfile)), 3)
+        self.assertEqual((db.hits, db.misses), (1, 0))
+
+    def test_merge(self):
+        # two makes sharing the database each read a different .d file
+        otherfile = os.path.join(os.path.realpath(self.tmpdir), 'bar.d')
+        with open(otherfile, 'w') as fd:
+            fd.write("bar.o: bar.c\n")
+        path = os.path.join(self.tmpdir, 'deps.db')
+        first = pymake.depsdb.DepsDB(path)
+        second = pymake.depsdb.DepsDB(path)
+        first.getlines(self.depfile, pymake.parser._readdepfile)
+        second.getlines(otherfile, pymake.parser._readdepfile)
+        first.save()
+        second.save()
+
+        db = pymake.depsdb.DepsDB(path)
+        db.getlines(self.depfile, pymake.parser._readdepfile)
+        db.getlines(otherfile, pymake.parser._readdepfile)
+        self.assertEqual((db.hits, db.misses), (2, 0))
+
+        # records of .d files which were found removed are dropped
+        os.unlink(otherfile)
+        db.forget(otherfile)
+        db.save()
+        self.assertEqual(list(pymake.depsdb._read(path)[1]), [self.depfile])
+
+    def test_nostat(self):
+        # saving doesn't look at the .d files of records which weren't looked up
+        pymake.parser.parsedepfile(self.depfile)
+        db = self.reopen()
+        otherfile = os.path.join(os.path.realpath(self.tmpdir), 'bar.d')
+        with open(otherfile, 'w') as fd:
+            fd.write("bar.o: bar.c\n")
+        pymake.parser.parsedepfile(otherfile)
+        os.unlink(self.depfile)
+        db.save()
+        self.assertEqual(sorted(pymake.depsdb._read(db.path)[1]), sorted([self.depfile, otherfile]))
+
+class SinglePassMakeSyntaxTest(MakeSyntaxTest):
+    def setUp(self):
+        pymake.parser.setscanner('singlepass')
+
+    def tearDown(self):
+        pymake.parser.setscanner('regex')
+
+class ScannerTest(TestBase):
+    """
+    The single-pass scanner must produce exactly the same statements as the regex scanner.
+    """
+
+    def parse(self, scanner, s, path):
+        pymake.parser.setscanner(scanner)
+        try:
+            return pickle.dumps(pymake.parser.parsestring(s, path))
+        except pymake.errors.SyntaxError as e:
+            return str(e)
+        finally:
+            pymake.parser.setscanner('regex')
+
+    def test_makefiles(self):
+        for path in glob.glob(os.path.join(os.path.dirname(__file__), '*.mk')):
+            with open(path) as fd:
+                s = fd.read()
+            self.assertEqual(self.parse('singlepass', s, path), self.parse('regex', s, path), path)
+
+    def test_escapes(self):
+        s = "a\\\\#b \\# $# x:\\y $$(c) $(if $(a),\\\n  b) : d # comment\n\techo $(info a#b) \\\n\t# c\n"
+        self.assertEqual(self.parse('singlepass', s, 'escapes'), self.parse('regex', s, 'escapes'))
+
+    def test_unknown_environment(self):
+        env = dict(os.environ, PYMAKE_SCANNER='bogus')
+        p = subprocess.run([sys.executable, '-c', 'import pymake.parser; print(pymake.parser._scanner.__name__)'],
+                           env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
+                           cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        self.assertEqual(p.returncode, 0, p.stderr)
+        self.assertEqual(p.stdout.strip(), '_regexmakesyntax')
+        self.assertIn("PYMAKE_SCANNER", p.stderr)
+
 class VariableTest(TestBase):
     testdata = """
     VAR = value
@@ -308,6 +428,155 @@ all:: test test2 $(VAR)
         self.assertEqual(len(irule.prerequisites), 1, "%.o prerequisite count")
         self.assertEqual(irule.targetpatterns[0].match('foo.o'), 'foo', "%.o stem")
 
+class OrderOnlyRuleTest(TestBase):
+    testdata = """
+DIR = out
+all: a b | $(DIR) c; echo $|
+$(DIR)/x.o: $(DIR)/%.o: %.c | $(DIR)
+objs: | $(DIR)
+"""
+
+    def runTest(self):
+        stmts = pymake.parser.parsestring(self.testdata, 'OrderOnlyRuleTest')
+        self.assertEqual(pymake.parser.parsestring(stmts.to_source(), 'OrderOnlyRuleTest'), stmts)
+
+        m = pymake.data.Makefile()
+        stmts.execute(m)
+        rule, = m.gettarget('all').rules
+        self.assertEqual(rule.prerequisites, ['a', 'b'])
+        self.assertEqual(rule.orderonly, ['out', 'c'])
+        self.assertEqual(len(rule.commands), 1)
+
+        rule, = m.gettarget('out/x.o').rules
+        self.assertEqual(rule.prerequisites, ['x.c'])
+        self.assertEqual(rule.orderonly, ['out'])
+
+        rule, = m.gettarget('objs').rules
+        self.assertEqual((rule.prerequisites, rule.orderonly), ([], ['out']))
+
+class GroupedRuleTest(TestBase):
+    testdata = """
+gen.h gen.c &: gen.y
+	echo $@
+x.o y.o &: %.o: %.c | out
+a&: b
+T = c d
+$(T)&: e
+"""
+
+    def runTest(self):
+        stmts = pymake.parser.parsestring(self.testdata, 'GroupedRuleTest')
+        self.assertEqual(pymake.parser.parsestring(stmts.to_source(), 'GroupedRuleTest'), stmts)
+
+        m = pymake.data.Makefile()
+        stmts.execute(m)
+        rule, = m.gettarget('gen.h').rules
+        self.assertTrue(m.gettarget('gen.c').rules[0] is rule)
+        self.assertEqual(rule.group.targets, ['gen.h', 'gen.c'])
+
+        x, = m.gettarget('x.o').rules
+        y, = m.gettarget('y.o').rules
+        self.assertTrue(x.group is y.group)
+        self.assertEqual(x.group.targets, ['x.o', 'y.o'])
+
+        self.assertEqual(m.gettarget('a').rules[0].group.targets, ['a'])
+        self.assertEqual(m.gettarget('c').rules[0].group.targets, ['c', 'd'])
+
+class GroupedRuleErrorTest(TestBase):
+    def test_variable(self):
+        self.assertRaises(pymake.errors.SyntaxError, pymake.parser.parsestring,
+                          "c d &: X = 1\n", 'GroupedRuleErrorTest')
+
+    def test_expanded(self):
+        for s in ("T = a b &\n$(T):\n", "T = a b&\n$(T): c\n", "T = a b &\n$(T): %: %.c\n"):
+            stmts = pymake.parser.parsestring(s, 'GroupedRuleErrorTest')
+            self.assertRaises(pymake.errors.DataError, stmts.execute, pymake.data.Makefile())
+
+class ParseCacheTest(TestBase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cachedir = os.path.join(self.tmpdir, 'cache')
+        self.makefile = os.path.join(self.tmpdir, 'Makefile')
+        with open(self.makefile, 'w') as fd:
+            fd.write("VAR = value\nall: $(VAR)\n\techo $@\n")
+        pymake.parser.setparsecache(self.cachedir)
+
+    def tearDown(self):
+        pymake.parser.setparsecache(None)
+        shutil.rmtree(self.tmpdir)
+
+    def test_reuse(self):
+        stmts = pymake.parser._parsefile(self.makefile)
+        cache = pymake.parser._diskcache
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+        cached = pymake.parser._parsefile(self.makefile)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(cached.to_source(), stmts.to_source())
+        self.assertEqual(cached.mtime, stmts.mtime)
+
+    def test_modified(self):
+        pymake.parser._parsefile(self.makefile)
+        with open(self.makefile, 'a') as fd:
+            fd.write("other:\n")
+
+        stmts = pymake.parser._parsefile(self.makefile)
+        self.assertEqual(pymake.parser._diskcache.misses, 2)
+        self.assertTrue('other' in stmts.to_source())
+
+    def test_evict(self):
+        pymake.parser.setparsecache(self.cachedir, maxbytes=0)
+        pymake.parser._parsefile(self.makefile)
+        self.assertEqual(os.listdir(self.cachedir), [])
+
+class IncludePrefetchTest(TestBase):
+    def setUp(self):
+        self.tmpdir = os.path.realpath(tempfile.mkdtemp())
+        for name, value in (('a', 'A'), ('b', 'B')):
+            with open(os.path.join(self.tmpdir, name + '.mk'), 'w') as fd:
+                fd.write("%s = yes\n" % value)
+        pymake.parser.setprefetcher(2)
+        self.prefetcher = pymake.parser._prefetcher
+
+    def tearDown(self):
+        self.prefetcher.close()
+        pymake.parser.setprefetcher(0)
+        shutil.rmtree(self.tmpdir)
+
+    def prefetch(self):
+        m = pymake.data.Makefile(workdir=self.tmpdir)
+        stmts = pymake.parser.parsestring("VAR := b\ninclude a.mk $(VAR).mk\n", 'IncludePrefetchTest')
+        pymake.parser.prefetchincludes(stmts, m)
+        self.assertEqual(self.prefetcher.submitted, 2)
+        futures.wait(list(self.prefetcher._pending.values()))
+        return m, stmts
+
+    def test_hit(self):
+        m, stmts = self.prefetch()
+        stmts.execute(m)
+        self.assertEqual(self.prefetcher.hits, 2)
+        self.assertEqual(m.variables.get('A')[2], 'yes')
+        self.assertEqual(m.variables.get('B')[2], 'yes')
+
+    def test_modified(self):
+        m, stmts = self.prefetch()
+        path = os.path.join(self.tmpdir, 'a.mk')
+        with open(path, 'w') as fd:
+            fd.write("A = changed\n")
+        mtime = os.path.getmtime(path) + 10
+        os.utime(path, (mtime, mtime))
+
+        stmts.execute(m)
+        self.assertEqual(self.prefetcher.hits, 1)
+        self.assertEqual(m.variables.get('A')[2], 'changed')
+
+    def test_replace(self):
+        self.prefetch()
+        pymake.parser.setprefetcher(3)
+        self.assertIsNot(pymake.parser._prefetcher, self.prefetcher)
+        self.assertEqual(self.prefetcher._pending, {})
+        self.assertIsNone(self.prefetcher._executor)
+
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG)
     unittest.main()
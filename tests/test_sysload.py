@@ -0,0 +1,92 @@
+import optparse, os, shutil, tempfile
+import unittest
+
+import pymake.command, pymake.sysload
+
+class CPUTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.saved = (pymake.sysload._cgroupv2cpu, pymake.sysload._cgroupv1quota, pymake.sysload._cgroupv1period)
+        pymake.sysload._cgroupv2cpu = os.path.join(self.dir, 'cpu.max')
+        pymake.sysload._cgroupv1quota = os.path.join(self.dir, 'cpu.cfs_quota_us')
+        pymake.sysload._cgroupv1period = os.path.join(self.dir, 'cpu.cfs_period_us')
+
+    def tearDown(self):
+        pymake.sysload._cgroupv2cpu, pymake.sysload._cgroupv1quota, pymake.sysload._cgroupv1period = self.saved
+        shutil.rmtree(self.dir)
+
+    def write(self, path, s):
+        with open(path, 'w') as fd:
+            fd.write(s)
+
+    def test_noquota(self):
+        self.assertEqual(pymake.sysload.cgroupcpus(), None)
+        self.write(pymake.sysload._cgroupv2cpu, 'max 100000\n')
+        self.assertEqual(pymake.sysload.cgroupcpus(), None)
+
+    def test_cgroupv2(self):
+        self.write(pymake.sysload._cgroupv2cpu, '250000 100000\n')
+        self.assertEqual(pymake.sysload.cgroupcpus(), 3)
+        self.assertTrue(1 <= pymake.sysload.usablecpus() <= 3)
+
+    def test_cgroupv1(self):
+        self.write(pymake.sysload._cgroupv1quota, '50000\n')
+        self.write(pymake.sysload._cgroupv1period, '100000\n')
+        self.assertEqual(pymake.sysload.cgroupcpus(), 1)
+        self.write(pymake.sysload._cgroupv1quota, '-1\n')
+        self.assertEqual(pymake.sysload.cgroupcpus(), None)
+
+    def test_optionaljobs(self):
+        op = optparse.OptionParser()
+        op.add_option('-k', action="store_true")
+        op.add_option('-s', action="store_true")
+        op.add_option('-C')
+        op.add_option('-j', '--jobs', type="int")
+
+        self.assertEqual(pymake.command._optionaljobs(['-j'], op), ['-j0'])
+        self.assertEqual(pymake.command._optionaljobs(['-j', 'all'], op), ['-j0', 'all'])
+        self.assertEqual(pymake.command._optionaljobs(['-j', '4', '--jobs'], op), ['-j', '4', '-j0'])
+
+        # -j at the end of a group of short options
+        self.assertEqual(pymake.command._optionaljobs(['-kj', 'all'], op), ['-kj0', 'all'])
+        self.assertEqual(pymake.command._optionaljobs(['-skj'], op), ['-skj0'])
+        self.assertEqual(pymake.command._optionaljobs(['-kj', '4'], op), ['-kj', '4'])
+        self.assertEqual(pymake.command._optionaljobs(['-kj4'], op), ['-kj4'])
+        # the j is the value of -C
+        self.assertEqual(pymake.command._optionaljobs(['-Cj', 'all'], op), ['-Cj', 'all'])
+
+        options, args = op.parse_args(pymake.command._optionaljobs(['-kj', 'all'], op))
+        self.assertEqual((options.k, options.jobs, args), (True, 0, ['all']))
+
+class LoadThrottleTest(unittest.TestCase):
+    def throttle(self, maxload, adaptive, load, pressure=None):
+        t = pymake.sysload.LoadThrottle(maxload, adaptive)
+        t._sample = lambda: None
+        t._load = load
+        t._pressure = pressure
+        return t
+
+    def test_maxload(self):
+        t = self.throttle(4.0, False, 5.0)
+        self.assertTrue(t.allows(0, 8))
+        self.assertFalse(t.allows(1, 8))
+        t._load = 3.5
+        self.assertTrue(t.allows(7, 8))
+
+    def test_adaptive(self):
+        # two of the load's six are other processes, which leaves six jobs
+        t = self.throttle(None, True, 6.0)
+        self.assertTrue(t.allows(4, 8))
+        t._load = 9.0
+        self.assertFalse(t.allows(5, 8))
+        # never below one job
+        t._load = 100.0
+        self.assertTrue(t.allows(0, 8))
+        self.assertFalse(t.allows(1, 8))
+
+    def test_memorypressure(self):
+        t = self.throttle(None, True, 0.0, 25.0)
+        self.assertTrue(t.allows(0, 8))
+        self.assertFalse(t.allows(1, 8))
+        t._pressure = 0.5
+        self.assertTrue(t.allows(1, 8))
@@ -0,0 +1,15 @@
+#T environment: {'MAKEFLAGS': '--trust-stat-cache'}
+# Submakes run in the same process stat() files again, even when the stat
+# cache is trusted, since the commands run before them may have changed any
+# file.
+
+all:
+	touch trust-submake.in
+	$(MAKE) -f $(TESTPATH)/trust-stat-cache-submake.mk trust-submake.out
+	touch -t 200001010000 trust-submake.out
+	$(MAKE) -f $(TESTPATH)/trust-stat-cache-submake.mk trust-submake.out
+	test trust-submake.out -nt trust-submake.in
+	@echo TEST-PASS
+
+trust-submake.out: trust-submake.in
+	touch $@
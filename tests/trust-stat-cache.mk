@@ -0,0 +1,16 @@
+#T environment: {'MAKEFLAGS': '--trust-stat-cache'}
+# Targets remade during the run are stat()ed again even when the stat cache
+# is trusted.
+
+$(shell touch -t 200001010000 trust-stat-old.in)
+
+all: trust-stat-2.out
+	test -f trust-stat-1.out
+	@echo TEST-PASS
+
+trust-stat-1.out: trust-stat-old.in
+	touch $@
+
+trust-stat-2.out: trust-stat-1.out
+	test -f $<
+	touch $@
@@ -0,0 +1,15 @@
+# $(wildcard) must see files created by $(shell) and by remade targets,
+# even after the directory was listed.
+
+BEFORE := $(wildcard wildcard-cache-*)
+$(shell touch wildcard-cache-1.in)
+INPUTS := $(wildcard wildcard-cache-*)
+
+all: wildcard-cache-1.out
+	test "$(BEFORE)" = ""
+	test "$(INPUTS)" = "wildcard-cache-1.in"
+	test "$(wildcard wildcard-cache-*)" = "wildcard-cache-1.in wildcard-cache-1.out"
+	@echo TEST-PASS
+
+wildcard-cache-1.out:
+	touch $@